@@ -1,378 +1,933 @@
-from flask import Flask, request, jsonify, render_template, session, url_for, redirect, flash
-from flask_cors import CORS
-import sqlite3
-import bcrypt
-import re
-import os
-from datetime import datetime
-from dotenv import load_dotenv
-from backend.llama_utils import classify_email_tone, detect_spam, summarize_email, rewrite_email_tone
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.utils import formataddr
-from collections import Counter
-
-app = Flask(__name__)
-app.secret_key = 'your_super_secret_key_here'
-CORS(app, supports_credentials=True)
-
-load_dotenv()
-DATABASE = 'Sbox.db'
-
-# --- DATABASE INITIALIZATION AND HELPERS ---
-def init_db():
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY, email TEXT UNIQUE NOT NULL, password_hash TEXT NOT NULL,
-            is_active BOOLEAN DEFAULT 1, is_admin BOOLEAN DEFAULT 0
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS emails (
-            id INTEGER PRIMARY KEY, sender_id INTEGER NOT NULL, recipient_email TEXT NOT NULL,
-            subject TEXT, body TEXT, sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            opened_at TIMESTAMP NULL, is_spam BOOLEAN DEFAULT 0, tone TEXT, summary TEXT,
-            FOREIGN KEY (sender_id) REFERENCES users(id)
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS external_emails (
-            id INTEGER PRIMARY KEY, sender_id INTEGER NOT NULL, sender_name TEXT NOT NULL,
-            recipient_email TEXT NOT NULL, subject TEXT, body TEXT,
-            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, tone TEXT, is_spam BOOLEAN DEFAULT 0, summary TEXT,
-            FOREIGN KEY (sender_id) REFERENCES users(id)
-        )
-    ''')
-    admin_email = "admin@sbox.com"
-    admin_pass = bcrypt.hashpw("admin@123".encode(), bcrypt.gensalt()).decode()
-    c.execute('INSERT OR IGNORE INTO users (email, password_hash, is_admin) VALUES (?, ?, 1)', (admin_email, admin_pass))
-    conn.commit()
-    conn.close()
-
-init_db()
-
-def get_db():
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def hash_password(password):
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
-
-def verify_password(password, hashed):
-    return bcrypt.checkpw(password.encode(), hashed.encode())
-
-# --- USER AUTHENTICATION & CORE ROUTES ---
-@app.route('/')
-def index():
-    if 'user_id' in session:
-        return redirect(url_for('admin_dashboard' if session.get('is_admin') else 'sender_dashboard'))
-    return render_template('login.html')
-
-@app.route('/login', methods=['GET','POST'])
-def login():
-    if request.method == 'POST':
-        data = request.get_json(silent=True) or request.form
-        if not data or not data.get('email') or not data.get('password'):
-            return jsonify({"status": "fail", "message": "Missing or invalid data"}), 400
-        conn = get_db()
-        user = conn.execute('SELECT * FROM users WHERE email = ?', (data['email'],)).fetchone()
-        conn.close()
-        if user and verify_password(data['password'], user['password_hash']):
-            session['user_id'] = user['id']
-            session['is_admin'] = bool(user['is_admin'])
-            session['email'] = user['email']
-            return jsonify({'status': 'success', 'redirect': '/admin_dashboard' if user['is_admin'] else '/sender_dashboard'})
-        return jsonify({'status': 'fail', 'message': 'Invalid email or password'}), 401
-    return render_template('login.html')
-
-@app.route('/register', methods=['GET', 'POST'])
-def register():
-    if request.method == 'POST':
-        username = request.form.get('username')
-        email = f"{username}@sbox.com"
-        password = request.form.get('password')
-        if not username or not password: return jsonify({"status": "fail", "error": "All fields are required"}), 400
-        if not re.match(r"^[a-zA-Z0-9_.-]+$", username): return jsonify({"status": "fail", "error": "Invalid username"}), 400
-        if len(password) < 6: return jsonify({"status": "fail", "error": "Password must be at least 6 characters"}), 400
-        conn = get_db()
-        if conn.execute('SELECT id FROM users WHERE email = ?', (email,)).fetchone():
-            conn.close()
-            return jsonify({"status": "fail", "error": "Username already taken"}), 400
-        hashed_password = hash_password(password)
-        conn.execute('INSERT INTO users (email, password_hash) VALUES (?, ?)', (email, hashed_password))
-        conn.commit()
-        conn.close()
-        return jsonify({"status": "success", "message": "User registered successfully"})
-    return render_template('register.html')
-
-@app.route('/logout')
-def logout():
-    session.clear()
-    return redirect(url_for('index'))
-
-def send_external_email(to_email, subject, body, sbox_sender_name):
-    sender_email = os.getenv("SENDER_EMAIL")
-    sender_password = os.getenv("EMAIL_PASS")
-
-    if not sender_email or not sender_password:
-        print("Error: Missing SENDER_EMAIL or EMAIL_PASS in .env file.")
-        return False
-
-    msg = MIMEMultipart()
-    msg["From"] = formataddr((f"{sbox_sender_name} (via Sbox)", sender_email))
-    msg["To"] = to_email
-    msg["Subject"] = f"(Sbox: {sbox_sender_name}) {subject}"
-    msg.attach(MIMEText(body, "plain"))
-
-    try:
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
-            server.login(sender_email, sender_password)
-            server.sendmail(sender_email, to_email, msg.as_string())
-        return True
-    except Exception as e:
-        print("Error sending Gmail:", e)
-        return False
-
-# --- DASHBOARD ROUTES ---
-@app.route('/sender_dashboard')
-def sender_dashboard():
-    if 'user_id' not in session:
-        return redirect(url_for('index'))
-
-    user_id = session.get('user_id')
-    conn = get_db()
-
-    internal_sent = conn.execute("""
-        SELECT e.id, e.recipient_email, e.subject, e.body,
-               strftime('%Y-%m-%d %H:%M', e.sent_at) AS sent_at,
-               CASE WHEN e.opened_at IS NULL THEN NULL
-                    ELSE strftime('%Y-%m-%d %H:%M', e.opened_at)
-               END AS opened_at,
-               e.is_spam, e.tone, 'Internal' AS source
-        FROM emails e
-        WHERE e.sender_id = ?
-        ORDER BY e.sent_at DESC
-    """, (user_id,)).fetchall()
-
-    external_sent = conn.execute("""
-        SELECT ee.id, ee.recipient_email, ee.subject, ee.body,
-               strftime('%Y-%m-%d %H:%M', ee.sent_at) AS sent_at,
-               NULL AS opened_at,
-               ee.is_spam, ee.tone, 'External' AS source
-        FROM external_emails ee
-        WHERE ee.sender_id = ?
-        ORDER BY ee.sent_at DESC
-    """, (user_id,)).fetchall()
-
-    conn.close()
-
-    # Merge and sort all emails (internal + external)
-    emails = [dict(row) for row in internal_sent] + [dict(row) for row in external_sent]
-    emails.sort(key=lambda e: e["sent_at"], reverse=True)  # newest first
-
-    return render_template(
-        "sender_dashboard.html",
-        current_user=session.get("email"),
-        current_id=user_id,
-        emails=emails
-    )
-
-
-
-@app.route('/admin_dashboard')
-def admin_dashboard():
-    if not session.get('is_admin'): return redirect(url_for('index'))
-    conn = get_db()
-    users = conn.execute('SELECT id, email, is_active, is_admin FROM users ORDER BY email').fetchall()
-    internal_emails = [dict(row) for row in conn.execute('SELECT e.*, u.email as sender_email FROM emails e JOIN users u ON e.sender_id = u.id ORDER BY e.sent_at DESC').fetchall()]
-    external_emails = [dict(row) for row in conn.execute('SELECT ee.*, u.email as sender_email FROM external_emails ee JOIN users u ON ee.sender_id = u.id ORDER BY ee.sent_at DESC').fetchall()]
-    stats = {
-        "active_users": sum(1 for user in users if user['is_active']),
-        "total_emails": len(internal_emails) + len(external_emails),
-        "spam_emails": sum(1 for email in internal_emails if email['is_spam']) + sum(1 for email in external_emails if email['is_spam']),
-        "read_emails": sum(1 for email in internal_emails if email['opened_at'] is not None)
-    }
-    all_emails = internal_emails + external_emails
-    ALL_TONES = sorted(["polite", "urgent", "neutral", "formal", "angry", "friendly", "apologetic", "appreciative", "sarcastic", "confused", "demanding", "encouraging", "threatening", "dismissive"])
-    existing_tone_counts = Counter(email['tone'] for email in all_emails if email.get('tone'))
-    tone_data = {
-        'labels': [tone.capitalize() for tone in ALL_TONES],
-        'counts': [existing_tone_counts.get(tone, 0) for tone in ALL_TONES],
-        'keys': ALL_TONES
-    }
-    conn.close()
-    return render_template('admin_dashboard.html', users=users, stats=stats, internal_emails=internal_emails, external_emails=external_emails, tone_data=tone_data)
-
-@app.route('/received_emails')
-def received_emails():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
-    current_email = session.get('email')
-    current_id = session.get('user_id')  # Make sure this is set during login
-    
-    conn = get_db()
-    emails = conn.execute("""
-        SELECT 
-            e.id, e.subject, e.body, e.summary, 
-            strftime('%Y-%m-%d %H:%M', e.sent_at) AS sent_at, 
-            e.opened_at, e.tone, e.is_spam,
-            u.email AS sender_email
-        FROM emails e
-        JOIN users u ON e.sender_id = u.id
-        WHERE e.recipient_email = ?
-        ORDER BY e.sent_at DESC
-    """, (current_email,)).fetchall()
-    conn.close()
-    
-    return render_template('received_emails.html', 
-                         emails=emails, 
-                         current_user=current_email,
-                         current_id=current_id)  # Pass current_id to template
-
-# --- API AND ACTION ROUTES ---
-@app.route('/send', methods=['POST'])
-def send_email():
-    if 'user_id' not in session: return jsonify({'status': 'error', 'message': 'Not authenticated'}), 401
-    data = request.json
-    conn = get_db()
-    sender_email_db = conn.execute('SELECT email FROM users WHERE id = ?', (data['sender_id'],)).fetchone()
-    if not sender_email_db: return jsonify({'status': 'error', 'message': 'Sender not found'}), 404
-    sbox_sender_name = sender_email_db[0].split("@")[0]
-    recipient_user = conn.execute('SELECT id FROM users WHERE email = ?', (data['recipient'],)).fetchone()
-    
-    body_text = data['body']
-    tone = classify_email_tone(body_text)
-    is_spam = 1 if detect_spam(body_text) else 0
-    summary = summarize_email(body_text)
-
-    if recipient_user:
-        conn.execute("INSERT INTO emails (sender_id, recipient_email, subject, body, tone, sent_at, is_spam, summary) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",(data['sender_id'], data['recipient'], data['subject'], body_text, tone, datetime.now(), is_spam, summary))
-    else:
-        # NOTE: External sending via SMTP is commented out, assuming it might not be configured.
-        send_external_email(data['recipient'], data['subject'], data['body'], sbox_sender_name)
-        conn.execute("INSERT INTO external_emails (sender_id, sender_name, recipient_email, subject, body, tone, sent_at, is_spam, summary) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", (data['sender_id'], sbox_sender_name, data['recipient'], data['subject'], body_text, tone, datetime.now(), is_spam, summary))
-    
-    conn.commit()
-    conn.close()
-    return jsonify({'message': 'Email processed', 'is_spam': bool(is_spam)}), 200
-
-@app.route('/rewrite_tone', methods=['POST'])
-def rewrite_tone_route():
-    if 'user_id' not in session: return jsonify({'error': 'Not authenticated'}), 401
-    data = request.json
-    text = data.get('text')
-    tone = data.get('tone')
-    if not text or not tone: return jsonify({'error': 'Missing text or tone'}), 400
-    rewritten_text = rewrite_email_tone(text, tone)
-    return jsonify({'rewritten_text': rewritten_text})
-
-@app.route('/llama_generate_tone', methods=['POST'])
-def llama_generate_tone():
-    text = request.json.get('text', '')
-    result = classify_email_tone(text)
-    return jsonify({'tone': result})
-
-@app.route('/llama_generate_spam', methods=['POST'])
-def llama_generate_spam():
-    text = request.json.get('text', '')
-    result = detect_spam(text)
-    return jsonify({'spam': result})
-
-@app.route('/summarize_email', methods=["POST"])
-def summarize_email_route():
-    if 'user_id' not in session: return jsonify({'error': 'Not authenticated'}), 401
-    data = request.get_json()
-    email_id = data.get("email_id")
-    if not email_id: return jsonify({"error": "Missing email_id"}), 400
-    conn = get_db()
-    email = conn.execute("SELECT body, summary FROM emails WHERE id = ? AND recipient_email = ?", (email_id, session.get('email'))).fetchone()
-    conn.close()
-    if not email: return jsonify({"error": "Email not found or not authorized"}), 404
-    if email['summary']:
-        return jsonify({"summary": email['summary']})
-    else:
-        summary = summarize_email(email['body'])
-        return jsonify({"summary": summary})
-
-@app.route('/mark_email_read/<int:email_id>', methods=['POST'])
-def mark_email_read(email_id):
-    if 'user_id' not in session: return jsonify({'status': 'error', 'message': 'Not authenticated'}), 401
-    user_email = session.get('email')
-    conn = get_db()
-    conn.execute("UPDATE emails SET opened_at = ? WHERE id = ? AND recipient_email = ? AND opened_at IS NULL", (datetime.now(), email_id, user_email))
-    conn.commit()
-    email_info = conn.execute("SELECT tone, is_spam FROM emails WHERE id = ?", (email_id,)).fetchone()
-    conn.close()
-    return jsonify({
-        'status': 'success',
-        'tone': email_info['tone'] if email_info else None,
-        'is_spam': bool(email_info['is_spam']) if email_info else False
-    })
-
-@app.route("/admin/delete_email/<int:email_id>", methods=["DELETE"])
-def delete_email(email_id):
-    if 'user_id' not in session or not session.get('is_admin'):
-        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 401
-    
-    conn = get_db()
-    cur = conn.cursor()
-    try:
-        # Try deleting from internal emails
-        cur.execute("DELETE FROM emails WHERE id = ?", (email_id,))
-        internal_rows_deleted = cur.rowcount
-        
-        # Try deleting from external emails
-        cur.execute("DELETE FROM external_emails WHERE id = ?", (email_id,))
-        external_rows_deleted = cur.rowcount
-        
-        conn.commit()
-
-        if internal_rows_deleted > 0 or external_rows_deleted > 0:
-            return jsonify({'status': 'success', 'message': 'Email deleted successfully'})
-        else:
-            return jsonify({'status': 'error', 'message': 'Email not found'}), 404
-            
-    except Exception as e:
-        conn.rollback()
-        return jsonify({'status': 'error', 'message': str(e)}), 500
-    finally:
-        conn.close()
-
-@app.route('/admin/delete_user/<int:user_id>', methods=['DELETE'])
-def delete_user(user_id):
-    if not session.get('is_admin'):
-        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 403
-
-    conn = get_db()
-    cur = conn.cursor()
-    try:
-        # Prevent admin from deleting themselves
-        if user_id == session.get('user_id'):
-             return jsonify({'status': 'error', 'message': 'Admin cannot delete their own account'}), 400
-
-        # Delete associated emails first
-        cur.execute("DELETE FROM emails WHERE sender_id = ?", (user_id,))
-        cur.execute("DELETE FROM external_emails WHERE sender_id = ?", (user_id,))
-        
-        # Delete the user
-        cur.execute("DELETE FROM users WHERE id = ? AND is_admin = 0", (user_id,))
-        
-        if cur.rowcount == 0:
-            return jsonify({'status': 'error', 'message': 'User not found or is an admin'}), 404
-            
-        conn.commit()
-        return jsonify({'status': 'success', 'message': 'User and their emails have been deleted.'})
-    except Exception as e:
-        conn.rollback()
-        return jsonify({'status': 'error', 'message': str(e)}), 500
-    finally:
-        conn.close()
-
-        
-if __name__ == '__main__':
-    app.run(debug=True)S
+from flask import Flask, Response, request, jsonify, render_template, session, url_for, redirect, flash
+from flask_cors import CORS
+import sqlite3
+import re
+import os
+import math
+import time
+import threading
+from datetime import datetime
+from http.cookies import SimpleCookie, CookieError
+from itsdangerous import BadSignature
+from dotenv import load_dotenv
+from backend.llama_utils import (
+    TONES, classify_email_tone, detect_spam, rewrite_email_tone,
+    rewrite_email_tone_stream, get_stream_stats, llm_idle,
+    analyze_email, analyze_email_separately, get_analysis_stats, get_backend_stats, get_prefilter_stats,
+    llm_errors_in_thread, PREFILTER_ENABLED, rate_limiter as llm_rate_limiter
+)
+from backend.llm_cache import cache as llm_cache
+from backend.jobs import JobQueue, enqueue
+from backend import outbox
+from backend import summaries
+from backend.db import Database
+from backend.prefilter import prefilter
+from backend import mail_stats, search as mail_search
+from backend.mailbox import inbox_page, inbox_item, sent_page, admin_page, email_body, SOURCE_TABLES, PAGE_SIZE
+from backend.events import hub as event_hub, sse_format, parse_event_id
+from backend.event_server import EventServer
+from backend import metrics, preprocess, bulk
+from backend.log import get_logger
+from backend.auth import hasher as password_hasher, AuthBusy, PLACEHOLDER_HASH
+from backend.rate_limit import AttemptLimiter
+
+app = Flask(__name__)
+app.secret_key = 'your_super_secret_key_here'
+CORS(app, supports_credentials=True)
+
+load_dotenv()
+DATABASE = 'Sbox.db'
+# One structured LLM call per message; set to 0 to use the separate tone/spam/summary calls
+COMBINED_ANALYSIS = os.getenv("SBOX_COMBINED_ANALYSIS", "1") != "0"
+# Accept mail immediately and classify it in background workers; set to 0 to classify inside /send
+ASYNC_ENRICHMENT = os.getenv("SBOX_ASYNC_ENRICHMENT", "1") != "0"
+ENRICH_WORKERS = int(os.getenv("SBOX_ENRICH_WORKERS", "4"))
+# Bearer token required by /metrics; unset leaves it open (bind the app to a private interface)
+METRICS_TOKEN = os.getenv("SBOX_METRICS_TOKEN")
+# Checked before any password is hashed; 0 disables a limit
+LOGIN_IP_LIMIT = int(os.getenv("SBOX_LOGIN_IP_LIMIT", "30"))            # login/register attempts per minute per client IP
+LOGIN_ACCOUNT_LIMIT = int(os.getenv("SBOX_LOGIN_ACCOUNT_LIMIT", "10"))  # failed logins per 15 minutes per account
+# Serve /events from the asyncio event server on this port (no thread per open inbox); unset keeps the Flask route only
+EVENT_PORT = int(os.getenv("SBOX_EVENT_PORT", "0"))
+EVENT_HOST = os.getenv("SBOX_EVENT_HOST", "127.0.0.1")
+EVENTS_URL = os.getenv("SBOX_EVENTS_URL", "/events")  # where the pages open their stream
+EVENT_ORIGINS = [o.strip() for o in os.getenv("SBOX_EVENT_ORIGINS", "").split(",") if o.strip()]
+
+log = get_logger("app")
+
+# --- DATABASE INITIALIZATION AND HELPERS ---
+# Run once per deploy (`flask --app app migrate`), not on every worker start
+def init_db():
+    version = db.migrate()
+    conn = db.connect()
+    admin_email = "admin@sbox.com"
+    # Hashing costs ~0.25 s, so only do it when the admin row is actually missing
+    if not conn.execute('SELECT 1 FROM users WHERE email = ?', (admin_email,)).fetchone():
+        admin_pass = password_hasher.hash("admin@123")
+        conn.execute('INSERT OR IGNORE INTO users (email, password_hash, is_admin) VALUES (?, ?, 1)', (admin_email, admin_pass))
+        conn.commit()
+    conn.close()
+    return version
+
+db = Database(DATABASE)
+
+def get_db():
+    # Pooled connection: close() returns it to the pool with its statement cache intact
+    return db.connection()
+
+# --- LIVE UPDATES ---
+# Open inbox and sent pages subscribe to /events; these push the changed rows to them
+def publish_inbox_card(conn, email_id, event_type):
+    """Pushes the rendered inbox card to the recipient; returns the row (or None if gone)."""
+    row = inbox_item(conn, email_id)
+    if row and row['recipient_id']:
+        with app.app_context():
+            html = render_template('partials/inbox_items.html', emails=[row])
+        event_hub.publish(row['recipient_id'], event_type, {'id': email_id, 'subject': row['subject'],
+                                                             'sender_email': row['sender_email'], 'html': html})
+    return row
+
+# --- BACKGROUND ENRICHMENT ---
+ENRICHABLE_TABLES = ('emails', 'external_emails')
+
+def analyze(body_text):
+    return analyze_email(body_text) if COMBINED_ANALYSIS else analyze_email_separately(body_text)
+
+def enrich_email_job(payload):
+    table = payload['table']
+    if table not in ENRICHABLE_TABLES:
+        raise ValueError(f"Unknown email table: {table}")
+    conn = get_db()
+    try:
+        row = conn.execute(f"SELECT body FROM {table} WHERE id = ?", (payload['id'],)).fetchone()
+        if not row:
+            return  # deleted before it was classified
+        errors_before = llm_errors_in_thread()
+        analysis = analyze(row['body'] or '')
+        if llm_errors_in_thread() > errors_before:
+            raise RuntimeError("LLM request failed during enrichment")
+        conn.execute(f"UPDATE {table} SET tone = ?, is_spam = ?, summary = ?, label_source = ?, enrichment_status = 'done' WHERE id = ?",
+                     (analysis['tone'], 1 if analysis['is_spam'] else 0, analysis['summary'], analysis['label_source'], payload['id']))
+        conn.commit()
+        if table == 'emails':
+            row = publish_inbox_card(conn, payload['id'], 'enriched')
+            sender_id = row['sender_id'] if row else None
+        else:
+            row = conn.execute("SELECT sender_id FROM external_emails WHERE id = ?", (payload['id'],)).fetchone()
+            if not row:
+                return  # deleted while it was being classified
+            sender_id = row['sender_id']
+        event_hub.publish(sender_id, 'enriched', {'id': payload['id'], 'source': 'Internal' if table == 'emails' else 'External',
+                                                  'tone': analysis['tone'], 'is_spam': bool(analysis['is_spam'])})
+    finally:
+        conn.close()
+
+def enrich_email_failed(payload, error):
+    if payload.get('table') not in ENRICHABLE_TABLES:
+        return
+    conn = get_db()
+    try:
+        conn.execute(f"UPDATE {payload['table']} SET enrichment_status = 'failed' WHERE id = ?", (payload['id'],))
+        conn.commit()
+    finally:
+        conn.close()
+
+job_queue = JobQueue(DATABASE, workers=ENRICH_WORKERS, kinds=('enrich_email',), name="enrich")
+job_queue.register('enrich_email', enrich_email_job, on_dead=enrich_email_failed)
+
+# --- OUTBOUND DELIVERY ---
+# External mail is committed with a 'deliver_email' job; one worker per pooled SMTP session sends it
+def deliver_email_job(payload):
+    conn = get_db()
+    try:
+        row = conn.execute("SELECT sender_id, sender_name, recipient_email, subject, body, delivery_status FROM external_emails WHERE id = ?",
+                           (payload['id'],)).fetchone()
+        if not row or row['delivery_status'] == outbox.SENT:
+            return  # deleted, or already sent by an earlier attempt
+        try:
+            outbox.deliver(row['sender_name'], row['recipient_email'], row['subject'], row['body'])
+        except outbox.TransientDeliveryError as e:
+            conn.execute("UPDATE external_emails SET delivery_status = ?, delivery_error = ? WHERE id = ?",
+                         (outbox.RETRYING, str(e), payload['id']))
+            conn.commit()
+            event_hub.publish(row['sender_id'], 'delivery', {'id': payload['id'], 'delivery_status': outbox.RETRYING})
+            raise
+        conn.execute("UPDATE external_emails SET delivery_status = ?, delivered_at = ?, delivery_error = NULL WHERE id = ?",
+                     (outbox.SENT, datetime.now(), payload['id']))
+        conn.commit()
+        event_hub.publish(row['sender_id'], 'delivery', {'id': payload['id'], 'delivery_status': outbox.SENT})
+    finally:
+        conn.close()
+
+def deliver_email_failed(payload, error):
+    conn = get_db()
+    try:
+        conn.execute("UPDATE external_emails SET delivery_status = ?, delivery_error = ? WHERE id = ?",
+                     (outbox.FAILED, error, payload['id']))
+        conn.commit()
+        row = conn.execute("SELECT sender_id FROM external_emails WHERE id = ?", (payload['id'],)).fetchone()
+        if row:
+            event_hub.publish(row['sender_id'], 'delivery', {'id': payload['id'], 'delivery_status': outbox.FAILED})
+    finally:
+        conn.close()
+
+delivery_queue = JobQueue(DATABASE, workers=outbox.SMTP_POOL_SIZE, max_attempts=8, base_delay=30.0, max_delay=3600.0,
+                          kinds=('deliver_email',), name="delivery")
+delivery_queue.register('deliver_email', deliver_email_job, on_dead=deliver_email_failed)
+
+# --- SUMMARY PREFETCH ---
+# Optional: fill in missing summaries of unread mail while the LLM has spare quota and no enrichment is queued
+def llm_quota_idle():
+    return llm_idle() and not job_queue.status()['depth']['queued']
+
+summary_prefetcher = summaries.SummaryPrefetcher(get_db, is_idle=llm_quota_idle)
+
+def train_prefilter():
+    try:
+        result = prefilter.train_from_db(DATABASE, TONES)
+        log.info("prefilter trained: %s", result)
+    except sqlite3.Error as e:
+        log.error("prefilter training failed: %s", e)
+
+# Hashes run on backend/auth.py's bounded pool; these limiters turn floods away before they get there
+ip_limiter = AttemptLimiter(LOGIN_IP_LIMIT, 60)
+account_limiter = AttemptLimiter(LOGIN_ACCOUNT_LIMIT, 900)
+
+def too_many_attempts(wait):
+    return jsonify({'status': 'fail', 'message': 'Too many attempts, try again later'}), 429, {'Retry-After': str(math.ceil(wait))}
+
+def auth_busy(e):
+    return jsonify({'status': 'fail', 'message': str(e)}), 503, {'Retry-After': '1'}
+
+# --- METRICS & PROFILING ---
+# Every request is timed into sbox_http_request_seconds; SBOX_PROFILE adds a
+# Server-Timing breakdown (SQL, LLM, SMTP, bcrypt) and logs it
+for prefix, collect in (("llm_cache", llm_cache.stats), ("llm_backend", get_backend_stats),
+                        ("llm_rate_limit", llm_rate_limiter.stats), ("prefilter", get_prefilter_stats),
+                        ("enrich_queue", job_queue.status), ("delivery_queue", delivery_queue.status),
+                        ("outbox", outbox.stats), ("db_pool", db.stats), ("events", event_hub.stats),
+                        ("summaries", summaries.stats), ("preprocess", preprocess.stats), ("auth", password_hasher.stats),
+                        ("login_ip_limiter", ip_limiter.stats), ("login_account_limiter", account_limiter.stats)):
+    metrics.REGISTRY.register_stats(prefix, collect)
+
+@app.before_request
+def start_request_timer():
+    request.started_at = time.perf_counter()
+    if metrics.PROFILE_MODE == "1" or (metrics.PROFILE_MODE == "header" and request.headers.get("X-Sbox-Profile") == "1"):
+        metrics.start_profile()
+
+@app.after_request
+def record_request_time(response):
+    started = getattr(request, "started_at", None)
+    if started is not None:
+        # The rule pattern (/email_body/<source>/<int:email_id>) keeps label cardinality bounded
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.http_seconds.observe(time.perf_counter() - started, request.method, route, str(response.status_code))
+    profile = metrics.end_profile()
+    if profile is not None:
+        response.headers["Server-Timing"] = metrics.server_timing(profile)
+        log.info("profile %s %s", request.method, request.path,
+                 extra={"profile_ms": {k: round(v[0] * 1000, 2) for k, v in profile.items()},
+                        "calls": {k: v[1] for k, v in profile.items() if k != "total"}})
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return Response("Unauthorized\n", status=401, mimetype="text/plain")
+    return Response(metrics.REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+# --- USER AUTHENTICATION & CORE ROUTES ---
+@app.route('/')
+def index():
+    if 'user_id' in session:
+        return redirect(url_for('admin_dashboard' if session.get('is_admin') else 'sender_dashboard'))
+    return render_template('login.html')
+
+@app.route('/login', methods=['GET','POST'])
+def login():
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or request.form
+        if not data or not data.get('email') or not data.get('password'):
+            return jsonify({"status": "fail", "message": "Missing or invalid data"}), 400
+        wait = max(ip_limiter.check(request.remote_addr), account_limiter.check(data['email']))
+        if wait:
+            return too_many_attempts(wait)
+        ip_limiter.record(request.remote_addr)
+        conn = get_db()
+        user = conn.execute('SELECT * FROM users WHERE email = ?', (data['email'],)).fetchone()
+        conn.close()
+        try:
+            matches, new_hash = password_hasher.verify(data['password'], user['password_hash']) if user else (False, None)
+        except AuthBusy as e:
+            return auth_busy(e)
+        if new_hash:
+            # Stored at another SBOX_BCRYPT_ROUNDS cost; upgrade it now that the password is known
+            conn = get_db()
+            conn.execute('UPDATE users SET password_hash = ? WHERE id = ?', (new_hash, user['id']))
+            conn.commit()
+            conn.close()
+        if matches:
+            account_limiter.reset(data['email'])
+            session['user_id'] = user['id']
+            session['is_admin'] = bool(user['is_admin'])
+            session['email'] = user['email']
+            return jsonify({'status': 'success', 'redirect': '/admin_dashboard' if user['is_admin'] else '/sender_dashboard'})
+        account_limiter.record(data['email'])
+        return jsonify({'status': 'fail', 'message': 'Invalid email or password'}), 401
+    return render_template('login.html')
+
+@app.route('/register', methods=['GET', 'POST'])
+def register():
+    if request.method == 'POST':
+        username = request.form.get('username')
+        email = f"{username}@sbox.com"
+        password = request.form.get('password')
+        if not username or not password: return jsonify({"status": "fail", "error": "All fields are required"}), 400
+        if not re.match(r"^[a-zA-Z0-9_.-]+$", username): return jsonify({"status": "fail", "error": "Invalid username"}), 400
+        if len(password) < 6: return jsonify({"status": "fail", "error": "Password must be at least 6 characters"}), 400
+        wait = ip_limiter.check(request.remote_addr)
+        if wait:
+            return too_many_attempts(wait)
+        ip_limiter.record(request.remote_addr)
+        conn = get_db()
+        existing = conn.execute('SELECT password_hash FROM users WHERE email = ?', (email,)).fetchone()
+        conn.close()
+        if existing and existing['password_hash'] != PLACEHOLDER_HASH:
+            return jsonify({"status": "fail", "error": "Username already taken"}), 400
+        try:
+            hashed_password = password_hasher.hash(password)
+        except AuthBusy as e:
+            return auth_busy(e)
+        conn = get_db()
+        try:
+            if existing:
+                # Created by a mail import; the owner of the address takes it over, imported mail included
+                cur = conn.execute('UPDATE users SET password_hash = ?, is_active = 1 WHERE email = ? AND password_hash = ?',
+                                   (hashed_password, email, PLACEHOLDER_HASH))
+                if cur.rowcount == 0:
+                    return jsonify({"status": "fail", "error": "Username already taken"}), 400
+            else:
+                conn.execute('INSERT INTO users (email, password_hash) VALUES (?, ?)', (email, hashed_password))
+            conn.commit()
+        except sqlite3.IntegrityError:
+            # Taken by a concurrent registration while the password was being hashed
+            return jsonify({"status": "fail", "error": "Username already taken"}), 400
+        finally:
+            conn.close()
+        return jsonify({"status": "success", "message": "User registered successfully"})
+    return render_template('register.html')
+
+@app.route('/logout')
+def logout():
+    session.clear()
+    return redirect(url_for('index'))
+
+# --- DASHBOARD ROUTES ---
+# Lists render the first page; the templates fetch later pages from the /api/* routes below
+def page_args():
+    """(cursor, limit) from the query string."""
+    limit = min(max(request.args.get('limit', PAGE_SIZE, type=int), 1), 200)
+    return request.args.get('cursor'), limit
+
+@app.route('/sender_dashboard')
+def sender_dashboard():
+    if 'user_id' not in session:
+        return redirect(url_for('index'))
+
+    user_id = session.get('user_id')
+    conn = get_db()
+    emails, next_cursor = sent_page(conn, user_id)
+    conn.close()
+
+    return render_template(
+        "sender_dashboard.html",
+        current_user=session.get("email"),
+        current_id=user_id,
+        emails=emails,
+        next_cursor=next_cursor
+    )
+
+
+
+@app.route('/admin_dashboard')
+def admin_dashboard():
+    if not session.get('is_admin'): return redirect(url_for('index'))
+    conn = get_db()
+    users = conn.execute('SELECT id, email, is_active, is_admin FROM users ORDER BY email').fetchall()
+    internal_emails, internal_cursor = admin_page(conn, 'internal')
+    external_emails, external_cursor = admin_page(conn, 'external')
+    # Counters are maintained by triggers (backend/mail_stats.py); no scan of the email tables
+    totals = mail_stats.totals(conn)
+    internal, external = totals['internal'], totals['external']
+    stats = {
+        "active_users": sum(1 for user in users if user['is_active']),
+        "total_emails": internal['total'] + external['total'],
+        "spam_emails": internal['spam'] + external['spam'],
+        "read_emails": internal['opened'],
+        "internal_emails": internal['total'],
+        "external_emails": external['total']
+    }
+    ALL_TONES = sorted(TONES)
+    existing_tone_counts = mail_stats.tone_tally(conn, TONES)
+    tone_data = {
+        'labels': [tone.capitalize() for tone in ALL_TONES],
+        'counts': [existing_tone_counts.get(tone, 0) for tone in ALL_TONES],
+        'keys': ALL_TONES
+    }
+    conn.close()
+    return render_template('admin_dashboard.html', users=users, stats=stats, internal_emails=internal_emails, external_emails=external_emails,
+                           internal_cursor=internal_cursor, external_cursor=external_cursor, tone_data=tone_data)
+
+@app.route('/received_emails')
+def received_emails():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    
+    current_email = session.get('email')
+    current_id = session.get('user_id')  # Make sure this is set during login
+    
+    conn = get_db()
+    emails, next_cursor = inbox_page(conn, current_email)
+    conn.close()
+    
+    return render_template('received_emails.html', 
+                         emails=emails, 
+                         next_cursor=next_cursor,
+                         tones=sorted(TONES),
+                         current_user=current_email,
+                         current_id=current_id)  # Pass current_id to template
+
+@app.route('/api/inbox')
+def inbox_api():
+    if 'user_id' not in session: return jsonify({'error': 'Not authenticated'}), 401
+    cursor, limit = page_args()
+    conn = get_db()
+    try:
+        emails, next_cursor = inbox_page(conn, session.get('email'), cursor, limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        conn.close()
+    return jsonify({'emails': emails, 'next_cursor': next_cursor,
+                    'html': render_template('partials/inbox_items.html', emails=emails)})
+
+@app.route('/api/sent')
+def sent_api():
+    if 'user_id' not in session: return jsonify({'error': 'Not authenticated'}), 401
+    cursor, limit = page_args()
+    conn = get_db()
+    try:
+        emails, next_cursor = sent_page(conn, session.get('user_id'), cursor, limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        conn.close()
+    return jsonify({'emails': emails, 'next_cursor': next_cursor,
+                    'html': render_template('partials/sent_items.html', emails=emails)})
+
+@app.route('/api/admin/emails')
+def admin_emails_api():
+    if not session.get('is_admin'):
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 403
+    source = request.args.get('source', 'internal')
+    if source not in SOURCE_TABLES: return jsonify({'error': 'source must be internal or external'}), 400
+    cursor, limit = page_args()
+    conn = get_db()
+    try:
+        emails, next_cursor = admin_page(conn, source, cursor, limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        conn.close()
+    return jsonify({'emails': emails, 'next_cursor': next_cursor,
+                    'html': render_template('partials/admin_email_rows.html', emails=emails)})
+
+@app.route('/api/search')
+def search_api():
+    """Ranked full-text search: ?q=&box=inbox|sent|mine|all&tone=&spam=&from=YYYY-MM-DD&to=&cursor="""
+    if 'user_id' not in session: return jsonify({'error': 'Not authenticated'}), 401
+    box = request.args.get('box', 'all' if session.get('is_admin') else 'mine')
+    if box not in ('inbox', 'sent', 'mine', 'all') or (box == 'all' and not session.get('is_admin')):
+        return jsonify({'error': 'Invalid box'}), 400
+    tone = (request.args.get('tone') or '').lower() or None
+    if tone and tone not in TONES: return jsonify({'error': f'Unknown tone: {tone}'}), 400
+    spam = request.args.get('spam')
+    cursor, limit = page_args()
+    conn = get_db()
+    try:
+        if not mail_search.available(conn):
+            return jsonify({'error': 'Search index unavailable (SQLite without FTS5)'}), 501
+        filters = {
+            'tone': tone,
+            'spam': None if spam in (None, '') else spam.lower() in ('1', 'true', 'yes'),
+            'date_from': mail_search.parse_day(request.args.get('from'), 'from'),
+            'date_to': mail_search.parse_day(request.args.get('to'), 'to'),
+        }
+        emails, next_cursor = mail_search.search(conn, request.args.get('q', ''), box, session.get('user_id'),
+                                                 session.get('email'), filters, cursor, limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        conn.close()
+    partial = 'partials/admin_email_rows.html' if box == 'all' else 'partials/inbox_items.html'
+    return jsonify({'emails': emails, 'next_cursor': next_cursor, 'html': render_template(partial, emails=emails)})
+
+@app.route('/email_body/<source>/<int:email_id>')
+def email_body_route(source, email_id):
+    if 'user_id' not in session: return jsonify({'error': 'Not authenticated'}), 401
+    if source not in SOURCE_TABLES: return jsonify({'error': 'Unknown source'}), 404
+    conn = get_db()
+    body = email_body(conn, source, email_id, session.get('user_id'), session.get('email'), bool(session.get('is_admin')))
+    conn.close()
+    if body is None: return jsonify({"error": "Email not found or not authorized"}), 404
+    return jsonify({'id': email_id, 'body': body})
+
+# --- SERVER-SENT EVENTS ---
+EVENT_STREAM_SECONDS = 55     # the browser reconnects (with Last-Event-ID) when a stream ends
+EVENT_HEARTBEAT_SECONDS = 15  # keeps proxies from closing idle streams
+
+@app.route('/events')
+def event_stream():
+    if 'user_id' not in session: return jsonify({'status': 'error', 'message': 'Not authenticated'}), 401
+    user_id = session['user_id']
+    last_id = parse_event_id(request.headers.get('Last-Event-ID') or request.args.get('last_id'))
+
+    def stream(cursor):
+        yield "retry: 3000\n\n"
+        if cursor is None:
+            cursor = event_hub.last_id
+            yield sse_format(cursor, 'ready', {})
+        deadline = time.monotonic() + EVENT_STREAM_SECONDS
+        while time.monotonic() < deadline:
+            remaining = deadline - time.monotonic()
+            events, reset = event_hub.wait(user_id, cursor, min(EVENT_HEARTBEAT_SECONDS, remaining))
+            if reset:
+                cursor = event_hub.last_id
+                yield sse_format(cursor, 'reset', {})
+            elif not events:
+                yield ": keep-alive\n\n"
+            else:
+                for event in events:
+                    yield sse_format(*event)
+                cursor = events[-1].id
+
+    return Response(stream(last_id), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def session_user_id(cookie_header):
+    """The user id in a signed Flask session cookie, for the event server (None if absent or forged)."""
+    cookies = SimpleCookie()
+    try:
+        cookies.load(cookie_header)
+    except CookieError:
+        return None
+    morsel = cookies.get(app.config['SESSION_COOKIE_NAME'])
+    if morsel is None:
+        return None
+    serializer = app.session_interface.get_signing_serializer(app)
+    try:
+        data = serializer.loads(morsel.value, max_age=int(app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return None
+    return data.get('user_id')
+
+event_server = EventServer(event_hub, session_user_id, host=EVENT_HOST, port=EVENT_PORT, allowed_origins=EVENT_ORIGINS,
+                           stream_seconds=EVENT_STREAM_SECONDS, heartbeat_seconds=EVENT_HEARTBEAT_SECONDS)
+
+@app.context_processor
+def events_url():
+    return {'events_url': EVENTS_URL}
+
+@app.route('/api/events')
+def events_api():
+    """Long-poll fallback: waits up to `timeout` seconds for events after `last_id`."""
+    if 'user_id' not in session: return jsonify({'status': 'error', 'message': 'Not authenticated'}), 401
+    last_id = parse_event_id(request.args.get('last_id'))
+    if last_id is None:
+        return jsonify({'events': [], 'last_id': event_hub.last_id, 'reset': False})
+    timeout = min(max(request.args.get('timeout', 25, type=float), 0), EVENT_STREAM_SECONDS)
+    events, reset = event_hub.wait(session['user_id'], last_id, timeout)
+    return jsonify({
+        'events': [{'id': e.id, 'type': e.type, 'data': e.data} for e in events],
+        'last_id': events[-1].id if events else (event_hub.last_id if reset else last_id),
+        'reset': reset,
+    })
+
+# --- API AND ACTION ROUTES ---
+@app.route('/send', methods=['POST'])
+def send_email():
+    if 'user_id' not in session: return jsonify({'status': 'error', 'message': 'Not authenticated'}), 401
+    data = request.json
+    conn = get_db()
+    sender_email_db = conn.execute('SELECT email FROM users WHERE id = ?', (data['sender_id'],)).fetchone()
+    if not sender_email_db:
+        conn.close()
+        return jsonify({'status': 'error', 'message': 'Sender not found'}), 404
+    sbox_sender_name = sender_email_db[0].split("@")[0]
+    recipient_user = conn.execute('SELECT id FROM users WHERE email = ?', (data['recipient'],)).fetchone()
+    
+    body_text = data['body']
+    if ASYNC_ENRICHMENT:
+        tone, is_spam, summary, source, status = None, 0, None, None, 'pending'
+    else:
+        analysis = analyze(body_text)
+        tone, is_spam, summary, source, status = analysis['tone'], 1 if analysis['is_spam'] else 0, analysis['summary'], analysis['label_source'], 'done'
+
+    if recipient_user:
+        table = 'emails'
+        cur = conn.execute("INSERT INTO emails (sender_id, recipient_email, subject, body, tone, sent_at, is_spam, summary, label_source, enrichment_status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",(data['sender_id'], data['recipient'], data['subject'], body_text, tone, datetime.now(), is_spam, summary, source, status))
+    else:
+        # Delivered by the outbox workers; the job commits together with the row
+        table = 'external_emails'
+        cur = conn.execute("INSERT INTO external_emails (sender_id, sender_name, recipient_email, subject, body, tone, sent_at, is_spam, summary, label_source, enrichment_status, delivery_status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (data['sender_id'], sbox_sender_name, data['recipient'], data['subject'], body_text, tone, datetime.now(), is_spam, summary, source, status, outbox.QUEUED))
+        enqueue(conn, 'deliver_email', {'id': cur.lastrowid})
+    email_id = cur.lastrowid
+    if ASYNC_ENRICHMENT:
+        enqueue(conn, 'enrich_email', {'table': table, 'id': email_id})
+
+    conn.commit()
+    if table == 'emails':
+        publish_inbox_card(conn, email_id, 'new_message')
+    conn.close()
+    if table == 'external_emails':
+        delivery_queue.notify()
+    if ASYNC_ENRICHMENT:
+        job_queue.notify()
+        return jsonify({'message': 'Email accepted', 'email_id': email_id, 'status': 'pending', 'is_spam': None}), 200
+    return jsonify({'message': 'Email processed', 'email_id': email_id, 'status': 'done', 'is_spam': bool(is_spam)}), 200
+
+@app.route('/rewrite_tone', methods=['POST'])
+def rewrite_tone_route():
+    if 'user_id' not in session: return jsonify({'error': 'Not authenticated'}), 401
+    data = request.json
+    text = data.get('text')
+    tone = data.get('tone')
+    if not text or not tone: return jsonify({'error': 'Missing text or tone'}), 400
+    rewritten_text = rewrite_email_tone(text, tone)
+    return jsonify({'rewritten_text': rewritten_text})
+
+# Streaming variants: plain text sent chunk by chunk as the model generates it
+STREAM_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+@app.route('/rewrite_tone/stream', methods=['POST'])
+def rewrite_tone_stream_route():
+    if 'user_id' not in session: return jsonify({'error': 'Not authenticated'}), 401
+    data = request.json
+    text = data.get('text')
+    tone = data.get('tone')
+    if not text or not tone: return jsonify({'error': 'Missing text or tone'}), 400
+    return Response(rewrite_email_tone_stream(text, tone), mimetype='text/plain', headers=STREAM_HEADERS)
+
+@app.route('/llama_generate_tone', methods=['POST'])
+def llama_generate_tone():
+    text = request.json.get('text', '')
+    result = classify_email_tone(text)
+    return jsonify({'tone': result})
+
+@app.route('/llama_generate_spam', methods=['POST'])
+def llama_generate_spam():
+    text = request.json.get('text', '')
+    result = detect_spam(text)
+    return jsonify({'spam': result})
+
+def parse_email_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+@app.route('/summarize_email', methods=["POST"])
+def summarize_email_route():
+    if 'user_id' not in session: return jsonify({'error': 'Not authenticated'}), 401
+    # An int, so "5" and 5 share one generation (the single-flight key)
+    email_id = parse_email_id((request.get_json(silent=True) or {}).get("email_id"))
+    if not email_id: return jsonify({"error": "Missing email_id"}), 400
+    conn = get_db()
+    email = conn.execute("SELECT body, summary FROM emails WHERE id = ? AND recipient_email = ?", (email_id, session.get('email'))).fetchone()
+    conn.close()
+    if not email: return jsonify({"error": "Email not found or not authorized"}), 404
+    if email['summary']:
+        summaries.record_stored()
+        return jsonify({"summary": email['summary']})
+    # Written back, and generated once even if several requests for this email arrive together
+    return jsonify({"summary": summaries.summary_for(get_db, email_id, email['body'])})
+
+@app.route('/summarize_email/stream', methods=["POST"])
+def summarize_email_stream_route():
+    if 'user_id' not in session: return jsonify({'error': 'Not authenticated'}), 401
+    email_id = parse_email_id((request.get_json(silent=True) or {}).get("email_id"))
+    if not email_id: return jsonify({"error": "Missing email_id"}), 400
+    conn = get_db()
+    email = conn.execute("SELECT body, summary FROM emails WHERE id = ? AND recipient_email = ?", (email_id, session.get('email'))).fetchone()
+    conn.close()
+    if not email: return jsonify({"error": "Email not found or not authorized"}), 404
+    if email['summary']:
+        summaries.record_stored()
+        return Response([email['summary']], mimetype='text/plain', headers=STREAM_HEADERS)
+    return Response(summaries.stream_summary(get_db, email_id, email['body']), mimetype='text/plain', headers=STREAM_HEADERS)
+
+@app.route('/mark_email_read/<int:email_id>', methods=['POST'])
+def mark_email_read(email_id):
+    if 'user_id' not in session: return jsonify({'status': 'error', 'message': 'Not authenticated'}), 401
+    user_email = session.get('email')
+    conn = get_db()
+    opened_at = datetime.now()
+    newly_read = conn.execute("UPDATE emails SET opened_at = ? WHERE id = ? AND recipient_email = ? AND opened_at IS NULL", (opened_at, email_id, user_email)).rowcount
+    conn.commit()
+    email_info = conn.execute("SELECT sender_id, tone, is_spam, summary, enrichment_status FROM emails WHERE id = ? AND recipient_email = ?", (email_id, user_email)).fetchone()
+    conn.close()
+    if email_info:
+        summaries.record_open(bool(email_info['summary']))
+    if newly_read and email_info:
+        event_hub.publish(email_info['sender_id'], 'read', {'id': email_id, 'opened_at': opened_at.strftime('%Y-%m-%d %H:%M')})
+    return jsonify({
+        'status': 'success',
+        'tone': email_info['tone'] if email_info else None,
+        'is_spam': bool(email_info['is_spam']) if email_info else False,
+        'summary': email_info['summary'] if email_info else None,
+        'enrichment_status': email_info['enrichment_status'] if email_info else None
+    })
+
+@app.route('/admin/analysis_stats')
+def analysis_stats():
+    if not session.get('is_admin'):
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 403
+    return jsonify(get_analysis_stats())
+
+@app.route('/admin/queue_status')
+def queue_status():
+    if not session.get('is_admin'):
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 403
+    return jsonify({**job_queue.status(), 'db_pool': db.stats()})
+
+@app.route('/admin/delivery_status')
+def delivery_status():
+    if not session.get('is_admin'):
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 403
+    return jsonify({**outbox.stats(), 'queue': delivery_queue.status()})
+
+@app.route('/admin/events')
+def events_stats():
+    if not session.get('is_admin'):
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 403
+    return jsonify({**event_hub.stats(), 'event_server': event_server.stats() if EVENT_PORT else None})
+
+@app.route('/admin/stream_stats')
+def stream_stats():
+    if not session.get('is_admin'):
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 403
+    return jsonify(get_stream_stats())
+
+@app.route('/admin/summary_stats')
+def summary_stats():
+    if not session.get('is_admin'):
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 403
+    return jsonify(summaries.stats())
+
+@app.route('/admin/preprocess_stats')
+def preprocess_stats():
+    if not session.get('is_admin'):
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 403
+    return jsonify(preprocess.stats())
+
+@app.route('/admin/llm_backend')
+def llm_backend_stats():
+    if not session.get('is_admin'):
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 403
+    return jsonify(get_backend_stats())
+
+@app.route('/admin/prefilter', methods=['GET'])
+def prefilter_stats():
+    if not session.get('is_admin'):
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 403
+    return jsonify(get_prefilter_stats())
+
+@app.route('/admin/prefilter/retrain', methods=['POST'])
+def prefilter_retrain():
+    if not session.get('is_admin'):
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 403
+    result = prefilter.train_from_db(DATABASE, TONES)
+    return jsonify({'status': 'success', **result})
+
+@app.route('/admin/mail_stats', methods=['GET'])
+def mail_stats_view():
+    if not session.get('is_admin'):
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 403
+    days = request.args.get('days', 30, type=int)
+    conn = get_db()
+    try:
+        return jsonify({'totals': mail_stats.totals(conn), 'tones': mail_stats.tone_tally(conn, TONES),
+                        'daily': mail_stats.daily(conn, days)})
+    finally:
+        conn.close()
+
+@app.route('/admin/mail_stats/rebuild', methods=['POST'])
+def mail_stats_rebuild():
+    if not session.get('is_admin'):
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 403
+    conn = get_db()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        mail_stats.rebuild(conn)
+        conn.commit()
+        return jsonify({'status': 'success', 'totals': mail_stats.totals(conn)})
+    finally:
+        conn.close()
+
+@app.route('/admin/llm_cache', methods=['GET'])
+def llm_cache_stats():
+    if not session.get('is_admin'):
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 403
+    return jsonify(llm_cache.stats())
+
+@app.route('/admin/llm_cache/invalidate', methods=['POST'])
+def llm_cache_invalidate():
+    if not session.get('is_admin'):
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 403
+    data = request.get_json(silent=True) or {}
+    removed = llm_cache.invalidate(data.get('model'))
+    return jsonify({'status': 'success', 'removed': removed})
+
+@app.route("/admin/delete_email/<source>/<int:email_id>", methods=["DELETE"])
+@app.route("/admin/delete_email/<int:email_id>", methods=["DELETE"])
+def delete_email(email_id, source=None):
+    if 'user_id' not in session or not session.get('is_admin'):
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 401
+    # Both tables number their rows from 1, so an id alone can name two different emails
+    source = source or request.args.get('source')
+    conn = get_db()
+    try:
+        if source is None:
+            sources = [name for name, table in SOURCE_TABLES.items()
+                       if conn.execute(f"SELECT 1 FROM {table} WHERE id = ?", (email_id,)).fetchone()]
+            if len(sources) > 1:
+                return jsonify({'status': 'error', 'message': 'Ambiguous id: pass source=internal or external'}), 409
+            source = sources[0] if sources else 'internal'
+        if bulk.apply(conn, 'delete', source, ids=[email_id]):
+            return jsonify({'status': 'success', 'message': 'Email deleted successfully'})
+        return jsonify({'status': 'error', 'message': 'Email not found'}), 404
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+    finally:
+        conn.close()
+
+@app.route('/admin/bulk/<action>', methods=['POST'])
+def bulk_action(action):
+    """{"source": "internal"|"external", "ids": [...], "filter": {...}}; ids and filter are ANDed."""
+    if not session.get('is_admin'):
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 403
+    data = request.get_json(silent=True) or {}
+    source = data.get('source', 'internal')
+    conn = get_db()
+    try:
+        result = bulk.apply(conn, action, source, data.get('ids'), data.get('filter'))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    finally:
+        conn.close()
+    if action == 'mark_read':
+        publish_read_receipts(result)
+        result = len(result)
+    elif action == 'reclassify' and result:
+        job_queue.notify()
+    return jsonify({'status': 'success', 'action': action, 'source': source, 'affected': result})
+
+@app.route('/api/inbox/mark_read', methods=['POST'])
+def inbox_mark_read():
+    """Marks the listed ids, or with {"all": true} the whole inbox, as read."""
+    if 'user_id' not in session: return jsonify({'status': 'error', 'message': 'Not authenticated'}), 401
+    data = request.get_json(silent=True) or {}
+    ids = None if data.get('all') else data.get('ids')
+    if ids is None and not data.get('all'):
+        return jsonify({'status': 'error', 'message': 'Missing ids'}), 400
+    conn = get_db()
+    try:
+        # The recipient filter keeps this to the caller's own inbox
+        rows = bulk.apply(conn, 'mark_read', 'internal', ids, {'recipient': session.get('email')})
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    finally:
+        conn.close()
+    publish_read_receipts(rows)
+    return jsonify({'status': 'success', 'affected': len(rows)})
+
+def publish_read_receipts(rows):
+    opened_at = datetime.now().strftime('%Y-%m-%d %H:%M')
+    for email_id, sender_id in rows:
+        event_hub.publish(sender_id, 'read', {'id': email_id, 'opened_at': opened_at})
+
+@app.route('/admin/delete_user/<int:user_id>', methods=['DELETE'])
+def delete_user(user_id):
+    if not session.get('is_admin'):
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 403
+
+    conn = get_db()
+    cur = conn.cursor()
+    try:
+        # Prevent admin from deleting themselves
+        if user_id == session.get('user_id'):
+             return jsonify({'status': 'error', 'message': 'Admin cannot delete their own account'}), 400
+
+        # Delete associated emails first
+        cur.execute("DELETE FROM emails WHERE sender_id = ?", (user_id,))
+        cur.execute("DELETE FROM external_emails WHERE sender_id = ?", (user_id,))
+        
+        # Delete the user
+        cur.execute("DELETE FROM users WHERE id = ? AND is_admin = 0", (user_id,))
+        
+        if cur.rowcount == 0:
+            return jsonify({'status': 'error', 'message': 'User not found or is an admin'}), 404
+            
+        conn.commit()
+        return jsonify({'status': 'success', 'message': 'User and their emails have been deleted.'})
+    except Exception as e:
+        conn.rollback()
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+    finally:
+        conn.close()
+
+        
+# --- APPLICATION FACTORY ---
+# Importing this module only defines the app. create_app() checks the schema and
+# starts the background workers; WSGI servers load it through wsgi.py.
+_workers_started = False
+_start_lock = threading.Lock()
+
+def create_app(migrate=False, start_workers=True):
+    """
+    Returns the app with enrichment, delivery, pre-filter training and summary
+    prefetch running (once per process). migrate=True applies pending
+    migrations first; otherwise the schema must already be current.
+    """
+    global _workers_started
+    with _start_lock:
+        if migrate:
+            init_db()
+        else:
+            current = db.schema_version()
+            if current < db.latest_version:
+                raise RuntimeError(f"Database schema is at v{current}, expected v{db.latest_version}: run `flask --app app migrate`")
+        if start_workers and not _workers_started:
+            _workers_started = True
+            # Always started: bulk reclassify and mail_transfer.py --enrich queue
+            # enrich_email jobs even when /send classifies inline
+            job_queue.start()
+            delivery_queue.start()
+            if EVENT_PORT:
+                event_server.start()
+            if summaries.PREFETCH_ENABLED:
+                summary_prefetcher.start()
+            if PREFILTER_ENABLED:
+                threading.Thread(target=train_prefilter, name="prefilter-train", daemon=True).start()
+    return app
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Apply pending schema migrations and create the admin account."""
+    print(f"{DATABASE} schema at v{init_db()}")
+
+if __name__ == '__main__':
+    create_app(migrate=True).run(debug=True)
@@ -0,0 +1,104 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+from backend import metrics
+from backend.log import get_logger
+
+# ------------------------- #
+# Password Hashing
+# ------------------------- #
+# bcrypt is deliberately CPU-heavy (~0.25 s at cost 12 on one core). Hashes
+# run on a small dedicated pool so a burst of logins queues there instead of
+# taking every core from the mail routes; past AUTH_MAX_PENDING waiting
+# requests new ones are turned away with AuthBusy.
+
+BCRYPT_ROUNDS = min(max(int(os.getenv("SBOX_BCRYPT_ROUNDS", "12")), 4), 16)  # each +1 doubles the cost
+AUTH_WORKERS = int(os.getenv("SBOX_AUTH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+AUTH_MAX_PENDING = int(os.getenv("SBOX_AUTH_MAX_PENDING", str(AUTH_WORKERS * 8)))
+
+log = get_logger("auth")
+
+# Stored for accounts that mail_transfer.py creates for senders without one. It is
+# never a valid bcrypt hash, so nobody can log in until /register claims the address.
+PLACEHOLDER_HASH = '!'
+
+
+class AuthBusy(Exception):
+    """Too many password hashes are queued; answer 503 and let the client retry."""
+
+
+def hash_cost(hashed: str):
+    """The cost factor of a $2b$12$... hash, or None if it is not a bcrypt hash."""
+    try:
+        return int(hashed.split("$")[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:
+    def __init__(self, rounds=BCRYPT_ROUNDS, workers=AUTH_WORKERS, max_pending=AUTH_MAX_PENDING):
+        self.rounds = rounds
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="bcrypt")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self.workers, self.max_pending = workers, max_pending
+        self.counters = {"hashed": 0, "verified": 0, "failed": 0, "rehashed": 0, "busy": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _run(self, op, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            self._count("busy")
+            raise AuthBusy("Too many sign-in requests, try again shortly")
+        try:
+            # Timed from the request thread, so the histogram and profile include time queued for a worker
+            with metrics.timed(metrics.bcrypt_seconds, op, profile="bcrypt"):
+                return self._executor.submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def _hash(self, password):
+        return bcrypt.hashpw(password.encode(), bcrypt.gensalt(self.rounds)).decode()
+
+    def needs_rehash(self, hashed) -> bool:
+        return hash_cost(hashed) != self.rounds
+
+    def hash(self, password: str) -> str:
+        result = self._run("hash", self._hash, password)
+        self._count("hashed")
+        return result
+
+    def verify(self, password: str, hashed: str):
+        """
+        (matches, new_hash). new_hash is set when the password matched but was
+        stored at a different cost: the caller should save it, so a change of
+        SBOX_BCRYPT_ROUNDS reaches every account as users sign in.
+        """
+        def check():
+            try:
+                matches = bcrypt.checkpw(password.encode(), hashed.encode())
+            except ValueError:
+                matches = False  # not a bcrypt hash
+            if matches and self.needs_rehash(hashed):
+                return True, self._hash(password)
+            return matches, None
+
+        matches, new_hash = self._run("verify", check)
+        self._count("verified" if matches else "failed")
+        if new_hash:
+            self._count("rehashed")
+            log.info("rehashing password from cost %s to %s", hash_cost(hashed), self.rounds)
+        return matches, new_hash
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+        return {"rounds": self.rounds, "workers": self.workers, "max_pending": self.max_pending, **counters}
+
+
+hasher = PasswordHasher()
@@ -0,0 +1,137 @@
+import json
+import time
+from datetime import datetime
+
+from backend.jobs import QUEUED
+from backend.mailbox import SOURCE_TABLES
+from backend.search import parse_day, tone_condition, tone_param, day_from_condition, day_to_condition
+
+# ------------------------- #
+# Bulk Mail Operations
+# ------------------------- #
+# Each operation is one set-based statement over a selection of one email
+# table (plus one INSERT ... SELECT of jobs for reclassify), committed as a
+# single transaction. Triggers still keep the stats counters and the search
+# index in step, row by row, inside that transaction.
+
+ACTIONS = ('delete', 'mark_read', 'reclassify')
+MAX_IDS = 10000
+
+# Filter name -> condition on the email table; every value is bound as a parameter
+FILTERS = {
+    'sender_id': "sender_id = ?",
+    'recipient': "recipient_email = ?",
+    'tone': tone_condition('tone'),                  # stored labels can hold several tones
+    'spam': "is_spam = ?",
+    'status': "enrichment_status = ?",
+    'after': day_from_condition('sent_at'),
+    'before': day_to_condition('sent_at'),           # inclusive, like search's date range
+    'unread': "opened_at IS NULL",                   # internal mail only
+}
+
+
+def _filter_value(name, value):
+    if name == 'sender_id':
+        return int(value)
+    if name == 'tone':
+        return tone_param(value)
+    if name == 'spam':
+        return 1 if value in (True, 1, '1', 'true', 'yes') else 0
+    if name in ('after', 'before'):
+        return parse_day(value, name)
+    return str(value)
+
+
+def selection(source, ids=None, filters=None):
+    """
+    (table, where, params) for the rows of `source` matching every given id
+    and filter. Raises ValueError on an unknown source or filter, or when
+    nothing narrows the selection: a bulk delete of a whole table has to be
+    asked for explicitly with a filter.
+    """
+    table = SOURCE_TABLES.get(source)
+    if table is None:
+        raise ValueError("source must be internal or external")
+    if filters is not None and not isinstance(filters, dict):
+        raise ValueError("filter must be an object")
+    clauses, params = [], []
+    if ids is not None:
+        if not isinstance(ids, list) or len(ids) > MAX_IDS:
+            raise ValueError(f"ids must be a list of at most {MAX_IDS} ids")
+        try:
+            ids = [int(i) for i in ids]
+        except (TypeError, ValueError) as e:
+            raise ValueError("ids must be integers") from e
+        # One parameter however long the list, instead of a placeholder per id
+        clauses.append("id IN (SELECT value FROM json_each(?))")
+        params.append(json.dumps(ids))
+    for name, value in (filters or {}).items():
+        if name not in FILTERS:
+            raise ValueError(f"Unknown filter: {name}")
+        if name == 'unread':
+            if table != 'emails':
+                raise ValueError("External mail has no read state")
+            if value:
+                clauses.append(FILTERS[name])
+            continue
+        if value is None or value == '':
+            continue
+        try:
+            params.append(_filter_value(name, value))
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Invalid value for {name}: {e}") from e
+        clauses.append(FILTERS[name])
+    if not clauses:
+        raise ValueError("Select emails by ids or at least one filter")
+    return table, " AND ".join(clauses), params
+
+
+def delete(conn, table, where, params) -> int:
+    return conn.execute(f"DELETE FROM {table} WHERE {where}", params).rowcount
+
+
+def mark_read(conn, table, where, params, opened_at=None) -> list:
+    """Marks unread matches as read; returns (id, sender_id) of each so read receipts can be sent."""
+    if table != 'emails':
+        raise ValueError("External mail has no read state")
+    opened_at = opened_at or datetime.now()
+    return conn.execute(f"UPDATE emails SET opened_at = ? WHERE opened_at IS NULL AND {where} RETURNING id, sender_id",
+                        [opened_at, *params]).fetchall()
+
+
+def reclassify(conn, table, where, params) -> int:
+    """
+    Queues an enrich_email job per match and marks it pending. Rows already
+    pending have a job and are left alone. Unchanged text gets its cached
+    answer back; invalidate the LLM cache first after a model or prompt change.
+    """
+    where = f"({where}) AND enrichment_status IS NOT 'pending'"
+    now = time.time()
+    conn.execute(f'''
+        INSERT INTO jobs (kind, payload, status, run_after, created_at, updated_at)
+        SELECT 'enrich_email', json_object('table', ?, 'id', id), ?, ?, ?, ? FROM {table} WHERE {where}
+    ''', [table, QUEUED, now, now, now, *params])
+    return conn.execute(f"UPDATE {table} SET enrichment_status = 'pending' WHERE {where}", params).rowcount
+
+
+def apply(conn, action, source, ids=None, filters=None):
+    """
+    Runs one bulk action in its own transaction. Returns the number of rows
+    changed, or for mark_read the (id, sender_id) rows.
+    """
+    if action not in ACTIONS:
+        raise ValueError(f"Unknown action: {action}")
+    table, where, params = selection(source, ids, filters)
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        if action == 'delete':
+            result = delete(conn, table, where, params)
+        elif action == 'mark_read':
+            result = mark_read(conn, table, where, params)
+        else:
+            result = reclassify(conn, table, where, params)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return result
@@ -0,0 +1,304 @@
+import time
+import sqlite3
+import threading
+
+from backend import metrics
+from backend.log import get_logger
+from backend.jobs import init_jobs_table
+from backend.llm_cache import install as install_llm_cache, install_expiry_index as llm_cache_expiry_index
+from backend.mail_stats import install as install_mail_stats
+from backend.search import install as install_search
+
+# ------------------------- #
+# Connection Settings
+# ------------------------- #
+
+# Applied to every new connection; journal_mode=WAL is persistent and set once in migrate()
+CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous = NORMAL",    # safe with WAL, avoids an fsync per commit
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA cache_size = -20000",     # ~20 MB page cache per connection
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA mmap_size = 268435456",
+)
+STATEMENT_CACHE_SIZE = 256  # sqlite3 keeps this many prepared statements per connection
+
+log = get_logger("db")
+
+
+# ------------------------- #
+# Schema Migrations
+# ------------------------- #
+
+def _base_schema(c):
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY, email TEXT UNIQUE NOT NULL, password_hash TEXT NOT NULL,
+            is_active BOOLEAN DEFAULT 1, is_admin BOOLEAN DEFAULT 0
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS emails (
+            id INTEGER PRIMARY KEY, sender_id INTEGER NOT NULL, recipient_email TEXT NOT NULL,
+            subject TEXT, body TEXT, sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            opened_at TIMESTAMP NULL, is_spam BOOLEAN DEFAULT 0, tone TEXT, summary TEXT,
+            FOREIGN KEY (sender_id) REFERENCES users(id)
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS external_emails (
+            id INTEGER PRIMARY KEY, sender_id INTEGER NOT NULL, sender_name TEXT NOT NULL,
+            recipient_email TEXT NOT NULL, subject TEXT, body TEXT,
+            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, tone TEXT, is_spam BOOLEAN DEFAULT 0, summary TEXT,
+            FOREIGN KEY (sender_id) REFERENCES users(id)
+        )
+    ''')
+
+
+def _enrichment_status(c):
+    for table in ('emails', 'external_emails'):
+        columns = [row[1] for row in c.execute(f'PRAGMA table_info({table})')]
+        if 'enrichment_status' not in columns:
+            c.execute(f"ALTER TABLE {table} ADD COLUMN enrichment_status TEXT DEFAULT 'done'")
+
+
+def _mail_indexes(c):
+    # Match the inbox, sent-mail and admin list queries so they read in index order instead of sorting
+    c.execute('CREATE INDEX IF NOT EXISTS idx_emails_recipient_sent ON emails (recipient_email, sent_at DESC)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_emails_sender_sent ON emails (sender_id, sent_at DESC)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_emails_sent ON emails (sent_at DESC)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_external_sender_sent ON external_emails (sender_id, sent_at DESC)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_external_sent ON external_emails (sent_at DESC)')
+
+
+def _keyset_indexes(c):
+    # Ascending indexes scanned backwards yield (sent_at DESC, id DESC), the keyset page order,
+    # without the per-timestamp sort the DESC indexes needed to break ties on id
+    for name, table, columns in (
+        ('idx_emails_recipient_sent', 'emails', 'recipient_email, sent_at'),
+        ('idx_emails_sender_sent', 'emails', 'sender_id, sent_at'),
+        ('idx_emails_sent', 'emails', 'sent_at'),
+        ('idx_external_sender_sent', 'external_emails', 'sender_id, sent_at'),
+        ('idx_external_sent', 'external_emails', 'sent_at'),
+    ):
+        c.execute(f'DROP INDEX IF EXISTS {name}')
+        c.execute(f'CREATE INDEX {name} ON {table} ({columns})')
+
+
+def _delivery_status(c):
+    # Outbound delivery state of external mail; NULL for rows sent before the outbox existed
+    columns = [row[1] for row in c.execute('PRAGMA table_info(external_emails)')]
+    for name, decl in (('delivery_status', 'TEXT NULL'), ('delivered_at', 'TIMESTAMP NULL'), ('delivery_error', 'TEXT NULL')):
+        if name not in columns:
+            c.execute(f'ALTER TABLE external_emails ADD COLUMN {name} {decl}')
+
+
+def _summary_prefetch_index(c):
+    # Only unread mail without a summary is indexed, in the prefetcher's priority order
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_emails_unsummarized ON emails (is_spam, sent_at DESC)
+        WHERE opened_at IS NULL AND summary IS NULL
+    ''')
+
+
+def _backfill_checkpoints(c):
+    # Progress of backfill.py runs, one row per (run, table)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS backfill_checkpoints (
+            run_name TEXT NOT NULL, table_name TEXT NOT NULL, last_id INTEGER NOT NULL,
+            rows_done INTEGER NOT NULL DEFAULT 0, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (run_name, table_name)
+        )
+    ''')
+
+
+def _summary_prefetch_index_empty(c):
+    # An empty summary counts as missing too, as it does for the routes and the prefetcher
+    c.execute('DROP INDEX IF EXISTS idx_emails_unsummarized')
+    c.execute('''
+        CREATE INDEX idx_emails_unsummarized ON emails (is_spam, sent_at DESC)
+        WHERE opened_at IS NULL AND (summary IS NULL OR summary = '')
+    ''')
+
+
+def _label_source(c):
+    # Where tone/is_spam came from ('llm', 'prefilter', 'fallback'); NULL for rows labelled
+    # before it was recorded or imported from elsewhere. The pre-filter trains on 'llm' only.
+    for table in ('emails', 'external_emails'):
+        columns = [row[1] for row in c.execute(f'PRAGMA table_info({table})')]
+        if 'label_source' not in columns:
+            c.execute(f'ALTER TABLE {table} ADD COLUMN label_source TEXT NULL')
+
+
+# (version, description, function). Append only; every step must be safe on
+# databases created before versioning existed (user_version 0).
+# All schema changes go here and run before the app starts: DDL against a live
+# database leaves the other open connections with a stale schema, which the
+# FTS5 triggers do not survive (see PooledConnection.execute).
+MIGRATIONS = [
+    (1, "base schema", _base_schema),
+    (2, "enrichment status columns", _enrichment_status),
+    (3, "background job queue", init_jobs_table),
+    (4, "mail list indexes", _mail_indexes),
+    (5, "keyset pagination indexes", _keyset_indexes),
+    (6, "admin stats counters and triggers", install_mail_stats),
+    (7, "full-text search index", install_search),
+    (8, "external delivery status", _delivery_status),
+    (9, "unsummarized mail index", _summary_prefetch_index),
+    (10, "LLM result cache", install_llm_cache),
+    (11, "backfill checkpoints", _backfill_checkpoints),
+    (12, "label source columns", _label_source),
+    (13, "unsummarized mail index includes empty summaries", _summary_prefetch_index_empty),
+    (14, "LLM cache expiry index", llm_cache_expiry_index),
+]
+
+
+# ------------------------- #
+# Pooled Connections
+# ------------------------- #
+
+class PooledConnection:
+    """
+    Wraps a sqlite3 connection checked out of a Database pool.
+    close() hands it back (rolling back anything uncommitted) instead of closing it,
+    so its prepared-statement cache survives across requests.
+    execute() and executemany() are timed into sbox_sqlite_statement_seconds;
+    for SELECTs that covers planning and the first row, not later fetches.
+    """
+    # After another connection changes the schema, the first write here that
+    # fires the FTS5 search triggers fails with "no such table: <email table>"
+    # before changing anything; run again on the reloaded schema it works.
+    # execute() retries once. executemany() does not, since earlier rows of
+    # the batch may already be written.
+    STALE_SCHEMA_ERROR = "no such table"
+
+    def __init__(self, database, conn):
+        self._database = database
+        self._conn = conn
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise sqlite3.ProgrammingError("Cannot operate on a closed database.")
+        return getattr(self._conn, name)
+
+    def _timed(self, method, sql, params, retry=False):
+        if self._conn is None:
+            raise sqlite3.ProgrammingError("Cannot operate on a closed database.")
+        started = time.perf_counter()
+        try:
+            try:
+                return getattr(self._conn, method)(sql, params)
+            except sqlite3.OperationalError as e:
+                if not retry or not str(e).startswith(self.STALE_SCHEMA_ERROR):
+                    raise
+                log.warning("retrying statement after a schema change: %s", e,
+                            extra={"statement": metrics.statement_label(sql)})
+                return getattr(self._conn, method)(sql, params)
+        finally:
+            elapsed = time.perf_counter() - started
+            label = metrics.statement_label(sql)
+            metrics.sql_seconds.observe(elapsed, label)
+            metrics.profile_add(f"sql {label}", elapsed)
+
+    def execute(self, sql, params=()):
+        return self._timed("execute", sql, params, retry=True)
+
+    def executemany(self, sql, seq_of_params):
+        return self._timed("executemany", sql, seq_of_params)
+
+    def __enter__(self):
+        return self._conn.__enter__()
+
+    def __exit__(self, *exc):
+        return self._conn.__exit__(*exc)
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._database.release(conn)
+
+
+class Database:
+    def __init__(self, path, pool_size=8):
+        self.path = path
+        self.pool_size = pool_size
+        self._idle = []
+        self._lock = threading.Lock()
+        self.counters = {"opened": 0, "reused": 0, "discarded": 0}
+
+    def connect(self):
+        """A new, unpooled connection with the standard pragmas applied."""
+        conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE_SIZE)
+        conn.row_factory = sqlite3.Row
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def connection(self) -> PooledConnection:
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+            self.counters["reused" if conn else "opened"] += 1
+        return PooledConnection(self, conn or self.connect())
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            return
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                return
+            self.counters["discarded"] += 1
+        conn.close()
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    @property
+    def latest_version(self) -> int:
+        return MIGRATIONS[-1][0]
+
+    def schema_version(self) -> int:
+        """PRAGMA user_version without creating the file; 0 for a missing database."""
+        try:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        except sqlite3.OperationalError:
+            return 0
+        try:
+            return conn.execute('PRAGMA user_version').fetchone()[0]
+        finally:
+            conn.close()
+
+    def migrate(self):
+        """Enables WAL and applies pending migrations; returns the schema version."""
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            conn.execute('PRAGMA journal_mode = WAL')
+            current = conn.execute('PRAGMA user_version').fetchone()[0]
+            for version, description, step in MIGRATIONS:
+                if version <= current:
+                    continue
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    step(conn)
+                    conn.execute(f'PRAGMA user_version = {version}')
+                    conn.execute('COMMIT')
+                except Exception:
+                    conn.execute('ROLLBACK')
+                    raise
+                log.info("migrated to v%d: %s", version, description, extra={"schema_version": version})
+                current = version
+            return current
+        finally:
+            conn.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"idle": len(self._idle), "pool_size": self.pool_size, **self.counters}
@@ -0,0 +1,161 @@
+import asyncio
+import threading
+from urllib.parse import parse_qs
+
+from backend.events import sse_format, parse_event_id
+from backend.log import get_logger
+
+# ------------------------- #
+# Async SSE Server
+# ------------------------- #
+# The Flask /events route holds a request thread for as long as a stream is
+# open, so a threaded server (gunicorn -k gthread --threads N) can keep at
+# most N inboxes live. This serves the same stream from one asyncio thread
+# inside the app process, next to the in-memory hub: an idle subscriber
+# costs a socket and a parked coroutine, not a thread. It runs on its own
+# port (SBOX_EVENT_PORT); route /events there from the reverse proxy, or
+# point the pages at it directly with SBOX_EVENTS_URL and allow the app's
+# origin with SBOX_EVENT_ORIGINS. Nothing is monkey-patched, so the bcrypt
+# executor, job workers and LLM thread stay real threads.
+
+log = get_logger("event_server")
+
+HEADER_TIMEOUT = 10.0
+MAX_HEADER_BYTES = 16384
+
+
+class EventServer:
+    """
+    Minimal HTTP/1.1 server for GET /events. `authenticate(cookie_header)`
+    returns the logged-in user id (or None); the stream is the one the Flask
+    route sends: retry, ready/reset, events and keep-alives, closed after
+    `stream_seconds` so the browser reconnects with Last-Event-ID.
+    """
+
+    def __init__(self, hub, authenticate, host="127.0.0.1", port=5001, allowed_origins=(),
+                 stream_seconds=55, heartbeat_seconds=15):
+        self.hub = hub
+        self.authenticate = authenticate
+        self.host = host
+        self.port = port
+        self.allowed_origins = set(allowed_origins)
+        self.stream_seconds = stream_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self._thread = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self.counters = {"streams": 0, "open_streams": 0, "rejected": 0}
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="event-server", daemon=True)
+            self._thread.start()
+            self._ready.wait(5)
+        return self
+
+    def _run(self):
+        try:
+            asyncio.run(self._serve())
+        except OSError as e:
+            log.error("event server could not listen on %s:%s: %s", self.host, self.port, e)
+        finally:
+            self._ready.set()
+
+    async def _serve(self):
+        server = await asyncio.start_server(self._handle, self.host, self.port, limit=MAX_HEADER_BYTES)
+        log.info("event server listening on %s:%s", self.host, self.port)
+        self._ready.set()
+        async with server:
+            await server.serve_forever()
+
+    def _count(self, name, delta=1):
+        with self._lock:
+            self.counters[name] += delta
+
+    async def _handle(self, reader, writer):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), HEADER_TIMEOUT)
+            lines = head.decode("latin-1").split("\r\n")
+            method, target, _ = lines[0].split(" ", 2)
+            headers = {}
+            for line in lines[1:]:
+                name, sep, value = line.partition(":")
+                if sep:
+                    headers[name.strip().lower()] = value.strip()
+            await self._respond(reader, writer, method, target, headers)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass  # slow, truncated or malformed request
+        except (ConnectionError, OSError):
+            pass  # client went away
+        finally:
+            writer.close()
+
+    def _cors_headers(self, headers):
+        origin = headers.get("origin")
+        if origin and origin in self.allowed_origins:
+            return f"Access-Control-Allow-Origin: {origin}\r\nAccess-Control-Allow-Credentials: true\r\nVary: Origin\r\n"
+        return ""
+
+    async def _reply(self, writer, status, headers, body=""):
+        writer.write((f"HTTP/1.1 {status}\r\nContent-Type: text/plain\r\nContent-Length: {len(body)}\r\n"
+                      f"{self._cors_headers(headers)}Connection: close\r\n\r\n{body}").encode())
+        await writer.drain()
+
+    async def _respond(self, reader, writer, method, target, headers):
+        path, _, query = target.partition("?")
+        if method != "GET" or path != "/events":
+            return await self._reply(writer, "404 Not Found", headers, "Not found")
+        user_id = self.authenticate(headers.get("cookie", ""))
+        if user_id is None:
+            self._count("rejected")
+            return await self._reply(writer, "401 Unauthorized", headers, "Not authenticated")
+        cursor = parse_event_id(headers.get("last-event-id") or parse_qs(query).get("last_id", [None])[0])
+        writer.write((f"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                      f"X-Accel-Buffering: no\r\n{self._cors_headers(headers)}Connection: close\r\n\r\n").encode())
+        self._count("streams")
+        self._count("open_streams")
+        try:
+            await self._stream(reader, writer, user_id, cursor)
+        finally:
+            self._count("open_streams", -1)
+
+    async def _stream(self, reader, writer, user_id, cursor):
+        loop = asyncio.get_running_loop()
+        wake = asyncio.Event()
+        listener = lambda: loop.call_soon_threadsafe(wake.set)
+        # A client sends nothing after its request, so any read completing means it hung up
+        closed = asyncio.ensure_future(reader.read(1))
+        self.hub.listen(user_id, listener)
+        try:
+            writer.write(b"retry: 3000\n\n")
+            if cursor is None:
+                cursor = self.hub.last_id
+                writer.write(sse_format(cursor, "ready", {}).encode())
+            deadline = loop.time() + self.stream_seconds
+            while loop.time() < deadline:
+                await writer.drain()
+                wake.clear()  # before reading, so a publish after the read still wakes us
+                events, reset = self.hub.wait(user_id, cursor, 0)
+                if reset:
+                    cursor = self.hub.last_id
+                    writer.write(sse_format(cursor, "reset", {}).encode())
+                elif events:
+                    writer.write("".join(sse_format(*event) for event in events).encode())
+                    cursor = events[-1].id
+                else:
+                    woken = asyncio.ensure_future(wake.wait())
+                    done, _ = await asyncio.wait({woken, closed}, timeout=min(self.heartbeat_seconds, deadline - loop.time()),
+                                                 return_when=asyncio.FIRST_COMPLETED)
+                    woken.cancel()
+                    if closed in done:
+                        return
+                    if not done:
+                        writer.write(b": keep-alive\n\n")
+            await writer.drain()
+        finally:
+            closed.cancel()
+            self.hub.unlisten(user_id, listener)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"host": self.host, "port": self.port, **self.counters}
@@ -0,0 +1,156 @@
+import json
+import time
+import threading
+from collections import deque, namedtuple
+
+# ------------------------- #
+# In-process Event Hub
+# ------------------------- #
+# send_email, mark_email_read and the background workers publish small events
+# to a per-user channel; /events (SSE) and /api/events (long-poll) wait on it,
+# so open inboxes update without re-running the inbox query.
+#
+# Waiting costs no thread of its own here: a subscriber blocks on its
+# channel's condition and is only woken by events for that user. The Flask
+# routes still hold a request thread per open stream, which caps open
+# inboxes at the server's thread count; backend/event_server.py serves the
+# same stream from one asyncio thread through listen() instead.
+
+Event = namedtuple("Event", "id type data")
+
+HISTORY_PER_USER = 100     # events kept per user for Last-Event-ID resume
+CHANNEL_IDLE_SECONDS = 600  # channels without waiters or new events are dropped after this
+
+
+class _Channel:
+    __slots__ = ("events", "cond", "floor", "waiters", "listeners", "touched")
+
+    def __init__(self, lock, floor, history):
+        self.events = deque(maxlen=history)
+        self.cond = threading.Condition(lock)
+        self.floor = floor  # ids <= floor may have been dropped from this channel
+        self.waiters = 0
+        self.listeners = set()
+        self.touched = time.monotonic()
+
+
+class EventHub:
+    """
+    Event ids increase across the whole hub (and across restarts, being seeded
+    from the clock), so a client's Last-Event-ID tells which events it missed.
+    When they are no longer buffered, wait() reports a reset and the client
+    reloads its first page instead.
+    """
+
+    def __init__(self, history=HISTORY_PER_USER, idle_seconds=CHANNEL_IDLE_SECONDS):
+        self.history = history
+        self.idle_seconds = idle_seconds
+        self._lock = threading.Lock()
+        self._channels = {}
+        self._last_id = int(time.time() * 1000)
+        self._last_sweep = time.monotonic()
+        self.counters = {"published": 0, "delivered": 0, "resets": 0}
+
+    def _channel(self, user_id):
+        channel = self._channels.get(user_id)
+        if channel is None:
+            channel = self._channels[user_id] = _Channel(self._lock, self._last_id, self.history)
+        return channel
+
+    def _sweep(self, now):
+        # Called with the lock held
+        if now - self._last_sweep < self.idle_seconds:
+            return
+        self._last_sweep = now
+        for user_id in [u for u, c in self._channels.items()
+                        if not c.waiters and not c.listeners and now - c.touched > self.idle_seconds]:
+            del self._channels[user_id]
+
+    @property
+    def last_id(self) -> int:
+        with self._lock:
+            return self._last_id
+
+    def publish(self, user_id, event_type, data=None):
+        if user_id is None:
+            return
+        with self._lock:
+            self._last_id += 1
+            channel = self._channel(user_id)
+            if len(channel.events) == channel.events.maxlen:
+                channel.floor = channel.events[0].id
+            channel.events.append(Event(self._last_id, event_type, data or {}))
+            channel.touched = time.monotonic()
+            self.counters["published"] += 1
+            channel.cond.notify_all()
+            for listener in channel.listeners:
+                listener()
+            self._sweep(channel.touched)
+
+    def listen(self, user_id, callback):
+        """
+        Calls `callback()` (with the hub's lock held, so it must only signal)
+        whenever an event is published for `user_id`; read them with
+        wait(user_id, last_id, 0).
+        """
+        with self._lock:
+            self._channel(user_id).listeners.add(callback)
+
+    def unlisten(self, user_id, callback):
+        with self._lock:
+            channel = self._channels.get(user_id)
+            if channel is not None:
+                channel.listeners.discard(callback)
+                channel.touched = time.monotonic()
+
+    def wait(self, user_id, last_id, timeout):
+        """
+        Events for `user_id` newer than `last_id`, blocking up to `timeout`
+        seconds for the first one. Returns (events, reset); reset means events
+        after last_id were lost (or last_id is from another process) and the
+        client should reload.
+        """
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            channel = self._channel(user_id)
+            channel.touched = time.monotonic()
+            if last_id < channel.floor or last_id > self._last_id:
+                self.counters["resets"] += 1
+                return [], True
+            channel.waiters += 1
+            try:
+                while True:
+                    events = [e for e in channel.events if e.id > last_id]
+                    remaining = deadline - time.monotonic()
+                    if events or remaining <= 0:
+                        break
+                    channel.cond.wait(remaining)
+            finally:
+                channel.waiters -= 1
+                channel.touched = time.monotonic()
+            self.counters["delivered"] += len(events)
+            return events, False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "channels": len(self._channels),
+                "subscribers": sum(c.waiters + len(c.listeners) for c in self._channels.values()),
+                "buffered_events": sum(len(c.events) for c in self._channels.values()),
+                "last_id": self._last_id,
+                **self.counters,
+            }
+
+
+def sse_format(event_id, event_type, data) -> str:
+    return f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data)}\n\n"
+
+
+def parse_event_id(value):
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return -1  # unknown id: resets the client
+
+
+hub = EventHub()
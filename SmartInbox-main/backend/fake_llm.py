@@ -0,0 +1,102 @@
+import json
+import time
+import random
+import hashlib
+import threading
+from types import SimpleNamespace
+
+# ------------------------- #
+# Offline Stand-in for the Groq Client
+# ------------------------- #
+
+FAKE_TONES = ["polite", "neutral", "formal", "friendly", "urgent", "appreciative"]
+
+
+class FakeRateLimitError(Exception):
+    """Looks enough like groq.RateLimitError for the retry logic in llama_utils."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Rate limit reached, retry after {retry_after}s")
+        self.status_code = 429
+        self.response = SimpleNamespace(headers={"retry-after": str(retry_after)})
+
+
+def _email_from_prompt(prompt: str) -> str:
+    for marker in ('"""', "Original Text:", "Email:"):
+        if marker in prompt:
+            return prompt.split(marker, 1)[1]
+    return prompt
+
+
+def fake_completion(prompt: str, max_tokens=64, json_mode=False) -> str:
+    """Deterministic answer for a prompt: the same email always gets the same verdict."""
+    text = _email_from_prompt(prompt)
+    digest = int(hashlib.sha256(text.encode("utf-8")).hexdigest(), 16)
+    tone = FAKE_TONES[digest % len(FAKE_TONES)]
+    spam = "yes" if ("prize" in text.lower() or "winner" in text.lower()) else "no"
+    words = text.split()
+    summary = " ".join(words[:12]).strip("\"' ") or "Empty email."
+
+    if json_mode:
+        return json.dumps({"tone": tone, "spam": spam, "summary": summary})
+    if "tone classifier" in prompt:
+        return tone
+    if "spam" in prompt and "'yes' or 'no'" in prompt:
+        return spam
+    if "summarizer" in prompt:
+        return summary
+    if "Rewrite" in prompt:
+        return " ".join(words).strip("\"")[: max_tokens * 4]
+    return summary
+
+
+class FakeGroqClient:
+    """
+    Mimics client.chat.completions.create() with configurable latency and an
+    optional simulated provider rate limit, so batch throughput can be
+    measured without network access.
+    """
+
+    def __init__(self, latency=0.05, jitter=0.0, requests_per_minute=0, retry_after=1.0, seed=0, token_latency=0.0):
+        self.latency = latency
+        self.token_latency = token_latency  # per streamed token, after `latency` to the first one
+        self.jitter = jitter
+        self.requests_per_minute = requests_per_minute
+        self.retry_after = retry_after
+        self.calls = 0
+        self.rate_limited = 0
+        self._window = []
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _check_rate_limit(self):
+        if not self.requests_per_minute:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._window = [t for t in self._window if t > now - 60]
+            if len(self._window) >= self.requests_per_minute:
+                self.rate_limited += 1
+                raise FakeRateLimitError(self.retry_after)
+            self._window.append(now)
+
+    def _create(self, model=None, messages=None, max_tokens=64, response_format=None, stream=False, **kwargs):
+        self._check_rate_limit()
+        with self._lock:
+            self.calls += 1
+            delay = self.latency + (self._random.random() * self.jitter if self.jitter else 0.0)
+        prompt = messages[-1]["content"]
+        content = fake_completion(prompt, max_tokens, json_mode=bool(response_format))
+        if stream:
+            return self._stream(content, delay)
+        time.sleep(delay + self.token_latency * len(content.split()))
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+    def _stream(self, content, delay):
+        time.sleep(delay)
+        for i, word in enumerate(content.split(" ")):
+            if i:
+                time.sleep(self.token_latency)
+            delta = SimpleNamespace(content=word if i == 0 else " " + word)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
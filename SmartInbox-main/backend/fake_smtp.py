@@ -0,0 +1,129 @@
+import time
+import threading
+import socketserver
+
+# ------------------------- #
+# Local SMTP Sink
+# ------------------------- #
+# A minimal SMTP server that accepts (and counts) everything, for delivery
+# benchmarks and offline development:
+#   SBOX_SMTP_HOST=127.0.0.1 SBOX_SMTP_PORT=8025 SBOX_SMTP_SSL=0
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        server = self.server.sink
+        # Stands in for the TCP + TLS handshake and login of a real relay
+        time.sleep(server.connect_latency)
+        server.record("connections")
+        self.reply("220 fake-smtp ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("utf-8", "replace").strip()
+            verb = command.split(" ", 1)[0].upper()
+            if verb == "EHLO":
+                self.wfile.write(b"250-fake-smtp\r\n250-PIPELINING\r\n250-8BITMIME\r\n250 AUTH PLAIN\r\n")
+            elif verb == "HELO":
+                self.reply("250 fake-smtp")
+            elif verb == "AUTH":
+                self.reply("235 2.7.0 Authentication successful")
+            elif verb == "MAIL" or verb == "RSET" or verb == "NOOP":
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                domain = command.rsplit("@", 1)[-1].rstrip(">").lower()
+                if domain in server.reject_domains:
+                    self.reply("550 5.1.1 No such user")
+                else:
+                    self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                size = 0
+                while True:
+                    data = self.rfile.readline()
+                    if not data or data in (b".\r\n", b".\n"):
+                        break
+                    size += len(data)
+                time.sleep(server.message_latency)
+                if server.take_transient_failure():
+                    self.reply("451 4.3.0 Try again later")
+                else:
+                    server.record("messages", size)
+                    self.reply("250 2.0.0 Queued")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+class _ThreadingServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeSMTPServer:
+    """
+    Runs in a background thread; port 0 picks a free port (see .port).
+    connect_latency simulates the per-connection handshake cost that pooling
+    saves, transient_failures makes the next N messages fail with a 451 and
+    reject_domains makes RCPT TO fail with a permanent 550.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, connect_latency=0.0, message_latency=0.0,
+                 transient_failures=0, reject_domains=()):
+        self.connect_latency = connect_latency
+        self.message_latency = message_latency
+        self.transient_failures = transient_failures
+        self.reject_domains = {d.lower() for d in reject_domains}
+        self._lock = threading.Lock()
+        self.counters = {"connections": 0, "messages": 0, "bytes": 0}
+        self._server = _ThreadingServer((host, port), _SMTPHandler)
+        self._server.sink = self
+        self.host, self.port = self._server.server_address[:2]
+        self._thread = None
+
+    def record(self, name, size=0):
+        with self._lock:
+            self.counters[name] += 1
+            self.counters["bytes"] += size
+
+    def take_transient_failure(self) -> bool:
+        with self._lock:
+            if self.transient_failures > 0:
+                self.transient_failures -= 1
+                return True
+            return False
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-smtp", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counters)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Run a local SMTP sink that accepts every message.")
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--connect-latency", type=float, default=0.0)
+    args = parser.parse_args()
+    sink = FakeSMTPServer(port=args.port, connect_latency=args.connect_latency).start()
+    print(f"fake SMTP listening on {sink.host}:{sink.port}")
+    try:
+        while True:
+            time.sleep(10)
+            print(sink.stats())
+    except KeyboardInterrupt:
+        sink.stop()
@@ -0,0 +1,234 @@
+import json
+import time
+import sqlite3
+import threading
+from collections import deque
+
+from backend import metrics
+from backend.log import get_logger
+
+# ------------------------- #
+# Durable SQLite Job Queue
+# ------------------------- #
+
+QUEUED, RUNNING, DONE, DEAD = "queued", "running", "done", "dead"
+
+log = get_logger("jobs")
+
+
+class PermanentJobError(Exception):
+    """Raised by a handler when retrying cannot help; the job goes straight to 'dead'."""
+
+
+def init_jobs_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY, kind TEXT NOT NULL, payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued', attempts INTEGER NOT NULL DEFAULT 0,
+            run_after REAL NOT NULL, locked_at REAL NULL, last_error TEXT NULL,
+            created_at REAL NOT NULL, updated_at REAL NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status_run_after ON jobs (status, run_after)')
+
+
+def enqueue(conn, kind: str, payload: dict, delay: float = 0.0) -> int:
+    """
+    Adds a job using the caller's connection, so it commits (or rolls back)
+    together with the row it refers to.
+    """
+    now = time.time()
+    cur = conn.execute(
+        'INSERT INTO jobs (kind, payload, status, run_after, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+        (kind, json.dumps(payload), QUEUED, now + delay, now, now)
+    )
+    return cur.lastrowid
+
+
+class JobQueue:
+    """
+    Drains the jobs table with a bounded pool of daemon threads.
+    Failed jobs are retried with exponential backoff and moved to the 'dead'
+    state once max_attempts is reached. `kinds` limits a queue to some job
+    kinds, so independent pools (enrichment, delivery) can share the table.
+    """
+
+    def __init__(self, db_path, workers=4, max_attempts=5, base_delay=2.0, max_delay=300.0,
+                 lease_seconds=300.0, poll_interval=1.0, retention_seconds=86400.0, kinds=None, name="job"):
+        self.db_path = db_path
+        self.workers = workers
+        self.kinds = tuple(kinds) if kinds else None
+        self.name = name
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.retention_seconds = retention_seconds
+        self._last_purge = 0.0
+        self._handlers = {}
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._completed = deque(maxlen=1000)  # (finished_at, seconds) of recent successful jobs
+        self.counters = {"succeeded": 0, "retried": 0, "dead": 0}
+
+    def register(self, kind, handler, on_dead=None):
+        """handler(payload) does the work; on_dead(payload, error) runs once retries are exhausted."""
+        self._handlers[kind] = (handler, on_dead)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def notify(self):
+        self._wakeup.set()
+
+    def start(self):
+        if self._threads:
+            return
+        self._stop.clear()
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"{self.name}-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        self._wakeup.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def _kind_filter(self):
+        if not self.kinds:
+            return "", ()
+        return f" AND kind IN ({', '.join('?' * len(self.kinds))})", self.kinds
+
+    def _claim(self, conn):
+        now = time.time()
+        kind_sql, kind_params = self._kind_filter()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Jobs left 'running' past their lease belong to a worker that died
+            row = conn.execute(f'''
+                SELECT id, kind, payload, attempts FROM jobs
+                WHERE ((status = ? AND run_after <= ?) OR (status = ? AND locked_at < ?)){kind_sql}
+                ORDER BY run_after, id LIMIT 1
+            ''', (QUEUED, now, RUNNING, now - self.lease_seconds, *kind_params)).fetchone()
+            if row:
+                conn.execute(
+                    'UPDATE jobs SET status = ?, attempts = attempts + 1, locked_at = ?, updated_at = ? WHERE id = ?',
+                    (RUNNING, now, now, row['id'])
+                )
+            conn.execute('COMMIT')
+            return row
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _finish(self, conn, job_id, status, error=None, run_after=None):
+        now = time.time()
+        conn.execute(
+            'UPDATE jobs SET status = ?, last_error = ?, run_after = COALESCE(?, run_after), locked_at = NULL, updated_at = ? WHERE id = ?',
+            (status, error, run_after, now, job_id)
+        )
+
+    def _purge_finished(self, conn):
+        # Completed jobs are only kept around for the status report
+        now = time.time()
+        with self._lock:
+            if now - self._last_purge < 60:
+                return
+            self._last_purge = now
+        try:
+            conn.execute('DELETE FROM jobs WHERE status = ? AND updated_at < ?', (DONE, now - self.retention_seconds))
+        except sqlite3.Error as e:
+            log.error("purge failed: %s", e, extra={"queue": self.name})
+
+    def _run(self):
+        conn = self._connect()
+        try:
+            while not self._stop.is_set():
+                try:
+                    job = self._claim(conn)
+                    if job is None:
+                        self._purge_finished(conn)
+                        self._wakeup.wait(self.poll_interval)
+                        self._wakeup.clear()
+                        continue
+                    self._execute(conn, job)
+                except sqlite3.Error as e:
+                    # e.g. 'database is locked' in _claim or _finish: keep the worker alive. A job
+                    # whose result could not be recorded stays 'running' and is retried after its lease.
+                    log.error("job queue database error: %s", e, extra={"queue": self.name})
+                    self._stop.wait(self.poll_interval)
+        finally:
+            conn.close()
+
+    def _execute(self, conn, job):
+        handler, on_dead = self._handlers.get(job['kind'], (None, None))
+        payload = json.loads(job['payload'])
+        attempts = job['attempts'] + 1
+        started = time.perf_counter()
+        try:
+            if handler is None:
+                raise LookupError(f"No handler registered for job kind '{job['kind']}'")
+            handler(payload)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if attempts >= self.max_attempts or isinstance(e, PermanentJobError):
+                metrics.job_seconds.observe(time.perf_counter() - started, job['kind'], "dead")
+                log.warning("job %s (%s) dead after %d attempts: %s", job['id'], job['kind'], attempts, error,
+                            extra={"queue": self.name, "job_id": job['id'], "kind": job['kind']})
+                self._finish(conn, job['id'], DEAD, error)
+                with self._lock:
+                    self.counters["dead"] += 1
+                if on_dead:
+                    try:
+                        on_dead(payload, error)
+                    except Exception as dead_error:
+                        log.error("dead-job hook failed: %s", dead_error, extra={"queue": self.name, "job_id": job['id']})
+            else:
+                metrics.job_seconds.observe(time.perf_counter() - started, job['kind'], "retry")
+                delay = min(self.max_delay, self.base_delay * (2 ** (attempts - 1)))
+                log.warning("job %s (%s) failed attempt %d/%d, retrying in %.1fs: %s", job['id'], job['kind'],
+                            attempts, self.max_attempts, delay, error,
+                            extra={"queue": self.name, "job_id": job['id'], "kind": job['kind']})
+                self._finish(conn, job['id'], QUEUED, error, run_after=time.time() + delay)
+                with self._lock:
+                    self.counters["retried"] += 1
+            return
+
+        self._finish(conn, job['id'], DONE)
+        elapsed = time.perf_counter() - started
+        metrics.job_seconds.observe(elapsed, job['kind'], "done")
+        with self._lock:
+            self.counters["succeeded"] += 1
+            self._completed.append((time.time(), elapsed))
+
+    def status(self) -> dict:
+        conn = self._connect()
+        try:
+            kind_sql, kind_params = self._kind_filter()
+            depth = {row['status']: row['n'] for row in conn.execute(
+                f'SELECT status, COUNT(*) AS n FROM jobs WHERE 1{kind_sql} GROUP BY status', kind_params)}
+            oldest = conn.execute(f'SELECT MIN(created_at) FROM jobs WHERE status = ?{kind_sql}',
+                                  (QUEUED, *kind_params)).fetchone()[0]
+        finally:
+            conn.close()
+
+        now = time.time()
+        with self._lock:
+            counters = dict(self.counters)
+            recent = [seconds for finished, seconds in self._completed if finished >= now - 60]
+        return {
+            "workers": len(self._threads),
+            "depth": {s: depth.get(s, 0) for s in (QUEUED, RUNNING, DONE, DEAD)},
+            "oldest_queued_age_s": round(now - oldest, 1) if oldest else None,
+            "jobs_per_minute": len(recent),
+            "avg_job_ms": round(sum(recent) / len(recent) * 1000, 1) if recent else None,
+            **counters,
+        }
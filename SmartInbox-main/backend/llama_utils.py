@@ -1,168 +1,784 @@
-import os
-from dotenv import load_dotenv
-from groq import Groq
-
-# ------------------------- #
-# Groq Model Setup
-# ------------------------- #
-
-load_dotenv()
-client = Groq(api_key=os.getenv("GROQ_API"))
-
-# Use a supported Groq model
-MODEL_NAME = "llama-3.1-8b-instant"  # alternatives: llama-3.1-70b-versatile
-
-
-# ------------------------- #
-# Groq Wrapper
-# ------------------------- #
-
-def generate_llama_response(prompt: str, max_tokens=64):
-    try:
-        response = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.1,
-            max_tokens=max_tokens,
-            top_p=0.9
-        )
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        print("[Groq ERROR]:", str(e))
-        return None
-
-
-# ------------------------- #
-# Tone Classifier (Multi-tone)
-# ------------------------- #
-
-def classify_email_tone(email_text: str) -> str:
-    prompt = (
-        "You are a tone classifier. Respond with the main emotional tone present in the email, "
-        "only 1 from the following list: polite, urgent, neutral, formal, "
-        "angry, friendly, apologetic, appreciative, sarcastic, confused, demanding, encouraging, "
-        "threatening, dismissive.\n"
-        "Do not explain, just name the main tone.\n\n"
-        f"Email: {email_text.strip()}\nAnswer:"
-    )
-
-    result = generate_llama_response(prompt, max_tokens=16)
-    if result:
-        result = result.lower()
-        print("[Tone Raw]:", repr(result))
-        tones = [
-            "polite", "urgent", "neutral", "formal", "angry", "friendly", "apologetic",
-            "appreciative", "sarcastic", "confused", "demanding", "encouraging",
-            "threatening", "dismissive"
-        ]
-        detected = [tone for tone in tones if tone in result]
-        if detected:
-            return ", ".join(detected)
-
-    # Fallback keyword-based tone detection
-    fallback_tones = []
-    text = email_text.lower()
-    if any(w in text for w in ["sorry", "apologize", "inconvenience"]):
-        fallback_tones.append("apologetic")
-    if any(w in text for w in ["great job", "well done", "thank you", "appreciate"]):
-        fallback_tones.append("appreciative")
-    if any(w in text for w in ["what now", "again?", "of course", "just great"]):
-        fallback_tones.append("sarcastic")
-    if any(w in text for w in ["looking forward", "can't wait", "excited"]):
-        fallback_tones.append("friendly")
-    if any(w in text for w in ["why", "how come", "wasn't it", "unclear"]):
-        fallback_tones.append("confused")
-    if any(w in text for w in ["do this", "no excuses", "now"]):
-        fallback_tones.append("demanding")
-    if any(w in text for w in ["you can do it", "keep going", "don't give up"]):
-        fallback_tones.append("encouraging")
-    if any(w in text for w in ["consequences", "last warning", "legal action"]):
-        fallback_tones.append("threatening")
-    if any(w in text for w in ["whatever", "don't care", "not my problem"]):
-        fallback_tones.append("dismissive")
-
-    if fallback_tones:
-        return ", ".join(set(fallback_tones))
-
-    return "neutral"
-
-
-# ------------------------- #
-# Spam Detector (Tone-Aware)
-# ------------------------- #
-
-def detect_spam(email_text: str) -> bool:
-    """
-    Returns True if email is spam, False otherwise.
-    Uses Groq LLaMA intelligence only — no keyword rules.
-    """
-
-    prompt = f"""
-You are an expert spam, phishing, and scam detector for emails.
-Classify if the email below is spam.
-
-Spam includes:
-- Any scam, phishing, or fraudulent attempt
-- Requests for sensitive personal or financial information
-- Fake offers, contests, or prizes
-- Marketing emails without consent
-- Anything deceptive or harmful
-
-Return your answer in EXACTLY one word: 'yes' or 'no'.
-
-Email:
-\"\"\"{email_text.strip()}\"\"\" 
-Answer:
-    """
-
-    result = generate_llama_response(prompt, max_tokens=5)
-    if not result:
-        return False  # default safe value
-
-    answer = result.strip().lower()
-    print("[Spam Raw]:", repr(answer))
-    return answer.startswith("yes")
-
-
-# ------------------------- #
-# Summarizer
-# ------------------------- #
-
-def summarize_email(email_text: str) -> str:
-    prompt = (
-        "You are an expert email summarizer. Summarize the following email using easy vocabulary under 30 words. "
-        "Respond ONLY with the summary text:\n\n"
-        f"Email: {email_text.strip()}\n\n"
-        "Summary:"
-    )
-    result = generate_llama_response(prompt, max_tokens=100)
-    if result:
-        print("[Summary Raw]:", repr(result))
-        return result.strip()
-    return "Summary unavailable."
-
-
-# ------------------------- #
-# Rewriter
-# ------------------------- #
-
-def rewrite_email_tone(text: str, tone: str) -> str:
-    prompt = (
-        f"You are an expert email editor. Rewrite the following email text to have a {tone} tone. "
-        "Keep the core message the same, but adjust phrasing, vocabulary, and nuance. "
-        "Respond ONLY with the rewritten email body (no extra text).\n\n"
-        f"Original Text: \"{text.strip()}\"\n\n"
-        f"Rewritten Text with a {tone} tone:"
-    )
-
-    result = generate_llama_response(prompt, max_tokens=512)
-
-    if not result:
-        return "⚠️ Could not rewrite the text."
-
-    result = result.strip()
-    # Remove wrapping quotes if present
-    if result.startswith('"') and result.endswith('"'):
-        result = result[1:-1]
-
-    return result
+import os
+import re
+import json
+import time
+import threading
+from collections import deque
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from backend import metrics, preprocess
+from backend.log import get_logger
+from backend.llm_cache import cache, make_key, normalize_text
+from backend.llm_backends import GroqBackend, create_backend
+from backend.prefilter import prefilter
+from backend.rate_limit import RateLimiter
+
+# ------------------------- #
+# Model Setup
+# ------------------------- #
+
+load_dotenv()
+log = get_logger("llm")
+
+# Use a supported Groq model
+MODEL_NAME = "llama-3.1-8b-instant"  # alternatives: llama-3.1-70b-versatile
+
+# SBOX_LLM_BACKEND selects groq (default), local (GGUF on CPU) or stub
+llm_backend = create_backend(MODEL_NAME)
+
+TONES = [
+    "polite", "urgent", "neutral", "formal", "angry", "friendly", "apologetic",
+    "appreciative", "sarcastic", "confused", "demanding", "encouraging",
+    "threatening", "dismissive"
+]
+
+# Provider limits (defaults are Groq's free tier for llama-3.1-8b-instant); 0 disables a limit
+rate_limiter = RateLimiter(
+    requests_per_minute=int(os.getenv("SBOX_GROQ_RPM", "30")),
+    tokens_per_minute=int(os.getenv("SBOX_GROQ_TPM", "6000")),
+)
+LLM_CONCURRENCY = int(os.getenv("SBOX_LLM_CONCURRENCY", "8"))
+# Answer obvious spam/ham and tone in-process once the pre-filter has been trained
+PREFILTER_ENABLED = os.getenv("SBOX_PREFILTER", "1") != "0"
+MAX_RATE_LIMIT_RETRIES = 3
+
+
+def set_backend(backend):
+    global llm_backend
+    llm_backend = backend
+
+
+def get_backend_stats() -> dict:
+    return llm_backend.stats()
+
+
+def set_client(new_client):
+    """Swaps the Groq chat-completions client, e.g. for backend.fake_llm.FakeGroqClient."""
+    set_backend(GroqBackend(MODEL_NAME, client=new_client))
+
+
+# ------------------------- #
+# LLM Wrapper
+# ------------------------- #
+
+_call_counter = threading.local()
+_timing_lock = threading.Lock()
+_llm_timing = {"calls": 0, "seconds": 0.0}
+
+
+def llm_calls_in_thread() -> int:
+    """Number of real (uncached) LLM round trips made by the current thread."""
+    return getattr(_call_counter, "count", 0)
+
+
+def llm_errors_in_thread() -> int:
+    """Number of LLM round trips made by the current thread that raised an error."""
+    return getattr(_call_counter, "errors", 0)
+
+
+def average_llm_seconds():
+    with _timing_lock:
+        return _llm_timing["seconds"] / _llm_timing["calls"] if _llm_timing["calls"] else None
+
+
+def llm_idle(headroom=0.5) -> bool:
+    """
+    True when the LLM has spare capacity for background work: no 429 pause
+    and at least `headroom` of each per-minute budget unused (or, for the
+    local backend, nothing waiting for the model).
+    """
+    backend = llm_backend
+    if not backend.uses_rate_limits:
+        return backend.stats().get("queue_depth", 0) == 0
+    stats = rate_limiter.stats()
+    if stats["blocked_for_s"] > 0:
+        return False
+    for available, limit in ((stats["available_requests"], stats["requests_per_minute"]),
+                             (stats["available_tokens"], stats["tokens_per_minute"])):
+        if limit and available < limit * headroom:
+            return False
+    return True
+
+
+def get_prefilter_stats() -> dict:
+    return {"enabled": PREFILTER_ENABLED, **prefilter.stats(average_llm_seconds())}
+
+
+def _record_call(backend, label, prompt, result, seconds, usage=None):
+    """Latency and token histograms for one LLM call; tokens are estimated when `usage` is None."""
+    metrics.llm_seconds.observe(seconds, label, backend.name)
+    metrics.profile_add(f"llm {label}", seconds)
+    prompt_tokens, completion_tokens = usage or (metrics.estimate_tokens(prompt), metrics.estimate_tokens(result))
+    metrics.llm_tokens.observe(prompt_tokens, label, "prompt")
+    metrics.llm_tokens.observe(completion_tokens, label, "completion")
+
+
+def generate_llama_response(prompt, max_tokens=64, json_mode=False, task=None, text=None, label=None):
+    """
+    Pass `task` and `text` to make the call cacheable: the result is keyed on
+    (model, task, normalized text, max_tokens) rather than the full prompt.
+    `prompt` may then be a function that builds it, so compaction (and any
+    map step) only runs on a cache miss. `label` names the call in metrics
+    when there is no task (default: task).
+    """
+    backend = llm_backend
+    label = label or task or "other"
+    key = None
+    if task is not None and text is not None:
+        key = make_key(backend.model_name, task, text, max_tokens)
+        cached = cache.get(key)
+        if cached is not None:
+            metrics.llm_cached.inc(label)
+            return cached
+    if callable(prompt):
+        prompt = prompt()
+
+    # Rough prompt size (~4 chars/token) plus the completion budget
+    estimated_tokens = len(prompt) // 4 + max_tokens
+
+    for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+        if backend.uses_rate_limits:
+            rate_limiter.acquire(estimated_tokens)
+        _call_counter.count = llm_calls_in_thread() + 1
+        started = time.perf_counter()
+        try:
+            result = backend.complete(prompt, max_tokens=max_tokens, json_mode=json_mode).strip()
+            elapsed = time.perf_counter() - started
+            with _timing_lock:
+                _llm_timing["calls"] += 1
+                _llm_timing["seconds"] += elapsed
+            _record_call(backend, label, prompt, result, elapsed, backend.last_usage())
+            if key is not None and result:
+                cache.set(key, backend.model_name, task, result)
+            return result
+        except Exception as e:
+            retry_after = _retry_after(e)
+            if retry_after is not None and attempt < MAX_RATE_LIMIT_RETRIES:
+                log.warning("rate limited, retrying in %ss", retry_after, extra={"task": label})
+                rate_limiter.block_for(retry_after)
+                continue
+            _call_counter.errors = llm_errors_in_thread() + 1
+            metrics.llm_errors.inc(label)
+            log.error("%s call failed: %s", backend.name, e, extra={"task": label})
+            return None
+
+
+def stream_llama_response(prompt, max_tokens=64, task=None, text=None, label="stream"):
+    """
+    Like generate_llama_response(), but yields text deltas as the backend
+    produces them. Time to first token and total time are recorded per
+    `label` (see get_stream_stats). A cached answer is yielded in one piece.
+    Yields nothing if the call fails. `prompt` may be a function, as above.
+    """
+    backend = llm_backend
+    started = time.perf_counter()
+    key = None
+    if task is not None and text is not None:
+        key = make_key(backend.model_name, task, text, max_tokens)
+        cached = cache.get(key)
+        if cached is not None:
+            metrics.llm_cached.inc(label)
+            record_stream(label, time.perf_counter() - started, time.perf_counter() - started, cached=True)
+            yield cached
+            return
+    if callable(prompt):
+        prompt = prompt()
+
+    estimated_tokens = len(prompt) // 4 + max_tokens
+    for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+        if backend.uses_rate_limits:
+            rate_limiter.acquire(estimated_tokens)
+        _call_counter.count = llm_calls_in_thread() + 1
+        parts, first_token = [], None
+        try:
+            # closing() stops the backend's generation as soon as our consumer goes away
+            with closing(backend.stream(prompt, max_tokens=max_tokens)) as deltas:
+                for delta in deltas:
+                    if first_token is None:
+                        first_token = time.perf_counter() - started
+                    parts.append(delta)
+                    yield delta
+        except Exception as e:
+            retry_after = _retry_after(e)
+            # Once text has reached the client the stream cannot be restarted
+            if retry_after is not None and not parts and attempt < MAX_RATE_LIMIT_RETRIES:
+                log.warning("rate limited, retrying in %ss", retry_after, extra={"task": label})
+                rate_limiter.block_for(retry_after)
+                continue
+            _call_counter.errors = llm_errors_in_thread() + 1
+            metrics.llm_errors.inc(label)
+            log.error("%s stream failed: %s", backend.name, e, extra={"task": label})
+            return
+        total = time.perf_counter() - started
+        with _timing_lock:
+            _llm_timing["calls"] += 1
+            _llm_timing["seconds"] += total
+        record_stream(label, first_token if first_token is not None else total, total)
+        result = "".join(parts).strip()
+        _record_call(backend, label, prompt, result, total)
+        if key is not None and result:
+            cache.set(key, backend.model_name, task, result)
+        return
+
+
+class StreamCleaner:
+    """
+    Applies the post-processing of the blocking functions (strip, and
+    optionally drop wrapping quotes) to a stream: whitespace and a possible
+    closing quote at the end are held back until more text arrives.
+    """
+
+    def __init__(self, strip_quotes=False):
+        self.strip_quotes = strip_quotes
+        self.started = False
+        self.quoted = False
+        self.pending = ""
+
+    def feed(self, delta: str) -> str:
+        if not self.started:
+            delta = delta.lstrip()
+            if not delta:
+                return ""
+            self.started = True
+            if self.strip_quotes and delta.startswith('"'):
+                self.quoted = True
+                delta = delta[1:]
+        text = self.pending + delta
+        keep = len(text.rstrip())
+        if self.quoted and text[:keep].endswith('"'):
+            keep -= 1
+        self.pending = text[keep:]
+        return text[:keep]
+
+    def finish(self) -> str:
+        tail = self.pending.rstrip()
+        if self.quoted and tail.endswith('"'):
+            tail = tail[:-1]
+        self.pending = ""
+        return tail
+
+
+def clean_stream(deltas, cleaner, fallback):
+    """Runs deltas through `cleaner`; yields `fallback` if the model produced nothing."""
+    produced = False
+    for delta in deltas:
+        chunk = cleaner.feed(delta)
+        if chunk:
+            produced = True
+            yield chunk
+    tail = cleaner.finish()
+    if tail or produced:
+        yield tail
+    else:
+        yield fallback
+
+
+def _retry_after(error):
+    """Seconds to wait if `error` is a 429 from the provider, otherwise None."""
+    if getattr(error, "status_code", None) != 429:
+        return None
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return max(0.0, float(headers.get("retry-after", 1.0)))
+    except (TypeError, ValueError):
+        return 1.0
+
+
+# ------------------------- #
+# Tone Classifier (Multi-tone)
+# ------------------------- #
+
+# Where a stored tone/spam label came from; the pre-filter only learns from LLM labels
+LLM, PREFILTER, FALLBACK = "llm", "prefilter", "fallback"
+
+
+def label_source(*sources):
+    """One source for a row from those of its labels: 'llm' only if every label came from the model."""
+    if all(source == LLM for source in sources):
+        return LLM
+    if FALLBACK in sources:
+        return FALLBACK
+    return None if None in sources else PREFILTER
+
+
+def classify_email_tone(email_text: str) -> str:
+    return classify_email_tone_labeled(email_text)[0]
+
+
+def classify_email_tone_labeled(email_text: str):
+    """(tone, source), where source is LLM, PREFILTER or FALLBACK."""
+    if PREFILTER_ENABLED:
+        tone = prefilter.predict_tone(email_text)
+        if tone is not None:
+            prefilter.record_avoided()
+            return tone, PREFILTER
+    return _llm_tone(email_text)
+
+
+def _llm_tone(email_text: str):
+    """The LLM (or keyword fallback) half of classify_email_tone_labeled, without the pre-filter."""
+    prompt = lambda: (
+        "You are a tone classifier. Respond with the main emotional tone present in the email, "
+        "only 1 from the following list: polite, urgent, neutral, formal, "
+        "angry, friendly, apologetic, appreciative, sarcastic, confused, demanding, encouraging, "
+        "threatening, dismissive.\n"
+        "Do not explain, just name the main tone.\n\n"
+        f"Email: {preprocess.fit('tone', email_text)}\nAnswer:"
+    )
+
+    result = generate_llama_response(prompt, max_tokens=16, task="tone", text=email_text)
+    if result:
+        result = result.lower()
+        log.debug("tone raw: %r", result)
+        detected = [tone for tone in TONES if tone in result]
+        if detected:
+            return ", ".join(detected), LLM
+
+    # Fallback keyword-based tone detection
+    fallback_tones = keyword_tones(email_text)
+    if fallback_tones:
+        return ", ".join(fallback_tones), FALLBACK
+
+    return "neutral", FALLBACK
+
+
+FALLBACK_KEYWORDS = {
+    "apologetic": ["sorry", "apologize", "inconvenience"],
+    "appreciative": ["great job", "well done", "thank you", "appreciate"],
+    "sarcastic": ["what now", "again?", "of course", "just great"],
+    "friendly": ["looking forward", "can't wait", "excited"],
+    "confused": ["why", "how come", "wasn't it", "unclear"],
+    "demanding": ["do this", "no excuses", "now"],
+    "encouraging": ["you can do it", "keep going", "don't give up"],
+    "threatening": ["consequences", "last warning", "legal action"],
+    "dismissive": ["whatever", "don't care", "not my problem"],
+}
+
+
+def keyword_tones(email_text: str) -> list:
+    # str.__contains__ runs in C; a single alternation regex over these
+    # phrases measured slower in CPython, so the table is scanned directly
+    text = email_text.lower()
+    return [tone for tone, phrases in FALLBACK_KEYWORDS.items() if any(p in text for p in phrases)]
+
+
+# ------------------------- #
+# Spam Detector (Tone-Aware)
+# ------------------------- #
+
+def detect_spam(email_text: str) -> bool:
+    """
+    Returns True if email is spam, False otherwise.
+    Uses the trained pre-filter for confident verdicts, otherwise the LLM.
+    """
+    return detect_spam_labeled(email_text)[0]
+
+
+def detect_spam_labeled(email_text: str):
+    """(is_spam, source), where source is LLM, PREFILTER or FALLBACK."""
+    if PREFILTER_ENABLED:
+        verdict = prefilter.predict_spam(email_text)
+        if verdict is not None:
+            prefilter.record_avoided()
+            return verdict, PREFILTER
+    return _llm_spam(email_text)
+
+
+def _llm_spam(email_text: str):
+    """The LLM half of detect_spam_labeled, without the pre-filter."""
+    prompt = lambda: f"""
+You are an expert spam, phishing, and scam detector for emails.
+Classify if the email below is spam.
+
+Spam includes:
+- Any scam, phishing, or fraudulent attempt
+- Requests for sensitive personal or financial information
+- Fake offers, contests, or prizes
+- Marketing emails without consent
+- Anything deceptive or harmful
+
+Return your answer in EXACTLY one word: 'yes' or 'no'.
+
+Email:
+\"\"\"{preprocess.fit('spam', email_text)}\"\"\" 
+Answer:
+    """
+
+    result = generate_llama_response(prompt, max_tokens=5, task="spam", text=email_text)
+    if not result:
+        return False, FALLBACK  # default safe value
+
+    answer = result.strip().lower()
+    log.debug("spam raw: %r", answer)
+    return answer.startswith("yes"), LLM
+
+
+# ------------------------- #
+# Summarizer
+# ------------------------- #
+
+SUMMARY_UNAVAILABLE = "Summary unavailable."
+
+
+def _summary_input(email_text: str) -> str:
+    """
+    The compacted email, or for mail over the summary budget the map step of
+    a map-reduce: each chunk is summarized (and cached) on its own and the
+    final prompt summarizes those notes instead.
+    """
+    pieces = preprocess.summary_chunks(email_text)
+    if len(pieces) == 1:
+        return pieces[0]
+    notes = []
+    for number, piece in enumerate(pieces, 1):
+        prompt = (
+            f"You are an expert email summarizer. Below is part {number} of {len(pieces)} of a long email. "
+            "List its key points (requests, decisions, dates, amounts) in at most 3 short sentences. "
+            "Respond ONLY with the key points:\n\n"
+            f"Part: {piece}\n\n"
+            "Key points:"
+        )
+        note = generate_llama_response(prompt, max_tokens=120, task="summary_part", text=piece)
+        if note:
+            notes.append(note)
+    log.debug("summarized %d chunks into %d notes", len(pieces), len(notes))
+    # If every chunk failed, the opening of the mail still gets a summary
+    return "\n".join(notes) if notes else pieces[0]
+
+
+def _summary_prompt(email_text: str) -> str:
+    return (
+        "You are an expert email summarizer. Summarize the following email using easy vocabulary under 30 words. "
+        "Respond ONLY with the summary text:\n\n"
+        f"Email: {_summary_input(email_text)}\n\n"
+        "Summary:"
+    )
+
+
+def summarize_email(email_text: str) -> str:
+    prompt = lambda: _summary_prompt(email_text)
+    result = generate_llama_response(prompt, max_tokens=100, task="summary", text=email_text)
+    if result:
+        log.debug("summary raw: %r", result)
+        return result.strip()
+    return SUMMARY_UNAVAILABLE
+
+
+def summarize_email_stream(email_text: str):
+    """summarize_email() as a stream of text chunks; shares its cache entries."""
+    prompt = lambda: _summary_prompt(email_text)
+    deltas = stream_llama_response(prompt, max_tokens=100, task="summary", text=email_text, label="summary")
+    yield from clean_stream(deltas, StreamCleaner(), SUMMARY_UNAVAILABLE)
+
+
+# ------------------------- #
+# Rewriter
+# ------------------------- #
+
+REWRITE_FAILED = "⚠️ Could not rewrite the text."
+REWRITE_TOO_LONG = "⚠️ The text is too long to rewrite. Try a shorter passage."
+
+
+def _rewrite_max_tokens(text: str) -> int:
+    # Room for the whole draft plus some growth; a cut-off rewrite is worse than none
+    return max(512, metrics.estimate_tokens(text) * 3 // 2)
+
+
+def _rewrite_prompt(text: str, tone: str) -> str:
+    return (
+        f"You are an expert email editor. Rewrite the following email text to have a {tone} tone. "
+        "Keep the core message the same, but adjust phrasing, vocabulary, and nuance. "
+        "Respond ONLY with the rewritten email body (no extra text).\n\n"
+        f"Original Text: \"{text.strip()}\"\n\n"
+        f"Rewritten Text with a {tone} tone:"
+    )
+
+
+def rewrite_email_tone(text: str, tone: str) -> str:
+    text = preprocess.compact_rewrite(text)
+    if text is None:
+        return REWRITE_TOO_LONG
+    prompt = _rewrite_prompt(text, tone)
+    result = generate_llama_response(prompt, max_tokens=_rewrite_max_tokens(text), label="rewrite")
+
+    if not result:
+        return REWRITE_FAILED
+
+    result = result.strip()
+    # Remove wrapping quotes if present
+    if result.startswith('"') and result.endswith('"'):
+        result = result[1:-1]
+
+    return result
+
+
+def rewrite_email_tone_stream(text: str, tone: str):
+    """rewrite_email_tone() as a stream of text chunks, with wrapping quotes removed on the fly."""
+    text = preprocess.compact_rewrite(text)
+    if text is None:
+        yield REWRITE_TOO_LONG
+        return
+    prompt = _rewrite_prompt(text, tone)
+    deltas = stream_llama_response(prompt, max_tokens=_rewrite_max_tokens(text), label="rewrite")
+    yield from clean_stream(deltas, StreamCleaner(strip_quotes=True), REWRITE_FAILED)
+
+
+# ------------------------- #
+# Combined Analyzer (tone + spam + summary in one call)
+# ------------------------- #
+
+def _parse_tone(value):
+    if not isinstance(value, str):
+        return None
+    value = value.lower()
+    detected = [tone for tone in TONES if tone in value]
+    return ", ".join(detected) if detected else None
+
+
+def _parse_spam(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ("yes", "no", "true", "false"):
+        return value.strip().lower() in ("yes", "true")
+    return None
+
+
+def _parse_analysis(raw):
+    """Returns the decoded JSON object from the model, or None if it is not parseable."""
+    if not raw:
+        return None
+    try:
+        data = json.loads(raw)
+    except ValueError:
+        # Models sometimes wrap the object in prose or code fences
+        match = re.search(r"\{.*\}", raw, re.DOTALL)
+        if not match:
+            return None
+        try:
+            data = json.loads(match.group(0))
+        except ValueError:
+            return None
+    return data if isinstance(data, dict) else None
+
+
+def _analysis_prompt(email_text: str, keys) -> str:
+    fields = {
+        "tone": '- "tone": the main emotional tone, only 1 from the following list: ' f"{', '.join(TONES)}\n",
+        "spam": '- "spam": "yes" if the email is spam, phishing, a scam, a fake offer or prize, '
+                'unsolicited marketing, or asks for sensitive personal or financial information, otherwise "no"\n',
+        "summary": '- "summary": a summary of the email using easy vocabulary under 30 words\n',
+    }
+    return (
+        "You are an email analyzer. Analyze the email below and respond with a JSON object "
+        "with exactly these keys:\n"
+        + "".join(fields[key] for key in keys)
+        + "Respond ONLY with the JSON object.\n\n"
+        f"Email: {preprocess.fit('analysis', email_text)}"
+    )
+
+
+def analyze_email(email_text: str) -> dict:
+    """
+    Returns {"tone", "is_spam", "summary", "label_source"} from a single JSON
+    completion. Fields the pre-filter answers confidently are left out of the
+    prompt, and so is the summary of mail long enough to be summarized with
+    map-reduce. Falls back to the separate classifiers only for fields that
+    fail validation.
+    """
+    started = time.perf_counter()
+    # The analysis prompt only sees the head and tail of long mail, whose summary
+    # comes from map-reduce over all of it instead
+    chunked = preprocess.needs_chunking(email_text)
+    tone = is_spam = None
+    tone_source = spam_source = PREFILTER
+    if PREFILTER_ENABLED:
+        tone = prefilter.predict_tone(email_text, record=False)
+        is_spam = prefilter.predict_spam(email_text, record=False)
+        prefilter.record("tone", tone is not None)
+        prefilter.record("spam", is_spam is not None)
+        if tone is not None and is_spam is not None:
+            # Only the summary still needs the LLM, and its prompt is smaller. That
+            # saves a call only for long mail, where the prompt had no summary key.
+            if chunked:
+                prefilter.record_avoided()
+            calls_before = llm_calls_in_thread()
+            summary = summarize_email(email_text)
+            record_analysis("combined", llm_calls_in_thread() - calls_before, time.perf_counter() - started)
+            return {"tone": tone, "is_spam": is_spam, "summary": summary, "label_source": PREFILTER}
+
+    keys = [key for key, known in (("tone", tone), ("spam", is_spam)) if known is None]
+    if not chunked:
+        keys.append("summary")
+    # Each key set is its own prompt, so its own cache entry
+    task = "analysis" if len(keys) == 3 else "analysis:" + "+".join(keys)
+    prompt = lambda: _analysis_prompt(email_text, keys)
+
+    calls_before = llm_calls_in_thread()
+    raw = generate_llama_response(prompt, max_tokens=160 if "summary" in keys else 40, json_mode=True,
+                                  task=task, text=email_text, label="analysis")
+    fallback = False
+    data = _parse_analysis(raw)
+    log.debug("analysis raw: %r", raw)
+    if data is None:
+        data = {}
+
+    if tone is None:
+        tone, tone_source = _parse_tone(data.get("tone")), LLM
+        if tone is None:
+            # The pre-filter already deferred this field; asking it again would count twice
+            tone, tone_source = _llm_tone(email_text)
+            fallback = True
+
+    if is_spam is None:
+        is_spam, spam_source = _parse_spam(data.get("spam")), LLM
+        if is_spam is None:
+            is_spam, spam_source = _llm_spam(email_text)
+            fallback = True
+
+    summary = data.get("summary")
+    if chunked:
+        summary = summarize_email(email_text)
+    elif not isinstance(summary, str) or not summary.strip():
+        summary = summarize_email(email_text)
+        fallback = True
+
+    calls = llm_calls_in_thread() - calls_before
+    record_analysis("combined", calls, time.perf_counter() - started, fallback=fallback)
+    return {"tone": tone, "is_spam": is_spam, "summary": summary.strip(),
+            "label_source": label_source(tone_source, spam_source)}
+
+
+def analyze_email_separately(email_text: str) -> dict:
+    """The original three-call path, kept for comparison and as a kill switch."""
+    started = time.perf_counter()
+    calls_before = llm_calls_in_thread()
+    tone, tone_source = classify_email_tone_labeled(email_text)
+    is_spam, spam_source = detect_spam_labeled(email_text)
+    result = {
+        "tone": tone,
+        "is_spam": is_spam,
+        "summary": summarize_email(email_text),
+        "label_source": label_source(tone_source, spam_source),
+    }
+    record_analysis("separate", llm_calls_in_thread() - calls_before, time.perf_counter() - started)
+    return result
+
+
+# ------------------------- #
+# Per-message Analysis Stats
+# ------------------------- #
+
+_stats_lock = threading.Lock()
+_analysis_stats = {}
+
+
+def record_analysis(mode: str, calls: int, seconds: float, fallback=False):
+    with _stats_lock:
+        stats = _analysis_stats.setdefault(mode, {
+            "messages": 0, "llm_calls": 0, "fallbacks": 0, "latencies": deque(maxlen=1000)
+        })
+        stats["messages"] += 1
+        stats["llm_calls"] += calls
+        stats["fallbacks"] += 1 if fallback else 0
+        stats["latencies"].append(seconds)
+
+
+_stream_stats = {}
+
+
+def record_stream(label: str, first_token_seconds: float, total_seconds: float, cached=False):
+    with _stats_lock:
+        stats = _stream_stats.setdefault(label, {
+            "streams": 0, "cached": 0, "ttft": deque(maxlen=1000), "total": deque(maxlen=1000)
+        })
+        stats["streams"] += 1
+        stats["cached"] += 1 if cached else 0
+        stats["ttft"].append(first_token_seconds)
+        stats["total"].append(total_seconds)
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def get_analysis_stats() -> dict:
+    """LLM calls and p50/p99 latency per message, keyed by analysis mode."""
+    report = {}
+    with _stats_lock:
+        for mode, stats in _analysis_stats.items():
+            latencies = sorted(stats["latencies"])
+            p50 = _percentile(latencies, 50)
+            p99 = _percentile(latencies, 99)
+            report[mode] = {
+                "messages": stats["messages"],
+                "llm_calls": stats["llm_calls"],
+                "calls_per_message": round(stats["llm_calls"] / stats["messages"], 3),
+                "fallbacks": stats["fallbacks"],
+                "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+                "p99_ms": round(p99 * 1000, 1) if p99 is not None else None,
+            }
+    return report
+
+
+def get_stream_stats() -> dict:
+    """Time to first token and total generation time (p50/p99) per streamed task."""
+    report = {}
+    with _stats_lock:
+        for label, stats in _stream_stats.items():
+            entry = {"streams": stats["streams"], "cached": stats["cached"]}
+            for name in ("ttft", "total"):
+                values = sorted(stats[name])
+                for pct in (50, 99):
+                    value = _percentile(values, pct)
+                    entry[f"{name}_p{pct}_ms"] = round(value * 1000, 1) if value is not None else None
+            report[label] = entry
+    return report
+
+
+# ------------------------- #
+# Batch APIs (deduped, concurrent, order-preserving)
+# ------------------------- #
+
+def _run_batch(fn, texts, concurrency=None):
+    unique = {}
+    for text in texts:
+        unique.setdefault(normalize_text(text), text)
+    if not unique:
+        return []
+    workers = max(1, min(concurrency or LLM_CONCURRENCY, len(unique)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm-batch") as pool:
+        results = dict(zip(unique.keys(), pool.map(fn, unique.values())))
+    return [results[normalize_text(text)] for text in texts]
+
+
+def run_batch_checked(fn, texts, concurrency=None) -> list:
+    """
+    Like the batch APIs below, but returns (result, failed) per text: failed
+    is True if an LLM call made for it raised, so `result` holds fallback
+    values rather than an answer from the model.
+    """
+    def checked(text):
+        errors_before = llm_errors_in_thread()
+        result = fn(text)
+        return result, llm_errors_in_thread() > errors_before
+    return _run_batch(checked, texts, concurrency)
+
+
+def classify_email_tone_batch(texts, concurrency=None) -> list:
+    return _run_batch(classify_email_tone, texts, concurrency)
+
+
+def detect_spam_batch(texts, concurrency=None) -> list:
+    return _run_batch(detect_spam, texts, concurrency)
+
+
+def summarize_email_batch(texts, concurrency=None) -> list:
+    return _run_batch(summarize_email, texts, concurrency)
+
+
+def analyze_email_batch(texts, concurrency=None) -> list:
+    return _run_batch(analyze_email, texts, concurrency)
@@ -0,0 +1,280 @@
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+from backend.fake_llm import fake_completion
+from backend.log import get_logger
+
+# ------------------------- #
+# Pluggable LLM Backends
+# ------------------------- #
+# Every backend exposes complete(prompt, max_tokens, json_mode) -> str,
+# stream(prompt, max_tokens) -> iterator of text deltas, last_usage() and stats().
+# Errors propagate to generate_llama_response() / stream_llama_response(),
+# which own retries and fallbacks.
+
+MODELS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "models")
+DEFAULT_LOCAL_MODEL = "llama-3.2-3b-instruct-q4_k_m.gguf"  # see models/model.txt
+
+log = get_logger("llm")
+
+
+class GroqBackend:
+    name = "groq"
+    uses_rate_limits = True
+
+    def __init__(self, model_name, client=None):
+        self._client = client
+        self._client_lock = threading.Lock()
+        self.model_name = model_name
+        self._local = threading.local()
+
+    @property
+    def client(self):
+        """Created on first use (importing groq takes ~0.1 s) and shared by every thread."""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    from groq import Groq
+                    # Retries are handled in llama_utils so that every thread shares one rate-limit schedule
+                    self._client = Groq(api_key=os.getenv("GROQ_API"), max_retries=0)
+        return self._client
+
+    def complete(self, prompt: str, max_tokens=64, json_mode=False) -> str:
+        kwargs = {}
+        if json_mode:
+            kwargs["response_format"] = {"type": "json_object"}
+        response = self.client.chat.completions.create(
+            model=self.model_name,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.1,
+            max_tokens=max_tokens,
+            top_p=0.9,
+            **kwargs
+        )
+        usage = getattr(response, "usage", None)
+        self._local.usage = (usage.prompt_tokens, usage.completion_tokens) if usage else None
+        return response.choices[0].message.content
+
+    def last_usage(self):
+        """(prompt_tokens, completion_tokens) of this thread's last complete(), if the API reported it."""
+        return getattr(self._local, "usage", None)
+
+    def stream(self, prompt: str, max_tokens=64):
+        chunks = self.client.chat.completions.create(
+            model=self.model_name,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.1,
+            max_tokens=max_tokens,
+            top_p=0.9,
+            stream=True,
+        )
+        for chunk in chunks:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "model": self.model_name}
+
+
+class StubBackend:
+    """Deterministic, instant answers for tests and offline development."""
+    name = "stub"
+    uses_rate_limits = False
+    model_name = "stub"
+
+    def __init__(self):
+        self.calls = 0
+
+    def complete(self, prompt: str, max_tokens=64, json_mode=False) -> str:
+        self.calls += 1
+        return fake_completion(prompt, max_tokens, json_mode)
+
+    def stream(self, prompt: str, max_tokens=64):
+        self.calls += 1
+        for i, word in enumerate(fake_completion(prompt, max_tokens).split(" ")):
+            yield word if i == 0 else " " + word
+
+    def last_usage(self):
+        return None
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "model": self.model_name, "calls": self.calls}
+
+
+class LocalGGUFBackend:
+    """
+    Runs a GGUF model on CPU through llama-cpp-python (optional dependency).
+
+    A llama.cpp context is not thread-safe, so one inference thread owns the
+    model and Flask threads submit requests through a queue. Identical
+    requests waiting in the queue at the same time are coalesced into a
+    single generation. Streamed requests are never coalesced; their tokens
+    are handed back through a per-request queue, and generation stops as
+    soon as the consumer does (client disconnect, generator closed).
+    """
+    name = "local"
+    uses_rate_limits = False
+
+    def __init__(self, model_path=None, n_threads=None, n_ctx=4096, max_batch=8, preload=False):
+        self.model_path = model_path or os.getenv("SBOX_LOCAL_MODEL") or os.path.join(MODELS_DIR, DEFAULT_LOCAL_MODEL)
+        self.model_name = os.path.basename(self.model_path)
+        self.n_threads = n_threads or int(os.getenv("SBOX_LOCAL_THREADS", str(os.cpu_count() or 4)))
+        self.n_ctx = n_ctx
+        self.max_batch = max_batch
+        self._llm = None
+        self._load_lock = threading.Lock()
+        self._requests = queue.Queue()
+        self._lock = threading.Lock()
+        self.counters = {"requests": 0, "generations": 0, "coalesced": 0, "completion_tokens": 0,
+                         "prompt_tokens": 0, "busy_seconds": 0.0, "streams_cancelled": 0, "load_seconds": None}
+        self._worker = threading.Thread(target=self._run, name="local-llm", daemon=True)
+        self._worker.start()
+        if preload:
+            self.load()
+
+    def load(self):
+        with self._load_lock:
+            if self._llm is not None:
+                return self._llm
+            try:
+                from llama_cpp import Llama
+            except ImportError as e:
+                raise RuntimeError("SBOX_LLM_BACKEND=local requires `pip install llama-cpp-python`") from e
+            started = time.perf_counter()
+            self._llm = Llama(model_path=self.model_path, n_ctx=self.n_ctx, n_threads=self.n_threads, verbose=False)
+            self.counters["load_seconds"] = round(time.perf_counter() - started, 2)
+            log.info("loaded %s in %ss", self.model_name, self.counters['load_seconds'])
+            return self._llm
+
+    def complete(self, prompt: str, max_tokens=64, json_mode=False) -> str:
+        future = Future()
+        self._requests.put(((prompt, max_tokens, json_mode), future))
+        with self._lock:
+            self.counters["requests"] += 1
+        return future.result()
+
+    def stream(self, prompt: str, max_tokens=64):
+        tokens, cancelled = queue.Queue(), threading.Event()
+        self._requests.put(((prompt, max_tokens, False, tokens, cancelled), tokens))
+        with self._lock:
+            self.counters["requests"] += 1
+        try:
+            while True:
+                item = tokens.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Runs on close() too, so an abandoned stream frees the inference thread
+            cancelled.set()
+
+    def _generate_stream(self, prompt, max_tokens, tokens, cancelled):
+        if cancelled.is_set():
+            return  # consumer left while the request was queued
+        llm = self.load()
+        started = time.perf_counter()
+        produced = 0
+        chunks = llm.create_chat_completion(
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.1, top_p=0.9, max_tokens=max_tokens, stream=True
+        )
+        try:
+            for chunk in chunks:
+                if cancelled.is_set():
+                    with self._lock:
+                        self.counters["streams_cancelled"] += 1
+                    break
+                content = chunk["choices"][0]["delta"].get("content")
+                if content:
+                    produced += 1
+                    tokens.put(content)
+        finally:
+            chunks.close()
+        with self._lock:
+            self.counters["generations"] += 1
+            self.counters["busy_seconds"] += time.perf_counter() - started
+            self.counters["completion_tokens"] += produced  # one chunk per token in llama.cpp
+        tokens.put(None)
+
+    def _generate(self, prompt, max_tokens, json_mode):
+        llm = self.load()
+        kwargs = {"response_format": {"type": "json_object"}} if json_mode else {}
+        started = time.perf_counter()
+        out = llm.create_chat_completion(
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.1, top_p=0.9, max_tokens=max_tokens, **kwargs
+        )
+        usage = out.get("usage") or {}
+        with self._lock:
+            self.counters["generations"] += 1
+            self.counters["busy_seconds"] += time.perf_counter() - started
+            self.counters["completion_tokens"] += usage.get("completion_tokens", 0)
+            self.counters["prompt_tokens"] += usage.get("prompt_tokens", 0)
+        return out["choices"][0]["message"]["content"]
+
+    def _run(self):
+        while True:
+            batch = [self._requests.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._requests.get_nowait())
+                except queue.Empty:
+                    break
+
+            groups = {}
+            for key, future in batch:
+                groups.setdefault(key, []).append(future)
+            with self._lock:
+                self.counters["coalesced"] += len(batch) - len(groups)
+
+            for key, futures in groups.items():
+                if len(key) == 5:
+                    try:
+                        self._generate_stream(key[0], key[1], key[3], key[4])
+                    except Exception as e:
+                        key[3].put(e)
+                    continue
+                prompt, max_tokens, json_mode = key
+                try:
+                    result = self._generate(prompt, max_tokens, json_mode)
+                except Exception as e:
+                    for future in futures:
+                        future.set_exception(e)
+                    continue
+                for future in futures:
+                    future.set_result(result)
+
+    def last_usage(self):
+        # Batched requests share one generation, so usage is only kept in aggregate (stats())
+        return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+        busy = counters["busy_seconds"]
+        return {
+            "backend": self.name,
+            "model": self.model_name,
+            "loaded": self._llm is not None,
+            "queue_depth": self._requests.qsize(),
+            "tokens_per_sec": round(counters["completion_tokens"] / busy, 1) if busy else None,
+            **counters,
+            "busy_seconds": round(busy, 2),
+        }
+
+
+def create_backend(groq_model, name=None):
+    """Builds the backend named by SBOX_LLM_BACKEND (groq, local or stub)."""
+    name = (name or os.getenv("SBOX_LLM_BACKEND", "groq")).lower()
+    if name == "groq":
+        return GroqBackend(groq_model)
+    if name == "local":
+        return LocalGGUFBackend(preload=os.getenv("SBOX_LOCAL_PRELOAD", "0") == "1")
+    if name == "stub":
+        return StubBackend()
+    raise ValueError(f"Unknown SBOX_LLM_BACKEND '{name}' (expected groq, local or stub)")
@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+
+from backend.log import get_logger
+
+# ------------------------- #
+# Cache Settings
+# ------------------------- #
+
+CACHE_MAX_ENTRIES = int(os.getenv("SBOX_LLM_CACHE_SIZE", "4096"))
+CACHE_TTL_SECONDS = int(os.getenv("SBOX_LLM_CACHE_TTL", str(7 * 24 * 3600)))
+# SQLite file for the persistent tier; set to an empty string to keep the cache in memory only
+CACHE_DB = os.getenv("SBOX_LLM_CACHE_DB", "Sbox.db")
+# Rows kept on disk; expired rows and the oldest beyond this are deleted every PURGE_INTERVAL seconds
+CACHE_DISK_MAX_ROWS = int(os.getenv("SBOX_LLM_CACHE_DISK_ROWS", "200000"))
+PURGE_INTERVAL = 300.0
+
+log = get_logger("llm_cache")
+
+
+def normalize_text(text: str) -> str:
+    text = unicodedata.normalize("NFC", text or "")
+    return " ".join(text.split())
+
+
+def make_key(model: str, task: str, text: str, max_tokens: int) -> str:
+    text_hash = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+    raw = f"{model}\x1f{task}\x1f{max_tokens}\x1f{text_hash}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def install(conn):
+    """Migration step (and setup of a standalone SBOX_LLM_CACHE_DB file)."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            key TEXT PRIMARY KEY, model TEXT NOT NULL, task TEXT NOT NULL,
+            value TEXT NOT NULL, created_at REAL NOT NULL, expires_at REAL NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_llm_cache_model ON llm_cache (model)')
+    install_expiry_index(conn)
+
+
+def install_expiry_index(conn):
+    """Migration step: lets purge() find expired and oldest rows without scanning the table."""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_llm_cache_expires ON llm_cache (expires_at)')
+
+
+# ------------------------- #
+# Two-tier LLM Result Cache
+# ------------------------- #
+
+class LLMCache:
+    """
+    In-process LRU with TTL in front of an optional SQLite table.
+    Keys are content-addressed on (model, task, normalized text, max_tokens).
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS, db_path=CACHE_DB,
+                 disk_max_rows=CACHE_DISK_MAX_ROWS, purge_interval=PURGE_INTERVAL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path or None
+        self.disk_max_rows = disk_max_rows
+        self.purge_interval = purge_interval
+        self._last_purge = time.time()
+        self._entries = OrderedDict()  # key -> (model, expires_at, value)
+        self._lock = threading.Lock()
+        self._conn = None
+        self._db_lock = threading.Lock()
+        self.counters = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "expired": 0, "stores": 0, "purged": 0}
+
+    # --- SQLite tier ---
+    def _connect(self):
+        """The tier's one connection, opened on first use; callers hold _db_lock."""
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False)
+            exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'llm_cache'").fetchone()
+            if not exists:
+                if conn.execute('PRAGMA user_version').fetchone()[0]:
+                    # The app database: the table comes from a migration, never from DDL at runtime
+                    conn.close()
+                    log.warning("llm_cache table missing in %s, keeping the cache in memory: run `flask --app app migrate`",
+                                self.db_path)
+                    self.db_path = None
+                    return None
+                install(conn)  # a separate cache file
+                conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _disk(self, operation):
+        """Runs operation(conn) on the SQLite tier; errors are logged and the connection reopened next time."""
+        with self._db_lock:
+            try:
+                conn = self._connect()
+                return operation(conn) if conn is not None else None
+            except sqlite3.Error as e:
+                log.error("disk tier error: %s", e)
+                if self._conn is not None:
+                    self._conn.close()
+                    self._conn = None
+                return None
+
+    def _disk_get(self, key, now):
+        def lookup(conn):
+            row = conn.execute('SELECT model, value, expires_at FROM llm_cache WHERE key = ?', (key,)).fetchone()
+            if row and row[2] <= now:
+                conn.execute('DELETE FROM llm_cache WHERE key = ?', (key,))
+                conn.commit()
+                return None
+            return row
+        return self._disk(lookup)
+
+    def _disk_set(self, key, model, task, value, now):
+        def store(conn):
+            conn.execute(
+                'INSERT OR REPLACE INTO llm_cache (key, model, task, value, created_at, expires_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (key, model, task, json.dumps(value), now, now + self.ttl)
+            )
+            conn.commit()
+        self._disk(store)
+        if now - self._last_purge >= self.purge_interval:
+            self.purge(now)
+
+    def purge(self, now=None):
+        """
+        Deletes expired rows, which lookups only remove for keys asked for
+        again, and the oldest rows beyond disk_max_rows. Returns rows deleted.
+        """
+        now = now or time.time()
+        self._last_purge = now
+        if not self.db_path:
+            return 0
+
+        def delete(conn):
+            removed = conn.execute('DELETE FROM llm_cache WHERE expires_at <= ?', (now,)).rowcount
+            removed += conn.execute('''
+                DELETE FROM llm_cache WHERE key IN (
+                    SELECT key FROM llm_cache ORDER BY expires_at DESC LIMIT -1 OFFSET ?
+                )
+            ''', (self.disk_max_rows,)).rowcount
+            conn.commit()
+            return removed
+        removed = self._disk(delete) or 0
+        if removed:
+            with self._lock:
+                self.counters["purged"] += removed
+            log.info("purged %d rows from the disk tier", removed)
+        return removed
+
+    # --- Memory tier ---
+    def _remember(self, key, model, expires_at, value):
+        # Caller holds the lock
+        self._entries[key] = (model, expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._entries.move_to_end(key)
+                    self.counters["hits"] += 1
+                    return entry[2]
+                del self._entries[key]
+                self.counters["expired"] += 1
+
+        if self.db_path:
+            row = self._disk_get(key, now)
+            if row:
+                value = json.loads(row[1])
+                with self._lock:
+                    self._remember(key, row[0], row[2], value)
+                    self.counters["disk_hits"] += 1
+                return value
+
+        with self._lock:
+            self.counters["misses"] += 1
+        return None
+
+    def set(self, key, model, task, value):
+        now = time.time()
+        with self._lock:
+            self._remember(key, model, now + self.ttl, value)
+            self.counters["stores"] += 1
+        if self.db_path:
+            self._disk_set(key, model, task, value, now)
+
+    def invalidate(self, model=None):
+        """Drops every entry produced by `model`, or the whole cache when model is None."""
+        with self._lock:
+            stale = [k for k, entry in self._entries.items() if model is None or entry[0] == model]
+            for key in stale:
+                del self._entries[key]
+        removed = len(stale)
+        if self.db_path:
+            def delete(conn):
+                if model is None:
+                    cur = conn.execute('DELETE FROM llm_cache')
+                else:
+                    cur = conn.execute('DELETE FROM llm_cache WHERE model = ?', (model,))
+                conn.commit()
+                return cur.rowcount
+            removed = max(removed, self._disk(delete) or 0)
+        return removed
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+            size = len(self._entries)
+        lookups = counters["hits"] + counters["disk_hits"] + counters["misses"]
+        counters.update({
+            "size": size,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "disk_max_rows": self.disk_max_rows,
+            "persistent": bool(self.db_path),
+            "hit_rate": round((counters["hits"] + counters["disk_hits"]) / lookups, 3) if lookups else None,
+        })
+        return counters
+
+
+cache = LLMCache()
@@ -0,0 +1,65 @@
+import os
+import json
+import logging
+
+# ------------------------- #
+# Structured Logging
+# ------------------------- #
+# SBOX_LOG_LEVEL picks the level (default INFO) and SBOX_LOG_FORMAT=json
+# emits one JSON object per line. Fields passed as `extra={...}` appear as
+# key=value pairs (text) or top-level keys (json). Debug dumps of raw model
+# output cost nothing unless DEBUG is enabled: the level check happens
+# before the message is formatted.
+
+LOG_LEVEL = os.getenv("SBOX_LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("SBOX_LOG_FORMAT", "text").lower()
+
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def _extra_fields(record):
+    return {k: v for k, v in vars(record).items() if k not in _RESERVED}
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s [%(name)s] %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        fields = _extra_fields(record)
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        return line
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            **_extra_fields(record),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level=LOG_LEVEL, fmt=LOG_FORMAT):
+    """Installs one handler on the 'sbox' logger; safe to call more than once."""
+    logger = logging.getLogger("sbox")
+    logger.setLevel(level)
+    logger.propagate = False
+    if not logger.handlers:
+        logger.addHandler(logging.StreamHandler())
+    logger.handlers[0].setFormatter(JSONFormatter() if fmt == "json" else TextFormatter())
+    return logger
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"sbox.{name}")
+
+
+configure_logging()
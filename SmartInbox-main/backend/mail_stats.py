@@ -0,0 +1,163 @@
+import sys
+import sqlite3
+import argparse
+from collections import Counter
+
+# ------------------------- #
+# Materialized Mail Stats
+# ------------------------- #
+# Triggers on both email tables keep these counters current for every writer
+# (send, read receipts, enrichment workers, backfill, deletes), so the admin
+# dashboard reads a handful of rows instead of scanning all mail.
+
+SOURCES = {'internal': 'emails', 'external': 'external_emails'}
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS mail_totals (
+        source TEXT PRIMARY KEY,
+        total INTEGER NOT NULL DEFAULT 0,
+        spam INTEGER NOT NULL DEFAULT 0,
+        opened INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS mail_daily (
+        source TEXT NOT NULL,
+        day TEXT NOT NULL,
+        total INTEGER NOT NULL DEFAULT 0,
+        spam INTEGER NOT NULL DEFAULT 0,
+        opened INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (source, day)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS tone_counts (
+        tone TEXT PRIMARY KEY,    -- stored label, e.g. 'polite, formal'
+        total INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID;
+'''
+
+
+def _apply(source, row, sign, opened):
+    """Trigger statements adding (sign=+1) or removing (sign=-1) one row (NEW or OLD) from the counters."""
+    values = f"'{source}', {sign}, {sign} * ({row}.is_spam != 0), {sign} * ({opened})"
+    return f'''
+        INSERT INTO mail_totals (source, total, spam, opened) VALUES ({values})
+            ON CONFLICT (source) DO UPDATE SET total = total + excluded.total,
+                spam = spam + excluded.spam, opened = opened + excluded.opened;
+        INSERT INTO mail_daily (source, day, total, spam, opened)
+            VALUES ('{source}', COALESCE(date({row}.sent_at), ''), {sign}, {sign} * ({row}.is_spam != 0), {sign} * ({opened}))
+            ON CONFLICT (source, day) DO UPDATE SET total = total + excluded.total,
+                spam = spam + excluded.spam, opened = opened + excluded.opened;
+        INSERT INTO tone_counts (tone, total) SELECT {row}.tone, {sign} WHERE {row}.tone IS NOT NULL
+            ON CONFLICT (tone) DO UPDATE SET total = total + excluded.total;'''
+
+
+def _triggers(source, table):
+    new_opened = "NEW.opened_at IS NOT NULL" if table == 'emails' else "0"
+    old_opened = "OLD.opened_at IS NOT NULL" if table == 'emails' else "0"
+    watched = "sent_at, is_spam, tone, opened_at" if table == 'emails' else "sent_at, is_spam, tone"
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS {table}_stats_insert AFTER INSERT ON {table} BEGIN"
+        f"{_apply(source, 'NEW', 1, new_opened)}\nEND",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_stats_delete AFTER DELETE ON {table} BEGIN"
+        f"{_apply(source, 'OLD', -1, old_opened)}\nEND",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_stats_update AFTER UPDATE OF {watched} ON {table} BEGIN"
+        f"{_apply(source, 'OLD', -1, old_opened)}{_apply(source, 'NEW', 1, new_opened)}\nEND",
+    ]
+
+
+def rebuild(conn):
+    """Recomputes every counter from the email tables (run inside a transaction)."""
+    conn.execute("DELETE FROM mail_totals")
+    conn.execute("DELETE FROM mail_daily")
+    conn.execute("DELETE FROM tone_counts")
+    for source, table in SOURCES.items():
+        opened = "COUNT(opened_at)" if table == 'emails' else "0"
+        conn.execute(f'''
+            INSERT INTO mail_daily (source, day, total, spam, opened)
+            SELECT '{source}', COALESCE(date(sent_at), ''), COUNT(*), COALESCE(SUM(is_spam != 0), 0), {opened}
+            FROM {table} GROUP BY 2
+        ''')
+        conn.execute(f'''
+            INSERT INTO mail_totals (source, total, spam, opened)
+            SELECT '{source}', COALESCE(SUM(total), 0), COALESCE(SUM(spam), 0), COALESCE(SUM(opened), 0)
+            FROM mail_daily WHERE source = '{source}'
+        ''')
+        conn.execute(f'''
+            INSERT INTO tone_counts (tone, total)
+            SELECT tone, COUNT(*) FROM {table} WHERE tone IS NOT NULL GROUP BY tone
+            ON CONFLICT (tone) DO UPDATE SET total = total + excluded.total
+        ''')
+
+
+def install(c):
+    """Migration step: counter tables, triggers and an initial rebuild from existing mail."""
+    # executescript() would commit the migration's transaction, so run the statements one by one
+    for statement in SCHEMA.split(';'):
+        if statement.strip():
+            c.execute(statement)
+    for source, table in SOURCES.items():
+        for trigger in _triggers(source, table):
+            c.execute(trigger)
+    rebuild(c)
+
+
+# ------------------------- #
+# Dashboard Reads
+# ------------------------- #
+
+def split_tones(label, tones):
+    """'Polite, formal' -> ['polite', 'formal'], keeping only known tones."""
+    return [t for t in (part.strip().lower() for part in (label or '').split(',')) if t in tones]
+
+
+def tone_tally(conn, tones) -> Counter:
+    """Per-tone counts; a multi-tone label counts once towards each of its tones."""
+    tally = Counter()
+    for row in conn.execute("SELECT tone, total FROM tone_counts WHERE total > 0"):
+        for tone in split_tones(row[0], tones):
+            tally[tone] += row[1]
+    return tally
+
+
+def totals(conn) -> dict:
+    """{source: {'total', 'spam', 'opened'}} for both email tables."""
+    result = {source: {'total': 0, 'spam': 0, 'opened': 0} for source in SOURCES}
+    for row in conn.execute("SELECT source, total, spam, opened FROM mail_totals"):
+        result[row[0]] = {'total': row[1], 'spam': row[2], 'opened': row[3]}
+    return result
+
+
+def daily(conn, days=30) -> list:
+    """The most recent `days` days as dicts with per-source totals, oldest first."""
+    rows = conn.execute('''
+        SELECT day, source, total, spam, opened FROM mail_daily
+        WHERE day >= date('now', ?) ORDER BY day
+    ''', (f'-{int(days)} days',)).fetchall()
+    series = {}
+    for day, source, total, spam, opened in rows:
+        entry = series.setdefault(day, {'day': day, 'internal': 0, 'external': 0, 'spam': 0, 'opened': 0})
+        entry[source] += total
+        entry['spam'] += spam
+        entry['opened'] += opened
+    return list(series.values())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild the admin dashboard counters from the email tables.")
+    parser.add_argument("--db", default="Sbox.db")
+    args = parser.parse_args(argv)
+    conn = sqlite3.connect(args.db, timeout=30, isolation_level=None)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        rebuild(conn)
+        conn.execute("COMMIT")
+        for source, counts in totals(conn).items():
+            print(f"{source}: {counts}")
+    except sqlite3.OperationalError as e:
+        print(f"Rebuild failed (has the app migrated this database?): {e}", file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
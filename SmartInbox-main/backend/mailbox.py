@@ -0,0 +1,145 @@
+import json
+import base64
+
+# ------------------------- #
+# Keyset Pagination Helpers
+# ------------------------- #
+# Lists are ordered newest first on (sent_at, source, id). A cursor is the
+# sort key of the last row already shown, so fetching the next page is an
+# index range scan no matter how deep the user has scrolled.
+
+PAGE_SIZE = 50
+SNIPPET_CHARS = 160
+
+INTERNAL, EXTERNAL = 'Internal', 'External'
+SOURCE_TABLES = {'internal': 'emails', 'external': 'external_emails'}
+
+
+def encode_cursor(row) -> str:
+    key = [row['sort_sent_at'], row['source'], row['id']]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Returns (sent_at, source, id) or None; raises ValueError on a malformed cursor."""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        sent_at, source, email_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return str(sent_at), str(source), int(email_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def _after(alias, source, cursor):
+    """SQL predicate (and params) selecting rows of one table that sort after `cursor`."""
+    cursor = decode_cursor(cursor)
+    if cursor is None:
+        return "1", ()
+    sent_at, cursor_source, cursor_id = cursor
+    # Rows with the same timestamp are ordered by source, then id
+    if source < cursor_source:
+        tie, tie_params = "1", ()
+    elif source == cursor_source:
+        tie, tie_params = f"{alias}.id < ?", (cursor_id,)
+    else:
+        tie, tie_params = "0", ()
+    return (f"{alias}.sent_at <= ? AND ({alias}.sent_at < ? OR {tie})",
+            (sent_at, sent_at) + tie_params)
+
+
+def _page(conn, sql, params, limit):
+    rows = [dict(row) for row in conn.execute(sql, params + (limit + 1,)).fetchall()]
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+# ------------------------- #
+# List Queries (headers and snippets only)
+# ------------------------- #
+
+def inbox_page(conn, recipient_email, cursor=None, limit=PAGE_SIZE):
+    after, after_params = _after('e', INTERNAL, cursor)
+    return _page(conn, f"""
+        SELECT
+            e.id, e.subject, substr(e.body, 1, {SNIPPET_CHARS}) AS snippet, e.summary,
+            strftime('%Y-%m-%d %H:%M', e.sent_at) AS sent_at, e.sent_at AS sort_sent_at,
+            e.opened_at, e.tone, e.is_spam, e.enrichment_status, '{INTERNAL}' AS source,
+            u.email AS sender_email
+        FROM emails e
+        JOIN users u ON e.sender_id = u.id
+        WHERE e.recipient_email = ? AND {after}
+        ORDER BY e.sent_at DESC, e.id DESC
+        LIMIT ?
+    """, (recipient_email,) + after_params, limit)
+
+
+def inbox_item(conn, email_id):
+    """One inbox row by id, with the same columns as inbox_page (for pushed updates)."""
+    row = conn.execute(f"""
+        SELECT
+            e.id, e.subject, substr(e.body, 1, {SNIPPET_CHARS}) AS snippet, e.summary,
+            strftime('%Y-%m-%d %H:%M', e.sent_at) AS sent_at, e.sent_at AS sort_sent_at,
+            e.opened_at, e.tone, e.is_spam, e.enrichment_status, '{INTERNAL}' AS source,
+            u.email AS sender_email, e.sender_id, r.id AS recipient_id
+        FROM emails e
+        JOIN users u ON e.sender_id = u.id
+        LEFT JOIN users r ON r.email = e.recipient_email
+        WHERE e.id = ?
+    """, (email_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def sent_page(conn, sender_id, cursor=None, limit=PAGE_SIZE):
+    """Internal and external sent mail merged in SQL; each arm reads its (sender_id, sent_at) index."""
+    internal_after, internal_params = _after('e', INTERNAL, cursor)
+    external_after, external_params = _after('ee', EXTERNAL, cursor)
+    return _page(conn, f"""
+        SELECT e.id, e.recipient_email, e.subject,
+               strftime('%Y-%m-%d %H:%M', e.sent_at) AS sent_at, e.sent_at AS sort_sent_at,
+               CASE WHEN e.opened_at IS NULL THEN NULL
+                    ELSE strftime('%Y-%m-%d %H:%M', e.opened_at)
+               END AS opened_at,
+               e.is_spam, e.tone, e.enrichment_status, NULL AS delivery_status, '{INTERNAL}' AS source
+        FROM emails e
+        WHERE e.sender_id = ? AND {internal_after}
+        UNION ALL
+        SELECT ee.id, ee.recipient_email, ee.subject,
+               strftime('%Y-%m-%d %H:%M', ee.sent_at) AS sent_at, ee.sent_at AS sort_sent_at,
+               NULL AS opened_at,
+               ee.is_spam, ee.tone, ee.enrichment_status, ee.delivery_status, '{EXTERNAL}' AS source
+        FROM external_emails ee
+        WHERE ee.sender_id = ? AND {external_after}
+        ORDER BY sort_sent_at DESC, source DESC, id DESC
+        LIMIT ?
+    """, (sender_id,) + internal_params + (sender_id,) + external_params, limit)
+
+
+def admin_page(conn, source, cursor=None, limit=PAGE_SIZE):
+    table = SOURCE_TABLES[source]
+    label = INTERNAL if source == 'internal' else EXTERNAL
+    after, after_params = _after('e', label, cursor)
+    opened = "e.opened_at" if table == 'emails' else "NULL"
+    return _page(conn, f"""
+        SELECT e.id, e.recipient_email, e.subject, e.sent_at, e.sent_at AS sort_sent_at,
+               {opened} AS opened_at, e.tone, e.is_spam, e.summary, e.enrichment_status,
+               '{label}' AS source, u.email AS sender_email
+        FROM {table} e
+        JOIN users u ON e.sender_id = u.id
+        WHERE {after}
+        ORDER BY e.sent_at DESC, e.id DESC
+        LIMIT ?
+    """, after_params, limit)
+
+
+def email_body(conn, source, email_id, user_id, user_email, is_admin=False):
+    """The full body of one message, if the user may read it (recipient, sender or admin)."""
+    table = SOURCE_TABLES[source]
+    if table == 'emails':
+        row = conn.execute("SELECT body, sender_id, recipient_email FROM emails WHERE id = ?", (email_id,)).fetchone()
+        allowed = row is not None and (is_admin or row['sender_id'] == user_id or row['recipient_email'] == user_email)
+    else:
+        row = conn.execute("SELECT body, sender_id FROM external_emails WHERE id = ?", (email_id,)).fetchone()
+        allowed = row is not None and (is_admin or row['sender_id'] == user_id)
+    return (row['body'] or '') if allowed else None
@@ -0,0 +1,229 @@
+import os
+import re
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# ------------------------- #
+# Metric Types
+# ------------------------- #
+# A small Prometheus-compatible registry (text exposition format 0.0.4) with
+# no dependencies. Components that already keep counters (caches, queues,
+# pools) are exported through collectors that are called at scrape time.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + [f'{n}="{v}"' for n, v in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labelvalues, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, labelvalues)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}  # labelvalues -> [bucket counts..., sum, count]
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = sorted((k, list(v)) for k, v in self._series.items())
+        for labelvalues, series in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labelvalues, [('le', _number(bound))])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, labelvalues, [('le', '+Inf')])} {series[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labelvalues)} {_number(series[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labelvalues)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = {}
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_stats(self, prefix, stats_fn):
+        """Exports every numeric value of stats_fn() (nested dicts flattened) as a gauge sbox_<prefix>_<key>."""
+        self._collectors[prefix] = stats_fn
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for prefix, stats_fn in self._collectors.items():
+            try:
+                stats = stats_fn()
+            except Exception as e:
+                lines.append(f"# sbox_{prefix}: collector failed: {type(e).__name__}")
+                continue
+            for key, value in _flatten(stats):
+                name = f"sbox_{prefix}_{key}"
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+METRIC_NAME_RE = re.compile(r"[^a-zA-Z0-9_]")
+
+
+def _flatten(stats, prefix=""):
+    for key, value in (stats or {}).items():
+        name = METRIC_NAME_RE.sub("_", f"{prefix}{key}")
+        if isinstance(value, dict):
+            yield from _flatten(value, name + "_")
+        elif isinstance(value, bool):
+            yield name, int(value)
+        elif isinstance(value, (int, float)):
+            yield name, value
+
+
+# ------------------------- #
+# Hot-path Metrics
+# ------------------------- #
+
+REGISTRY = Registry()
+http_seconds = REGISTRY.histogram("sbox_http_request_seconds", "Request latency by route", ("method", "route", "status"))
+llm_seconds = REGISTRY.histogram("sbox_llm_request_seconds", "LLM round trip by task (cache misses only)", ("task", "backend"))
+llm_tokens = REGISTRY.histogram("sbox_llm_tokens", "Tokens per LLM call (provider usage, else ~4 chars/token)",
+                                ("task", "kind"), buckets=TOKEN_BUCKETS)
+llm_cached = REGISTRY.counter("sbox_llm_cached_responses_total", "LLM results served from the cache", ("task",))
+llm_errors = REGISTRY.counter("sbox_llm_errors_total", "LLM calls that failed after retries", ("task",))
+sql_seconds = REGISTRY.histogram("sbox_sqlite_statement_seconds", "Time in execute() by statement (verb and table)",
+                                 ("statement",), buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0))
+smtp_seconds = REGISTRY.histogram("sbox_smtp_send_seconds", "SMTP delivery attempts by result", ("result",))
+bcrypt_seconds = REGISTRY.histogram("sbox_bcrypt_seconds", "Password hashing and verification", ("op",))
+job_seconds = REGISTRY.histogram("sbox_job_seconds", "Background job run time by kind and outcome", ("kind", "result"))
+
+VERB_RE = re.compile(r"^\s*(\w+)")
+UPDATE_RE = re.compile(r"^\s*UPDATE\s+(?:OR\s+\w+\s+)?(\w+)", re.IGNORECASE)
+TABLE_RE = re.compile(r"\b(?:FROM|INTO|TABLE|INDEX|ON)\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)", re.IGNORECASE)
+_statement_labels = {}
+
+
+def statement_label(sql: str) -> str:
+    """'SELECT emails' for a SELECT ... FROM emails ...; cached so the regexes run once per distinct SQL."""
+    label = _statement_labels.get(sql)
+    if label is None:
+        match = VERB_RE.match(sql)
+        verb = match.group(1).upper() if match else "OTHER"
+        table = UPDATE_RE.match(sql) if verb == "UPDATE" else TABLE_RE.search(sql)
+        label = f"{verb} {table.group(1)}" if table and verb not in ("PRAGMA", "BEGIN", "COMMIT", "ROLLBACK") else verb
+        if len(_statement_labels) < 4096:
+            _statement_labels[sql] = label
+    return label
+
+
+def estimate_tokens(text) -> int:
+    return len(text or "") // 4
+
+
+# ------------------------- #
+# Per-request Profiling
+# ------------------------- #
+# SBOX_PROFILE=1 profiles every request, SBOX_PROFILE=header only requests
+# sent with "X-Sbox-Profile: 1". Time spent in SQL, LLM and SMTP calls is
+# summed per category and returned in a Server-Timing header.
+
+PROFILE_MODE = os.getenv("SBOX_PROFILE", "0").lower()
+_local = threading.local()
+
+
+def start_profile():
+    _local.profile = {}
+    _local.started = time.perf_counter()
+
+
+def end_profile():
+    """{key: [seconds, calls]} plus a 'total' entry, or None if the request was not profiled."""
+    profile = getattr(_local, "profile", None)
+    if profile is None:
+        return None
+    _local.profile = None
+    profile["total"] = [time.perf_counter() - _local.started, 1]
+    return profile
+
+
+def profile_add(key, seconds):
+    profile = getattr(_local, "profile", None)
+    if profile is not None:
+        entry = profile.get(key)
+        if entry is None:
+            profile[key] = [seconds, 1]
+        else:
+            entry[0] += seconds
+            entry[1] += 1
+
+
+@contextmanager
+def timed(histogram, *labelvalues, profile=None):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        histogram.observe(elapsed, *labelvalues)
+        if profile:
+            profile_add(profile, elapsed)
+
+
+def server_timing(profile) -> str:
+    parts = []
+    for key, (seconds, calls) in sorted(profile.items(), key=lambda item: -item[1][0]):
+        name = METRIC_NAME_RE.sub("-", key)
+        parts.append(f'{name};dur={seconds * 1000:.2f};desc="{key} x{calls}"')
+    return ", ".join(parts)
@@ -0,0 +1,222 @@
+import os
+import time
+import smtplib
+import threading
+from collections import deque
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from email.utils import formataddr
+
+from backend import metrics
+from backend.jobs import PermanentJobError
+from backend.rate_limit import RateLimiter
+
+# ------------------------- #
+# Delivery Settings
+# ------------------------- #
+# External mail is written to external_emails with delivery_status 'queued'
+# and a 'deliver_email' job in the same transaction; delivery workers send it
+# through the pool below. Point SBOX_SMTP_HOST/PORT at a local sink
+# (python -m backend.fake_smtp) for benchmarks.
+
+SMTP_HOST = os.getenv("SBOX_SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SBOX_SMTP_PORT", "465"))
+SMTP_SSL = os.getenv("SBOX_SMTP_SSL", "1" if SMTP_PORT == 465 else "0") != "0"
+SMTP_STARTTLS = os.getenv("SBOX_SMTP_STARTTLS", "1" if SMTP_PORT == 587 else "0") != "0"
+SMTP_USER = os.getenv("SBOX_SMTP_USER") or os.getenv("SENDER_EMAIL")
+SMTP_PASSWORD = os.getenv("SBOX_SMTP_PASSWORD") or os.getenv("EMAIL_PASS")
+SMTP_POOL_SIZE = int(os.getenv("SBOX_SMTP_POOL", "2"))
+SMTP_MAX_PER_CONNECTION = int(os.getenv("SBOX_SMTP_MAX_PER_CONNECTION", "100"))
+SMTP_IDLE_SECONDS = float(os.getenv("SBOX_SMTP_IDLE_SECONDS", "60"))
+
+# Messages per minute the relay accepts from one account before throttling (0 = unlimited).
+# Conservative defaults; SBOX_SMTP_RATE overrides them.
+PROVIDER_RATES = {"smtp.gmail.com": 20, "smtp.office365.com": 30}
+SMTP_RATE = int(os.getenv("SBOX_SMTP_RATE", str(PROVIDER_RATES.get(SMTP_HOST, 0))))
+THROTTLE_PAUSE = 30.0  # seconds every worker backs off after a 421/450 from the relay
+
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1")
+QUEUED, RETRYING, SENT, FAILED = "queued", "retrying", "sent", "failed"
+
+
+class TransientDeliveryError(Exception):
+    """The relay could not take the message right now; the job is retried with backoff."""
+
+
+# ------------------------- #
+# SMTP Connection Pool
+# ------------------------- #
+
+class SMTPPool:
+    """
+    Up to `size` authenticated SMTP sessions, each reused for many messages so
+    the TCP/TLS handshake and login are paid once per session rather than once
+    per message. Sessions are recycled after max_per_connection messages or
+    idle_seconds without use (relays drop idle clients).
+    """
+
+    def __init__(self, host, port, username=None, password=None, use_ssl=True, starttls=False,
+                 size=2, max_per_connection=100, idle_seconds=60.0, timeout=30.0):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_ssl = use_ssl
+        self.starttls = starttls
+        self.size = size
+        self.max_per_connection = max_per_connection
+        self.idle_seconds = idle_seconds
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = deque()  # (server, messages sent on it, last used)
+        self._lock = threading.Lock()
+        self.counters = {"opened": 0, "reused": 0, "sent": 0, "errors": 0, "recycled": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _open(self):
+        if self.use_ssl:
+            server = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.starttls:
+                server.starttls()
+        if self.username and self.password:
+            server.login(self.username, self.password)
+        self._count("opened")
+        return server
+
+    @staticmethod
+    def _close(server):
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+    def _checkout(self):
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                server, sent, last_used = self._idle.pop()
+            if now - last_used < self.idle_seconds:
+                self._count("reused")
+                return server, sent
+            self._close(server)
+            self._count("recycled")
+        return self._open(), 0
+
+    def _checkin(self, server, sent):
+        if sent >= self.max_per_connection:
+            self._close(server)
+            self._count("recycled")
+            return
+        with self._lock:
+            self._idle.append((server, sent, time.monotonic()))
+
+    def send(self, from_addr, to_addrs, message: str):
+        """Sends one message on a pooled session; raises smtplib/OSError errors unchanged."""
+        with self._slots:
+            server, sent = self._checkout()
+            try:
+                try:
+                    server.sendmail(from_addr, to_addrs, message)
+                except smtplib.SMTPServerDisconnected:
+                    if sent == 0:
+                        raise
+                    # The relay dropped a pooled session; one fresh session before giving up
+                    server.close()
+                    server, sent = self._open(), 0
+                    server.sendmail(from_addr, to_addrs, message)
+            except Exception:
+                server.close()
+                self._count("errors")
+                raise
+            self._count("sent")
+            self._checkin(server, sent + 1)
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for server, _, _ in idle:
+            self._close(server)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"host": self.host, "port": self.port, "size": self.size, "idle": len(self._idle), **self.counters}
+
+
+pool = SMTPPool(SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASSWORD, use_ssl=SMTP_SSL, starttls=SMTP_STARTTLS,
+                size=SMTP_POOL_SIZE, max_per_connection=SMTP_MAX_PER_CONNECTION, idle_seconds=SMTP_IDLE_SECONDS)
+limiter = RateLimiter(requests_per_minute=SMTP_RATE)
+
+
+# ------------------------- #
+# Delivery
+# ------------------------- #
+
+def build_message(from_addr, sender_name, to_email, subject, body) -> str:
+    msg = MIMEMultipart()
+    msg["From"] = formataddr((f"{sender_name} (via Sbox)", from_addr))
+    msg["To"] = to_email
+    msg["Subject"] = f"(Sbox: {sender_name}) {subject}"
+    msg.attach(MIMEText(body or '', "plain"))
+    return msg.as_string()
+
+
+def _is_throttle(code):
+    return code in (421, 450)  # "too many connections/messages, slow down"
+
+
+def deliver(sender_name, to_email, subject, body):
+    """
+    Sends one message through the pool. Raises PermanentJobError when retrying
+    cannot help (5xx, refused recipient) and TransientDeliveryError otherwise.
+    """
+    from_addr = SMTP_USER or f"sbox@{SMTP_HOST}"
+    if not (SMTP_USER and SMTP_PASSWORD) and SMTP_HOST not in LOCAL_HOSTS:
+        # Like a failed login: retried with backoff so fixing .env (and restarting) recovers the queue
+        raise TransientDeliveryError("Missing SENDER_EMAIL or EMAIL_PASS in .env file")
+    message = build_message(from_addr, sender_name, to_email, subject, body)
+    limiter.acquire()
+    # Timed after the rate limiter so the histogram shows the relay, not our own throttling
+    started = time.perf_counter()
+    try:
+        _send(from_addr, to_email, message)
+    except PermanentJobError:
+        metrics.smtp_seconds.observe(time.perf_counter() - started, "rejected")
+        raise
+    except TransientDeliveryError:
+        metrics.smtp_seconds.observe(time.perf_counter() - started, "deferred")
+        raise
+    metrics.smtp_seconds.observe(time.perf_counter() - started, "sent")
+
+
+def _send(from_addr, to_email, message):
+    try:
+        pool.send(from_addr, [to_email], message)
+    except smtplib.SMTPRecipientsRefused as e:
+        code, reply = next(iter(e.recipients.values()))
+        if _is_throttle(code):
+            limiter.block_for(THROTTLE_PAUSE)
+        if code >= 500:
+            raise PermanentJobError(f"Recipient refused: {code} {reply.decode(errors='replace')}") from e
+        raise TransientDeliveryError(f"Recipient deferred: {code} {reply.decode(errors='replace')}") from e
+    except smtplib.SMTPAuthenticationError as e:
+        # Bad credentials affect every message; retry so fixing .env recovers the queue
+        raise TransientDeliveryError(f"SMTP login failed: {e.smtp_code}") from e
+    except smtplib.SMTPResponseException as e:
+        if _is_throttle(e.smtp_code):
+            limiter.block_for(THROTTLE_PAUSE)
+        if e.smtp_code >= 500:
+            raise PermanentJobError(f"Rejected by relay: {e.smtp_code} {e.smtp_error.decode(errors='replace')}") from e
+        raise TransientDeliveryError(f"Deferred by relay: {e.smtp_code} {e.smtp_error.decode(errors='replace')}") from e
+    except (smtplib.SMTPException, OSError) as e:
+        raise TransientDeliveryError(f"{type(e).__name__}: {e}") from e
+
+
+def stats() -> dict:
+    return {"pool": pool.stats(), "rate_limit": limiter.stats()}
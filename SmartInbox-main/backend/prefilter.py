@@ -0,0 +1,263 @@
+import os
+import re
+import math
+import time
+import zlib
+import sqlite3
+import threading
+from collections import Counter, defaultdict
+
+from backend.log import get_logger
+
+log = get_logger("prefilter")
+
+# ------------------------- #
+# Hashed n-gram Features
+# ------------------------- #
+
+N_FEATURES = 1 << 18
+TOKEN_RE = re.compile(r"[a-z0-9']+")
+
+
+def hashed_features(text: str) -> Counter:
+    """Word unigrams and bigrams hashed into N_FEATURES buckets (crc32 is stable across processes)."""
+    tokens = TOKEN_RE.findall((text or "").lower())
+    grams = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    return Counter(zlib.crc32(g.encode("utf-8")) & (N_FEATURES - 1) for g in grams)
+
+
+# ------------------------- #
+# Multinomial Naive Bayes
+# ------------------------- #
+
+class HashedNaiveBayes:
+    def __init__(self, alpha=1.0):
+        self.alpha = alpha
+        self.classes = []
+        self._log_prior = {}
+        self._log_prob = {}      # class -> {feature: log P(feature | class)}
+        self._log_unseen = {}    # class -> log P(unseen feature | class)
+
+    def fit(self, feature_counts, labels):
+        feature_totals = defaultdict(Counter)
+        docs = Counter()
+        for features, label in zip(feature_counts, labels):
+            feature_totals[label].update(features)
+            docs[label] += 1
+
+        total_docs = sum(docs.values())
+        self.classes = sorted(docs)
+        for label in self.classes:
+            counts = feature_totals[label]
+            denominator = sum(counts.values()) + self.alpha * N_FEATURES
+            self._log_prior[label] = math.log(docs[label] / total_docs)
+            self._log_prob[label] = {f: math.log((c + self.alpha) / denominator) for f, c in counts.items()}
+            self._log_unseen[label] = math.log(self.alpha / denominator)
+        return self
+
+    def predict_proba(self, features) -> dict:
+        scores = {}
+        for label in self.classes:
+            log_prob, unseen = self._log_prob[label], self._log_unseen[label]
+            scores[label] = self._log_prior[label] + sum(n * log_prob.get(f, unseen) for f, n in features.items())
+        top = max(scores.values())
+        exp = {label: math.exp(score - top) for label, score in scores.items()}
+        norm = sum(exp.values())
+        return {label: value / norm for label, value in exp.items()}
+
+
+# ------------------------- #
+# First-stage Pre-filter
+# ------------------------- #
+# Naive Bayes posteriors over hashed n-grams pile up near 0 and 1, so a
+# threshold is not a calibrated confidence. Every training run holds out
+# one row in HOLDOUT_EVERY, checks how often the confident verdicts agree
+# with the LLM's labels on it, and raises the cutoff through CUTOFFS until
+# they agree at least min_agreement of the time. A model that never gets
+# there is not used.
+
+HOLDOUT_EVERY = 5
+CUTOFFS = (0.9, 0.95, 0.97, 0.99, 0.995, 0.999, 0.9999, 0.99999)
+
+class PreFilter:
+    """
+    Cheap in-process classifiers trained on mail the LLM has already labeled.
+    Only verdicts above the calibrated cutoffs (never below the configured
+    thresholds) are returned; everything else is left to the LLM (None).
+    """
+
+    def __init__(self, spam_threshold=0.99, tone_threshold=0.97, min_examples=50, max_training_rows=50000,
+                 min_agreement=0.98, min_holdout=20):
+        self.spam_threshold = spam_threshold
+        self.tone_threshold = tone_threshold
+        self.min_examples = min_examples
+        self.max_training_rows = max_training_rows
+        self.min_agreement = min_agreement
+        self.min_holdout = min_holdout  # confident held-out verdicts needed to trust a cutoff
+        self._spam_model = None
+        self._tone_model = None
+        self.spam_cutoff = self.tone_cutoff = None
+        self.calibration = {}
+        self._lock = threading.Lock()
+        self.trained_at = None
+        self.training_rows = 0
+        self.counters = {"spam_confident": 0, "spam_deferred": 0, "tone_confident": 0,
+                         "tone_deferred": 0, "llm_calls_avoided": 0, "predictions": 0, "predict_seconds": 0.0}
+
+    def train(self, rows, tones):
+        """rows: iterable of (body, tone, is_spam). Tone labels must be a single entry from `tones`."""
+        spam_x, spam_y, tone_x, tone_y = [], [], [], []
+        for body, tone, is_spam in rows:
+            features = hashed_features(body)
+            if not features:
+                continue
+            spam_x.append(features)
+            spam_y.append(bool(is_spam))
+            if tone in tones:
+                tone_x.append(features)
+                tone_y.append(tone)
+
+        calibration = {}
+        spam_counts = Counter(spam_y)
+        spam_model = spam_cutoff = None
+        if spam_counts[True] >= self.min_examples and spam_counts[False] >= self.min_examples:
+            spam_model, spam_cutoff, calibration["spam"] = self._fit_checked("spam", spam_x, spam_y, self.spam_threshold)
+        tone_counts = Counter(tone_y)
+        tone_model = tone_cutoff = None
+        if sum(1 for n in tone_counts.values() if n >= self.min_examples) >= 2:
+            keep = [i for i, label in enumerate(tone_y) if tone_counts[label] >= self.min_examples]
+            tone_model, tone_cutoff, calibration["tone"] = self._fit_checked(
+                "tone", [tone_x[i] for i in keep], [tone_y[i] for i in keep], self.tone_threshold)
+
+        with self._lock:
+            self._spam_model, self._tone_model = spam_model, tone_model
+            self.spam_cutoff, self.tone_cutoff = spam_cutoff, tone_cutoff
+            self.calibration = calibration
+            self.trained_at = time.time()
+            self.training_rows = len(spam_y)
+        return {"rows": len(spam_y), "spam_model": spam_model is not None, "tone_model": tone_model is not None,
+                "calibration": calibration}
+
+    def _fit_checked(self, task, features, labels, threshold):
+        """(model, cutoff, report); model is None if no cutoff is accurate enough on the held-out rows."""
+        held = [i for i in range(len(labels)) if i % HOLDOUT_EVERY == 0]
+        fitted = [i for i in range(len(labels)) if i % HOLDOUT_EVERY != 0]
+        model = HashedNaiveBayes().fit([features[i] for i in fitted], [labels[i] for i in fitted])
+        cutoff, report = self._calibrate(model, [features[i] for i in held], [labels[i] for i in held], threshold)
+        if cutoff is None and report["agreement"] is None:
+            log.warning("prefilter %s model disabled: fewer than %d confident verdicts on %d held-out rows",
+                        task, self.min_holdout, report["holdout"])
+            return None, None, report
+        if cutoff is None:
+            log.warning("prefilter %s model disabled: confident verdicts agree with the LLM %s of the time "
+                        "on %d held-out rows (need %s)", task, report["agreement"], report["holdout"], self.min_agreement)
+            return None, None, report
+        log.info("prefilter %s cutoff %s: %.1f%% of %d held-out rows answered, %.2f%% agree with the LLM", task, cutoff,
+                 report["coverage"] * 100, report["holdout"], report["agreement"] * 100)
+        # Checked on the split; the served model learns from every row
+        return HashedNaiveBayes().fit(features, labels), cutoff, report
+
+    def _calibrate(self, model, features, labels, threshold):
+        """The lowest cutoff, from `threshold` up, whose confident held-out verdicts meet min_agreement."""
+        verdicts = [max(model.predict_proba(f).items(), key=lambda item: item[1]) for f in features]
+        report = {"holdout": len(labels), "cutoff": None, "coverage": 0.0, "agreement": None}
+        for cutoff in [threshold] + [c for c in CUTOFFS if c > threshold]:
+            agree = [label == truth for (label, confidence), truth in zip(verdicts, labels) if confidence >= cutoff]
+            if len(agree) < self.min_holdout:
+                break  # stricter cutoffs only answer fewer
+            report["agreement"] = round(sum(agree) / len(agree), 4)
+            report["coverage"] = round(len(agree) / len(labels), 3)
+            if report["agreement"] >= self.min_agreement:
+                report["cutoff"] = cutoff
+                return cutoff, report
+        return None, report
+
+    def train_from_db(self, db_path, tones):
+        """
+        Trains on the most recent LLM-labeled rows of both email tables; rows the
+        pre-filter or the keyword fallback labelled would teach it its own output.
+        """
+        conn = sqlite3.connect(db_path, timeout=30)
+        try:
+            rows = conn.execute('''
+                SELECT body, tone, is_spam FROM (
+                    SELECT body, tone, is_spam, sent_at FROM emails WHERE tone IS NOT NULL AND label_source = 'llm'
+                    UNION ALL
+                    SELECT body, tone, is_spam, sent_at FROM external_emails WHERE tone IS NOT NULL AND label_source = 'llm'
+                ) ORDER BY sent_at DESC LIMIT ?
+            ''', (self.max_training_rows,))
+            return self.train(rows, tones)
+        finally:
+            conn.close()
+
+    def _predict(self, model, text, threshold):
+        if model is None:
+            return None, 0.0
+        started = time.perf_counter()
+        probs = model.predict_proba(hashed_features(text))
+        label, confidence = max(probs.items(), key=lambda item: item[1])
+        with self._lock:
+            self.counters["predictions"] += 1
+            self.counters["predict_seconds"] += time.perf_counter() - started
+        return (label if confidence >= threshold else None), confidence
+
+    def record(self, task, confident):
+        """Counts whether a `task` ('spam' or 'tone') verdict was answered here or left to the LLM."""
+        with self._lock:
+            self.counters[f"{task}_confident" if confident else f"{task}_deferred"] += 1
+
+    def record_avoided(self, calls=1):
+        """
+        Counts LLM calls a confident verdict actually replaced. Callers decide:
+        in the combined analysis a known field only shrinks the prompt.
+        """
+        with self._lock:
+            self.counters["llm_calls_avoided"] += calls
+
+    def predict_spam(self, text, record=True):
+        """True/False when confident, otherwise None."""
+        with self._lock:  # a model and its cutoff are replaced together by train()
+            model, cutoff = self._spam_model, self.spam_cutoff
+        verdict, _ = self._predict(model, text, cutoff)
+        if record:
+            self.record("spam", verdict is not None)
+        return verdict
+
+    def predict_tone(self, text, record=True):
+        """A tone label when confident, otherwise None."""
+        with self._lock:
+            model, cutoff = self._tone_model, self.tone_cutoff
+        verdict, _ = self._predict(model, text, cutoff)
+        if record:
+            self.record("tone", verdict is not None)
+        return verdict
+
+    def stats(self, avg_llm_seconds=None) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+        decisions = sum(counters[k] for k in ("spam_confident", "spam_deferred", "tone_confident", "tone_deferred"))
+        confident = counters["spam_confident"] + counters["tone_confident"]
+        avoided = counters["llm_calls_avoided"]
+        return {
+            "spam_model": self._spam_model is not None,
+            "tone_model": self._tone_model is not None,
+            "training_rows": self.training_rows,
+            "trained_at": self.trained_at,
+            "spam_threshold": self.spam_threshold,
+            "tone_threshold": self.tone_threshold,
+            "spam_cutoff": self.spam_cutoff,
+            "tone_cutoff": self.tone_cutoff,
+            "min_agreement": self.min_agreement,
+            "calibration": self.calibration,
+            **{k: v for k, v in counters.items() if k != "predict_seconds"},
+            "skip_rate": round(confident / decisions, 3) if decisions else None,  # verdicts answered here
+            "avg_predict_us": round(counters["predict_seconds"] / counters["predictions"] * 1e6, 1) if counters["predictions"] else None,
+            "est_llm_seconds_saved": round(avoided * avg_llm_seconds, 2) if avg_llm_seconds else None,
+        }
+
+
+prefilter = PreFilter(
+    spam_threshold=float(os.getenv("SBOX_PREFILTER_SPAM_THRESHOLD", "0.99")),
+    tone_threshold=float(os.getenv("SBOX_PREFILTER_TONE_THRESHOLD", "0.97")),
+    min_agreement=float(os.getenv("SBOX_PREFILTER_MIN_AGREEMENT", "0.98")),
+)
@@ -0,0 +1,211 @@
+import os
+import re
+import threading
+
+from backend.metrics import estimate_tokens
+
+# ------------------------- #
+# Prompt Compaction
+# ------------------------- #
+# Runs before every LLM prompt that embeds a message body. clean_email()
+# drops what the model does not need (quoted replies, signatures, legal
+# footers, runs of whitespace); fit() then keeps each task under its token
+# budget. Classifiers get the head and tail of the message, where the
+# greeting, the ask and any unsubscribe footer are; the summarizer splits
+# very long mail into chunks instead (see llama_utils.summarize_email).
+
+PREPROCESS_ENABLED = os.getenv("SBOX_PREPROCESS", "1") != "0"
+
+# Tokens of email text per prompt, not counting the instructions (~4 chars/token)
+BUDGETS = {
+    "tone": int(os.getenv("SBOX_TOKEN_BUDGET_TONE", "384")),
+    "spam": int(os.getenv("SBOX_TOKEN_BUDGET_SPAM", "512")),
+    "analysis": int(os.getenv("SBOX_TOKEN_BUDGET_ANALYSIS", "1024")),
+    "summary": int(os.getenv("SBOX_TOKEN_BUDGET_SUMMARY", "1536")),
+    "rewrite": int(os.getenv("SBOX_TOKEN_BUDGET_REWRITE", "1536")),
+}
+# Longer mail is head+tail sampled down to this many summary chunks first
+MAX_SUMMARY_CHUNKS = int(os.getenv("SBOX_SUMMARY_MAX_CHUNKS", "6"))
+CHARS_PER_TOKEN = 4
+ELLIPSIS = "\n[...]\n"
+
+# Everything from one of these lines on is an earlier message in the thread
+REPLY_HEADER_RE = re.compile(
+    r"^(?:On\b[^\n]{0,200}(?:\n[^\n]{0,100})?\bwrote:[ \t]*$"
+    r"|-{2,}[ \t]*Original Message[ \t]*-{2,}"
+    r"|_{5,}[ \t]*$\n^From:"
+    r"|From:[^\n]+\n(?:Sent|Date):[^\n]+\n(?:To|Subject):)",
+    re.MULTILINE | re.IGNORECASE,
+)
+# "-- " (RFC 3676) or a bare "--" starts a signature block
+SIGNATURE_RE = re.compile(r"^--[ \t]?$", re.MULTILINE)
+MOBILE_FOOTER_RE = re.compile(r"^(?:Sent from my [^\n]{1,40}|Get Outlook for [^\n]{1,20}|Sent from Mail for Windows)[ \t]*$",
+                              re.MULTILINE | re.IGNORECASE)
+# Legal footers run to the end of their paragraph; unsubscribe lines are left in, they are a spam signal
+DISCLAIMER_RE = re.compile(
+    r"^[^\n]*(?:CONFIDENTIALITY NOTICE|DISCLAIMER:|This (?:e-?mail|message)(?: and any attachments?)?"
+    r"[^\n]{0,40}\b(?:confidential|intended (?:solely|only) for))[^\n]*(?:\n[^\n]+)*",
+    re.MULTILINE | re.IGNORECASE,
+)
+QUOTED_LINE_RE = re.compile(r"^[ \t]*>[^\n]*\n?", re.MULTILINE)
+SPACES_RE = re.compile(r"[ \t\u00a0\u200b]+")
+BLANK_LINES_RE = re.compile(r"\n\s*\n\s*")
+
+
+def collapse_whitespace(text: str) -> str:
+    text = SPACES_RE.sub(" ", text.replace("\r\n", "\n").replace("\r", "\n"))
+    text = "\n".join(line.strip() for line in text.split("\n"))
+    return BLANK_LINES_RE.sub("\n\n", text).strip()
+
+
+def _cut(text, match):
+    """Text before `match`, unless that would leave nothing (a bare forward keeps its quote)."""
+    head = text[:match.start()] if match else text
+    return head if head.strip() else text
+
+
+def clean_email(text: str) -> str:
+    """The new part of a message: no quoted thread, signature, mobile or legal footer, or extra whitespace."""
+    text = (text or "").replace("\r\n", "\n")
+    text = _cut(text, REPLY_HEADER_RE.search(text))
+    stripped = QUOTED_LINE_RE.sub("", text)
+    text = stripped if stripped.strip() else text
+    text = _cut(text, SIGNATURE_RE.search(text))
+    text = MOBILE_FOOTER_RE.sub("", text)
+    stripped = DISCLAIMER_RE.sub("", text)
+    text = stripped if stripped.strip() else text
+    return collapse_whitespace(text)
+
+
+def _boundary(text, index, forward):
+    """The nearest whitespace to `index` within 40 chars, so words are not cut in half."""
+    window = text[index:index + 40] if forward else text[max(0, index - 40):index]
+    match = re.search(r"\s", window) if forward else re.search(r"\s(?=\S*$)", window)
+    if not match:
+        return index
+    return index + match.start() if forward else index - len(window) + match.start()
+
+
+def head_tail(text: str, budget: int) -> str:
+    """At most ~`budget` tokens of `text`: the first two thirds of the budget from the start, the rest from the end."""
+    limit = budget * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    limit -= len(ELLIPSIS)
+    head = _boundary(text, limit * 2 // 3, forward=False)
+    tail = _boundary(text, len(text) - (limit - head), forward=True)
+    return text[:head].rstrip() + ELLIPSIS + text[tail:].lstrip()
+
+
+def chunks(text: str, budget: int) -> list:
+    """`text` split on paragraph (then word) boundaries into pieces of at most ~`budget` tokens."""
+    limit = budget * CHARS_PER_TOKEN
+    pieces, current = [], ""
+    for paragraph in text.split("\n\n"):
+        while len(paragraph) > limit:
+            cut = _boundary(paragraph, limit, forward=False) or limit
+            pieces.append(paragraph[:cut])
+            paragraph = paragraph[cut:].lstrip()
+        if current and len(current) + 2 + len(paragraph) > limit:
+            pieces.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        pieces.append(current)
+    return [piece.strip() for piece in pieces if piece.strip()]
+
+
+# ------------------------- #
+# Per-task Entry Points
+# ------------------------- #
+
+def fit(task: str, text: str) -> str:
+    """The text to embed in a `task` prompt: cleaned, then head+tail sampled to BUDGETS[task]."""
+    original = text or ""
+    cleaned = clean_email(original) if PREPROCESS_ENABLED else original.strip()
+    fitted = head_tail(cleaned, BUDGETS[task])
+    record(task, original, cleaned, estimate_tokens(fitted), truncated=fitted is not cleaned)
+    return fitted
+
+
+def summary_chunks(text: str) -> list:
+    """
+    The cleaned message as one piece if it fits the summary budget, else as
+    up to MAX_SUMMARY_CHUNKS budget-sized chunks for map-reduce.
+    """
+    original = text or ""
+    budget = BUDGETS["summary"]
+    cleaned = clean_email(original) if PREPROCESS_ENABLED else original.strip()
+    if estimate_tokens(cleaned) <= budget:
+        record("summary", original, cleaned, estimate_tokens(cleaned))
+        return [cleaned]
+    sampled = head_tail(cleaned, budget * MAX_SUMMARY_CHUNKS)
+    pieces = chunks(sampled, budget)
+    if len(pieces) > MAX_SUMMARY_CHUNKS:  # paragraphs rarely pack exactly
+        pieces = pieces[:MAX_SUMMARY_CHUNKS - 1] + pieces[-1:]
+    record("summary", original, cleaned, sum(estimate_tokens(p) for p in pieces),
+           truncated=sampled is not cleaned, chunked=True)
+    return pieces
+
+
+def compact_rewrite(text: str):
+    """
+    A draft to rewrite keeps its quotes and signature (they are part of what
+    the user wants back); only whitespace is collapsed. None if it is still
+    over the rewrite budget: rewriting part of a draft would lose the rest.
+    """
+    original = text or ""
+    collapsed = collapse_whitespace(original) if PREPROCESS_ENABLED else original.strip()
+    if over_budget("rewrite", collapsed):
+        return None
+    record("rewrite", original, collapsed, estimate_tokens(collapsed))
+    return collapsed
+
+
+def over_budget(task: str, text: str) -> bool:
+    return estimate_tokens(text) > BUDGETS[task]
+
+
+def needs_chunking(text: str) -> bool:
+    """True if summary_chunks() would split `text`; the length check on the raw text keeps this cheap."""
+    if not over_budget("summary", text or ""):
+        return False
+    return over_budget("summary", clean_email(text) if PREPROCESS_ENABLED else text.strip())
+
+
+# ------------------------- #
+# Token Savings Stats
+# ------------------------- #
+
+_lock = threading.Lock()
+_stats = {}
+
+
+def record(task, original, cleaned, sent_tokens, truncated=False, chunked=False):
+    original_tokens = estimate_tokens(original)
+    with _lock:
+        stats = _stats.setdefault(task, {
+            "messages": 0, "original_tokens": 0, "cleaned_tokens": 0, "sent_tokens": 0,
+            "cleaned": 0, "truncated": 0, "chunked": 0,
+        })
+        stats["messages"] += 1
+        stats["original_tokens"] += original_tokens
+        stats["cleaned_tokens"] += estimate_tokens(cleaned)
+        stats["sent_tokens"] += sent_tokens
+        stats["cleaned"] += 1 if len(cleaned) < len(original.strip()) else 0
+        stats["truncated"] += 1 if truncated else 0
+        stats["chunked"] += 1 if chunked else 0
+
+
+def stats() -> dict:
+    """Estimated email-text tokens before and after compaction, per task."""
+    report = {"enabled": PREPROCESS_ENABLED, "budgets": dict(BUDGETS), "tasks": {}}
+    with _lock:
+        for task, counters in _stats.items():
+            saved = counters["original_tokens"] - counters["sent_tokens"]
+            report["tasks"][task] = {
+                **counters,
+                "saved_tokens": saved,
+                "saved_pct": round(100.0 * saved / counters["original_tokens"], 1) if counters["original_tokens"] else 0.0,
+            }
+    return report
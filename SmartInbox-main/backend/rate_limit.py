@@ -0,0 +1,146 @@
+import time
+import threading
+from collections import deque
+
+# ------------------------- #
+# Token-bucket Rate Limiter
+# ------------------------- #
+
+class RateLimiter:
+    """
+    Two token buckets (requests/minute and tokens/minute) shared by every
+    thread that talks to the LLM provider. acquire() blocks until both have
+    room; block_for() pauses everyone after a 429 with a retry-after header.
+    A limit of 0 disables that bucket.
+    """
+
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0):
+        self._cond = threading.Condition()
+        self._blocked_until = 0.0
+        self.counters = {"acquired": 0, "throttled": 0, "rate_limited": 0, "wait_seconds": 0.0}
+        self.configure(requests_per_minute, tokens_per_minute)
+
+    def configure(self, requests_per_minute=0, tokens_per_minute=0):
+        with self._cond:
+            self.requests_per_minute = requests_per_minute
+            self.tokens_per_minute = tokens_per_minute
+            self._requests = float(requests_per_minute)
+            self._tokens = float(tokens_per_minute)
+            self._updated = time.monotonic()
+            self._cond.notify_all()
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        if self.requests_per_minute:
+            self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60.0)
+        if self.tokens_per_minute:
+            self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60.0)
+
+    def _wait_needed(self, now, tokens):
+        wait = max(0.0, self._blocked_until - now)
+        if self.requests_per_minute and self._requests < 1:
+            wait = max(wait, (1 - self._requests) * 60.0 / self.requests_per_minute)
+        if self.tokens_per_minute and self._tokens < tokens:
+            wait = max(wait, (tokens - self._tokens) * 60.0 / self.tokens_per_minute)
+        return wait
+
+    def acquire(self, tokens=1) -> float:
+        """Blocks until a request costing `tokens` may be sent; returns the seconds spent waiting."""
+        if self.tokens_per_minute:
+            tokens = min(tokens, self.tokens_per_minute)
+        waited = 0.0
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._wait_needed(now, tokens)
+                if wait <= 0:
+                    break
+                self._cond.wait(wait)
+                waited += time.monotonic() - now
+            if self.requests_per_minute:
+                self._requests -= 1
+            if self.tokens_per_minute:
+                self._tokens -= tokens
+            self.counters["acquired"] += 1
+            if waited:
+                self.counters["throttled"] += 1
+                self.counters["wait_seconds"] += waited
+        return waited
+
+    def block_for(self, seconds: float):
+        """Called on a 429: nobody sends anything until `seconds` have passed."""
+        with self._cond:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self._requests = min(self._requests, 0.0)
+            self.counters["rate_limited"] += 1
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            self._refill(time.monotonic())
+            return {
+                "requests_per_minute": self.requests_per_minute,
+                "tokens_per_minute": self.tokens_per_minute,
+                "available_requests": round(self._requests, 2) if self.requests_per_minute else None,
+                "available_tokens": round(self._tokens) if self.tokens_per_minute else None,
+                "blocked_for_s": round(max(0.0, self._blocked_until - time.monotonic()), 2),
+                **{k: round(v, 3) if isinstance(v, float) else v for k, v in self.counters.items()},
+            }
+
+
+# ------------------------- #
+# Sliding-window Attempt Limiter
+# ------------------------- #
+
+class AttemptLimiter:
+    """
+    Rejects instead of waiting: at most `limit` attempts per key within
+    `window` seconds. check() is cheap and runs before any expensive work;
+    record() counts an attempt and reset() forgets a key. A limit of 0
+    disables it.
+    """
+
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self._lock = threading.Lock()
+        self._attempts = {}  # key -> deque of monotonic timestamps, newest last
+        self._last_sweep = time.monotonic()
+        self.counters = {"recorded": 0, "rejected": 0}
+
+    def check(self, key) -> float:
+        """0 if `key` may try now, else the seconds until it may."""
+        if not self.limit:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            attempts = self._attempts.get(key)
+            if attempts is None or len(attempts) < self.limit or attempts[0] <= now - self.window:
+                return 0.0
+            self.counters["rejected"] += 1
+            return attempts[0] + self.window - now
+
+    def record(self, key):
+        if not self.limit:
+            return
+        now = time.monotonic()
+        with self._lock:
+            attempts = self._attempts.get(key)
+            if attempts is None:
+                attempts = self._attempts[key] = deque(maxlen=self.limit)
+            attempts.append(now)
+            self.counters["recorded"] += 1
+            if now - self._last_sweep > self.window:
+                self._last_sweep = now
+                for stale in [k for k, a in self._attempts.items() if a[-1] <= now - self.window]:
+                    del self._attempts[stale]
+
+    def reset(self, key):
+        with self._lock:
+            self._attempts.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"limit": self.limit, "window_s": self.window, "tracked_keys": len(self._attempts), **self.counters}
@@ -0,0 +1,270 @@
+import re
+import sys
+import json
+import base64
+import sqlite3
+import argparse
+from datetime import datetime
+
+from markupsafe import Markup, escape
+
+from backend.log import get_logger
+
+# ------------------------- #
+# FTS5 Index
+# ------------------------- #
+# One external-content FTS5 table per email table: the text lives only in
+# the email tables, the index holds tokens. Triggers keep it in sync,
+# including summaries written later by the enrichment workers.
+
+FTS_TABLES = {'emails': 'emails_fts', 'external_emails': 'external_fts'}
+SNIPPET_OPEN, SNIPPET_CLOSE = '\x02', '\x03'   # escaped and turned into <mark> after the query
+COLUMN_WEIGHTS = "10.0, 1.0, 3.0"             # bm25 weights for subject, body, summary
+
+log = get_logger("search")
+PAGE_SIZE = 20
+
+
+def _fts_statements(table, fts):
+    columns = "subject, body, summary"
+    new = "NEW.id, NEW.subject, NEW.body, NEW.summary"
+    old = f"'delete', OLD.id, OLD.subject, OLD.body, OLD.summary"
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({columns}, content='{table}', content_rowid='id', "
+        f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts} (rowid, {columns}) VALUES ({new}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts} ({fts}, rowid, {columns}) VALUES ({old}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {columns} ON {table} BEGIN "
+        f"INSERT INTO {fts} ({fts}, rowid, {columns}) VALUES ({old}); "
+        f"INSERT INTO {fts} (rowid, {columns}) VALUES ({new}); END",
+    ]
+
+
+def rebuild(conn):
+    """Re-reads every email row into the index (the backfill for existing mail)."""
+    for fts in FTS_TABLES.values():
+        conn.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+
+
+def install(c):
+    """Migration step: FTS tables, sync triggers and a backfill of existing rows."""
+    try:
+        for table, fts in FTS_TABLES.items():
+            for statement in _fts_statements(table, fts):
+                c.execute(statement)
+    except sqlite3.OperationalError as e:
+        if 'fts5' not in str(e):
+            raise
+        # Search stays disabled; `python -m backend.search` installs it once SQLite has FTS5
+        log.warning("FTS5 unavailable, skipping index: %s", e)
+        return
+    rebuild(c)
+
+
+def available(conn) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'emails_fts'").fetchone() is not None
+
+
+# ------------------------- #
+# Query Parsing
+# ------------------------- #
+
+TERM_RE = re.compile(r'"([^"]*)"|(\S+)')
+WORD_RE = re.compile(r"\w+")
+
+
+def to_match(query: str):
+    """
+    Turns free text into a safe FTS5 expression: every word or "quoted phrase"
+    must appear, and a word ending in * matches as a prefix (budg*).
+    Returns None when the query has no searchable words.
+    """
+    terms = []
+    for phrase, word in TERM_RE.findall(query or ''):
+        tokens = WORD_RE.findall(phrase or word)
+        if tokens:
+            prefix = '*' if word.endswith('*') else ''
+            terms.append('"' + ' '.join(tokens) + '"' + prefix)
+    return ' '.join(terms) or None
+
+
+def parse_day(value, name):
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+    except ValueError as e:
+        raise ValueError(f"{name} must be YYYY-MM-DD") from e
+
+
+# Tone may hold several labels, e.g. 'polite, formal'; search and bulk
+# selections both match one of them with this condition and parameter
+def tone_condition(column):
+    return f"instr(',' || replace(lower({column}), ' ', '') || ',', ?) > 0"
+
+
+def tone_param(tone):
+    return ',' + str(tone).lower().replace(' ', '') + ','
+
+
+# Day ranges from parse_day() include both named days
+def day_from_condition(column):
+    return f"{column} >= ?"
+
+
+def day_to_condition(column):
+    return f"{column} < date(?, '+1 day')"
+
+
+def _highlight(text):
+    escaped = str(escape(text or ''))
+    return Markup(escaped.replace(SNIPPET_OPEN, '<mark>').replace(SNIPPET_CLOSE, '</mark>'))
+
+
+def _encode_cursor(row):
+    key = [row['score'], row['source'], row['id']]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+
+def _decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        score, source, email_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return float(score), str(source), int(email_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+# ------------------------- #
+# Ranked Search
+# ------------------------- #
+
+def _arm(table, label, box, user_id, user_email, filters):
+    """One SELECT of the UNION ALL: (id, source, score) of matches in `table` visible in `box`."""
+    fts = FTS_TABLES[table]
+    where, params = [f"{fts} MATCH ?"], []
+    if box == 'inbox':
+        if table != 'emails':
+            return None, ()
+        where.append("e.recipient_email = ?")
+        params.append(user_email)
+    elif box == 'sent':
+        where.append("e.sender_id = ?")
+        params.append(user_id)
+    elif box == 'mine':
+        if table == 'emails':
+            where.append("(e.recipient_email = ? OR e.sender_id = ?)")
+            params += [user_email, user_id]
+        else:
+            where.append("e.sender_id = ?")
+            params.append(user_id)
+    if filters.get('tone'):
+        where.append(tone_condition('e.tone'))
+        params.append(tone_param(filters['tone']))
+    if filters.get('spam') is not None:
+        where.append("e.is_spam = ?")
+        params.append(1 if filters['spam'] else 0)
+    if filters.get('date_from'):
+        where.append(day_from_condition('e.sent_at'))
+        params.append(filters['date_from'])
+    if filters.get('date_to'):
+        where.append(day_to_condition('e.sent_at'))
+        params.append(filters['date_to'])
+    sql = f"""
+        SELECT {fts}.rowid AS id, '{label}' AS source, bm25({fts}, {COLUMN_WEIGHTS}) AS score
+        FROM {fts}
+        JOIN {table} e ON e.id = {fts}.rowid
+        WHERE {' AND '.join(where)}
+    """
+    return sql, tuple(params)
+
+
+def _details(conn, table, label, match, ids):
+    """Display columns and a highlighted snippet, only for the rows on the page."""
+    fts = FTS_TABLES[table]
+    opened = "e.opened_at" if table == 'emails' else "NULL"
+    marks = ", ".join("?" * len(ids))
+    rows = conn.execute(f"""
+        SELECT e.id, '{label}' AS source, e.subject, e.summary, e.recipient_email,
+               strftime('%Y-%m-%d %H:%M', e.sent_at) AS sent_at, e.sent_at AS sort_sent_at,
+               {opened} AS opened_at, e.tone, e.is_spam, e.enrichment_status,
+               u.email AS sender_email,
+               snippet({fts}, -1, '{SNIPPET_OPEN}', '{SNIPPET_CLOSE}', '…', 16) AS snippet
+        FROM {fts}
+        JOIN {table} e ON e.id = {fts}.rowid
+        JOIN users u ON u.id = e.sender_id
+        WHERE {fts} MATCH ? AND {fts}.rowid IN ({marks})
+    """, (match, *ids)).fetchall()
+    return {row['id']: dict(row) for row in rows}
+
+
+def search(conn, query, box='mine', user_id=None, user_email=None, filters=None,
+           cursor=None, limit=PAGE_SIZE):
+    """
+    Best matches first (BM25), as (rows, next_cursor). `box` is 'inbox', 'sent',
+    'mine' (both) or 'all' (admin). Raises ValueError on an empty query or a bad cursor.
+    """
+    match = to_match(query)
+    if match is None:
+        raise ValueError("Search query has no words")
+    filters = filters or {}
+    arms, params = [], []
+    tables = {'Internal': 'emails', 'External': 'external_emails'}
+    for label, table in tables.items():
+        sql, arm_params = _arm(table, label, box, user_id, user_email, filters)
+        if sql:
+            arms.append(sql)
+            params += [match, *arm_params]
+    after, after_params = "", ()
+    key = _decode_cursor(cursor)
+    if key is not None:
+        after, after_params = "WHERE (score, source, id) > (?, ?, ?)", key
+
+    # Rank first; snippets and joins are only computed for the page that is returned
+    ranked = conn.execute(f"""
+        SELECT * FROM ({' UNION ALL '.join(arms)})
+        {after}
+        ORDER BY score, source, id
+        LIMIT ?
+    """, (*params, *after_params, limit + 1)).fetchall()
+    next_cursor = _encode_cursor(ranked[limit - 1]) if len(ranked) > limit else None
+    ranked = ranked[:limit]
+
+    details = {}
+    for label, table in tables.items():
+        ids = [row['id'] for row in ranked if row['source'] == label]
+        if ids:
+            details[label] = _details(conn, table, label, match, ids)
+    rows = []
+    for hit in ranked:
+        row = details[hit['source']].get(hit['id'])
+        if row is None:
+            continue  # deleted between the two queries
+        row['snippet_html'] = _highlight(row.pop('snippet'))
+        row['snippet'] = row['snippet_html'].striptags()
+        row['score'] = round(hit['score'], 4)
+        rows.append(row)
+    return rows, next_cursor
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create (if needed) and rebuild the full-text search index.")
+    parser.add_argument("--db", default="Sbox.db")
+    args = parser.parse_args(argv)
+    conn = sqlite3.connect(args.db, timeout=30, isolation_level=None)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        install(conn)
+        conn.execute("COMMIT")
+        print("search index:", "ready" if available(conn) else "unavailable (SQLite built without FTS5)")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
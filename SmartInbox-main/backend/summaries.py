@@ -0,0 +1,271 @@
+import os
+import time
+import threading
+
+from backend.log import get_logger
+from backend.llama_utils import summarize_email, summarize_email_stream, llm_idle, SUMMARY_UNAVAILABLE
+
+# ------------------------- #
+# Single-flight Calls
+# ------------------------- #
+
+PREFETCH_ENABLED = os.getenv("SBOX_SUMMARY_PREFETCH", "0") == "1"
+PREFETCH_INTERVAL = float(os.getenv("SBOX_SUMMARY_PREFETCH_INTERVAL", "5"))
+RETRY_FAILED_AFTER = 600.0  # seconds before the prefetcher retries a message whose summary failed
+
+log = get_logger("summaries")
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Concurrent callers asking for the same key share one call: the first
+    (leader) runs it, the others block until its result is ready.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def begin(self, key):
+        """Returns (flight, is_leader); the leader must call finish()."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            return flight, True
+
+    def finish(self, key, flight, result=None, error=None):
+        flight.result, flight.error = result, error
+        with self._lock:
+            self._flights.pop(key, None)
+        flight.done.set()
+
+    @staticmethod
+    def wait(flight):
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def __len__(self):
+        with self._lock:
+            return len(self._flights)
+
+    def do(self, key, fn):
+        """(fn() or the in-flight result for `key`, whether this caller ran fn)."""
+        while True:
+            flight, leader = self.begin(key)
+            if leader:
+                break
+            try:
+                return self.wait(flight), False
+            except Exception:
+                continue  # the leader failed or its client went away; lead a new attempt
+        try:
+            result = fn()
+        except Exception as e:
+            self.finish(key, flight, error=e)
+            raise
+        self.finish(key, flight, result)
+        return result, True
+
+
+flights = SingleFlight()
+
+
+# ------------------------- #
+# Stored Summaries
+# ------------------------- #
+
+_lock = threading.Lock()
+counters = {"opens": 0, "available_at_open": 0, "stored": 0, "generated": 0, "shared": 0,
+            "prefetched": 0, "prefetch_failed": 0}
+
+
+def _count(name, n=1):
+    with _lock:
+        counters[name] += n
+
+
+def record_open(had_summary: bool):
+    """Called when a user opens an email: was its summary already there?"""
+    with _lock:
+        counters["opens"] += 1
+        counters["available_at_open"] += 1 if had_summary else 0
+
+
+def record_stored():
+    """A summary request answered from the stored summary."""
+    _count("stored")
+
+
+def stats() -> dict:
+    with _lock:
+        result = dict(counters)
+    result["availability_at_open"] = round(result["available_at_open"] / result["opens"], 3) if result["opens"] else None
+    result["in_flight"] = len(flights)
+    result["prefetch_enabled"] = PREFETCH_ENABLED
+    return result
+
+
+def save_summary(conn, email_id, summary) -> str:
+    """Writes `summary` unless the row already has one; returns whichever is stored."""
+    if summary and summary != SUMMARY_UNAVAILABLE:
+        # Conditional so a summary written meanwhile (e.g. by enrichment) is kept
+        conn.execute("UPDATE emails SET summary = ? WHERE id = ? AND (summary IS NULL OR summary = '')", (summary, email_id))
+        conn.commit()
+    row = conn.execute("SELECT summary FROM emails WHERE id = ?", (email_id,)).fetchone()
+    return (row[0] if row else None) or summary
+
+
+def _stored(connect, email_id):
+    conn = connect()
+    try:
+        row = conn.execute("SELECT summary FROM emails WHERE id = ?", (email_id,)).fetchone()
+        return row[0] if row else None
+    finally:
+        conn.close()
+
+
+def summary_for(connect, email_id, body, prefetch=False) -> str:
+    """
+    The email's summary, generating and storing it if missing. Concurrent
+    requests for one email make a single LLM call. `connect` returns a
+    connection whose close() releases it (db.connection).
+    """
+    def generate():
+        stored = _stored(connect, email_id)
+        if stored:
+            return stored  # written while this request was queued
+        summary = summarize_email(body or '')
+        _count("prefetched" if prefetch else "generated")
+        conn = connect()
+        try:
+            return save_summary(conn, email_id, summary)
+        finally:
+            conn.close()
+
+    result, leader = flights.do(email_id, generate)
+    if not leader:
+        _count("shared")
+    return result
+
+
+def stream_summary(connect, email_id, body):
+    """
+    summary_for() as a stream of chunks. The leader streams from the model and
+    stores the result; concurrent requests get the finished summary in one chunk.
+    """
+    flight, leader = flights.begin(email_id)
+    if not leader:
+        _count("shared")
+        try:
+            result = SingleFlight.wait(flight)
+        except Exception:
+            result = summary_for(connect, email_id, body)
+        yield result
+        return
+    parts = []
+    try:
+        stored = _stored(connect, email_id)
+        if stored:
+            _count("stored")
+            parts.append(stored)
+            yield stored
+        else:
+            for chunk in summarize_email_stream(body or ''):
+                parts.append(chunk)
+                yield chunk
+            _count("generated")
+            conn = connect()
+            try:
+                save_summary(conn, email_id, "".join(parts))
+            finally:
+                conn.close()
+    except BaseException as e:
+        # Includes GeneratorExit when the client disconnects mid-stream
+        flights.finish(email_id, flight, error=RuntimeError(f"Summary stream aborted: {type(e).__name__}"))
+        raise
+    flights.finish(email_id, flight, "".join(parts))
+
+
+# ------------------------- #
+# Background Prefetcher
+# ------------------------- #
+
+class SummaryPrefetcher:
+    """
+    Summarizes unread mail that has no summary yet, newest non-spam first,
+    one message at a time and only while `is_idle()` reports spare LLM
+    capacity, so interactive requests keep priority.
+    """
+
+    def __init__(self, connect, is_idle=llm_idle, interval=PREFETCH_INTERVAL):
+        self.connect = connect
+        self.is_idle = is_idle
+        self.interval = interval
+        self._skip = {}  # email id -> monotonic time after which it may be retried
+        self._stop = threading.Event()
+        self._thread = None
+
+    def next_candidate(self):
+        now = time.monotonic()
+        self._skip = {i: t for i, t in self._skip.items() if t > now}
+        skip = list(self._skip)
+        exclude = f"AND id NOT IN ({', '.join('?' * len(skip))})" if skip else ""
+        conn = self.connect()
+        try:
+            # Served by idx_emails_unsummarized (partial index on the same condition)
+            return conn.execute(f"""
+                SELECT id, body FROM emails
+                WHERE opened_at IS NULL AND (summary IS NULL OR summary = '') AND enrichment_status != 'pending' {exclude}
+                ORDER BY is_spam, sent_at DESC
+                LIMIT 1
+            """, skip).fetchone()
+        finally:
+            conn.close()
+
+    def run_once(self) -> bool:
+        """Summarizes one message if the LLM is idle; False when there was nothing to do."""
+        if not self.is_idle():
+            return False
+        row = self.next_candidate()
+        if row is None:
+            return False
+        summary = summary_for(self.connect, row['id'], row['body'], prefetch=True)
+        if not summary or summary == SUMMARY_UNAVAILABLE:
+            _count("prefetch_failed")
+            self._skip[row['id']] = time.monotonic() + RETRY_FAILED_AFTER
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                busy = self.run_once()
+            except Exception as e:
+                log.error("prefetch failed: %s", e)
+                busy = False
+            if not busy:
+                self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="summary-prefetch", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
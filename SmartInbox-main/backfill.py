@@ -0,0 +1,183 @@
+"""
+Recompute tone / is_spam / summary for stored mail, e.g. after changing
+MODEL_NAME or a prompt in backend/llama_utils.py.
+
+Rows are read in id order one chunk at a time, classified with the batch
+APIs and written back in a single transaction per chunk together with a
+checkpoint, so an interrupted run picks up where it stopped.
+
+    python backfill.py                          # all tables, all fields
+    python backfill.py --tables emails --fields tone --dry-run
+    python backfill.py --restart --invalidate-cache
+"""
+import os
+import sys
+import time
+import argparse
+
+from backend import llama_utils
+from backend.db import Database
+from backend.llama_utils import (
+    analyze_email, classify_email_tone_labeled, detect_spam_labeled, summarize_email, run_batch_checked, label_source,
+)
+
+DATABASE = 'Sbox.db'
+TABLES = ('emails', 'external_emails')
+FIELDS = ('tone', 'spam', 'summary')
+
+
+def load_checkpoint(conn, run_name, table):
+    row = conn.execute('SELECT last_id, rows_done FROM backfill_checkpoints WHERE run_name = ? AND table_name = ?',
+                       (run_name, table)).fetchone()
+    return (row[0], row[1]) if row else (0, 0)
+
+
+def iter_chunks(conn, table, after_id, chunk_size):
+    """Keyset pagination on the primary key; memory use is one chunk regardless of table size."""
+    while True:
+        rows = conn.execute(f'SELECT id, body, tone, is_spam, summary, label_source FROM {table} WHERE id > ? ORDER BY id LIMIT ?',
+                            (after_id, chunk_size)).fetchall()
+        if not rows:
+            return
+        yield rows
+        after_id = rows[-1][0]
+
+
+def classify_chunk(bodies, fields, concurrency):
+    """
+    Returns one (tone, is_spam, summary, sources, failed) tuple per body;
+    fields not requested are None and sources holds the label source of each
+    recomputed tone/spam label. failed is True if any LLM call for the body
+    errored, in which case the other values are fallbacks and must not be stored.
+    """
+    if set(fields) == set(FIELDS):
+        results = run_batch_checked(analyze_email, bodies, concurrency)
+        return [(r['tone'], r['is_spam'], r['summary'], (r['label_source'],), failed) for r, failed in results]
+    skipped = [((None, None), False)] * len(bodies)
+    tones = run_batch_checked(classify_email_tone_labeled, bodies, concurrency) if 'tone' in fields else skipped
+    spam = run_batch_checked(detect_spam_labeled, bodies, concurrency) if 'spam' in fields else skipped
+    summaries = run_batch_checked(summarize_email, bodies, concurrency) if 'summary' in fields else [(None, False)] * len(bodies)
+    return [(tone, is_spam, summary, tuple(source for source in (tone_source, spam_source) if source),
+             tone_failed or spam_failed or summary_failed)
+            for ((tone, tone_source), tone_failed), ((is_spam, spam_source), spam_failed), (summary, summary_failed)
+            in zip(tones, spam, summaries)]
+
+
+def backfill_table(conn, table, args, run_name):
+    last_id, rows_done = load_checkpoint(conn, run_name, table)
+    if last_id:
+        print(f"[{table}] resuming after id {last_id} ({rows_done} rows already done)", file=sys.stderr)
+    started = time.perf_counter()
+    processed = changed = failed = 0
+
+    for rows in iter_chunks(conn, table, last_id, args.chunk_size):
+        bodies = [row[1] or '' for row in rows]
+        results = classify_chunk(bodies, args.fields, args.concurrency)
+
+        updates = []
+        first_failed = None
+        for row, (tone, is_spam, summary, sources, row_failed) in zip(rows, results):
+            if row_failed:
+                # An LLM outage must not overwrite good labels with fallbacks
+                failed += 1
+                first_failed = first_failed or row[0]
+                continue
+            new_tone = tone if tone is not None else row[2]
+            new_spam = (1 if is_spam else 0) if is_spam is not None else row[3]
+            new_summary = summary if summary is not None else row[4]
+            if (new_tone, new_spam, new_summary) != (row[2], row[3], row[4]):
+                changed += 1
+            # A label kept from before counts with the source it was stored with
+            if not sources:
+                new_source = row[5]
+            elif 'tone' in args.fields and 'spam' in args.fields:
+                new_source = label_source(*sources)
+            else:
+                new_source = label_source(*sources, row[5])
+            updates.append((new_tone, new_spam, new_summary, new_source, row[0]))
+
+        # The checkpoint stops short of the first failed row, so a rerun retries it
+        done_rows = [row for row in rows if first_failed is None or row[0] < first_failed]
+        if done_rows:
+            last_id = done_rows[-1][0]
+        processed += len(done_rows)
+        if not args.dry_run:
+            with conn:
+                conn.executemany(f"UPDATE {table} SET tone = ?, is_spam = ?, summary = ?, label_source = ?, enrichment_status = 'done' WHERE id = ?", updates)
+                if done_rows:
+                    conn.execute('''
+                        INSERT INTO backfill_checkpoints (run_name, table_name, last_id, rows_done, updated_at)
+                        VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                        ON CONFLICT (run_name, table_name) DO UPDATE SET
+                            last_id = excluded.last_id, rows_done = excluded.rows_done, updated_at = excluded.updated_at
+                    ''', (run_name, table, last_id, rows_done + processed))
+
+        elapsed = time.perf_counter() - started
+        print(f"[{table}] {processed} rows, {changed} changed, last id {last_id}, "
+              f"{processed / elapsed:.1f} rows/sec", file=sys.stderr)
+        if first_failed is not None:
+            print(f"[{table}] LLM calls failed for {failed} rows, stopping before id {first_failed}; "
+                  f"rerun to resume from there", file=sys.stderr)
+            break
+
+    return {"table": table, "rows": processed, "changed": changed, "failed": failed,
+            "seconds": round(time.perf_counter() - started, 2)}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=DATABASE, help='SQLite database path (default: %(default)s)')
+    parser.add_argument('--tables', nargs='+', choices=TABLES, default=list(TABLES))
+    parser.add_argument('--fields', nargs='+', choices=FIELDS, default=list(FIELDS))
+    parser.add_argument('--chunk-size', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=llama_utils.LLM_CONCURRENCY)
+    parser.add_argument('--run-name', default=None, help='checkpoint name (default: model name + fields)')
+    parser.add_argument('--restart', action='store_true', help='ignore and clear an existing checkpoint')
+    parser.add_argument('--dry-run', action='store_true', help='classify and report, but write nothing')
+    parser.add_argument('--invalidate-cache', action='store_true',
+                        help='drop cached LLM results for the current model first (use after a prompt change)')
+    parser.add_argument('--rpm', type=int, default=None, help='override SBOX_GROQ_RPM for this run')
+    parser.add_argument('--tpm', type=int, default=None, help='override SBOX_GROQ_TPM for this run')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not os.path.exists(args.db):
+        print(f"Database not found: {args.db}", file=sys.stderr)
+        return 1
+    database = Database(args.db)
+    current = database.schema_version()
+    if current < database.latest_version:
+        print(f"{args.db} is at schema v{current}, expected v{database.latest_version}: "
+              f"run `flask --app app migrate` first", file=sys.stderr)
+        return 1
+    if args.rpm is not None or args.tpm is not None:
+        limiter = llama_utils.rate_limiter
+        llama_utils.rate_limiter.configure(
+            limiter.requests_per_minute if args.rpm is None else args.rpm,
+            limiter.tokens_per_minute if args.tpm is None else args.tpm,
+        )
+    model_name = llama_utils.llm_backend.model_name
+    if args.invalidate_cache:
+        removed = llama_utils.cache.invalidate(model_name)
+        print(f"Dropped {removed} cached results for {model_name}", file=sys.stderr)
+
+    run_name = args.run_name or f"{model_name}:{','.join(sorted(args.fields))}"
+    conn = database.connect()  # WAL-friendly pragmas and busy timeout, same as the app
+    try:
+        if args.restart:
+            with conn:
+                conn.execute('DELETE FROM backfill_checkpoints WHERE run_name = ?', (run_name,))
+        failed = 0
+        for table in args.tables:
+            summary = backfill_table(conn, table, args, run_name)
+            failed += summary["failed"]
+            print(f"[{table}] done: {summary}", file=sys.stderr)
+    finally:
+        conn.close()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
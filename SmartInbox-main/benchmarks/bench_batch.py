@@ -0,0 +1,67 @@
+"""
+Offline throughput benchmark for the batch classification APIs.
+
+Swaps the Groq client for backend.fake_llm.FakeGroqClient and compares the
+serial per-email calls against the concurrent batch functions.
+
+    python benchmarks/bench_batch.py --emails 200 --latency 0.2 --concurrency 16
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GROQ_API", "offline-benchmark")
+os.environ["SBOX_LLM_CACHE_DB"] = ""
+
+from backend import llama_utils
+from backend.fake_llm import FakeGroqClient
+
+
+def make_emails(count, duplicate_ratio):
+    unique = max(1, int(count * (1 - duplicate_ratio)))
+    return [f"Hello team, this is update number {i % unique}. Please review the attached notes." for i in range(count)]
+
+
+def run(label, fn, emails, fake):
+    llama_utils.cache.invalidate()
+    calls_before = fake.calls
+    started = time.perf_counter()
+    results = fn(emails)
+    elapsed = time.perf_counter() - started
+    assert len(results) == len(emails)
+    return {
+        "mode": label,
+        "emails": len(emails),
+        "llm_calls": fake.calls - calls_before,
+        "seconds": round(elapsed, 3),
+        "emails_per_sec": round(len(emails) / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--emails", type=int, default=200)
+    parser.add_argument("--duplicates", type=float, default=0.25, help="fraction of repeated bodies")
+    parser.add_argument("--latency", type=float, default=0.1, help="fake LLM latency per call (s)")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--rpm", type=int, default=0, help="requests/minute limit (0 = unlimited)")
+    parser.add_argument("--tpm", type=int, default=0, help="tokens/minute limit (0 = unlimited)")
+    args = parser.parse_args()
+
+    fake = FakeGroqClient(latency=args.latency)
+    llama_utils.set_client(fake)
+    llama_utils.rate_limiter.configure(args.rpm, args.tpm)
+
+    emails = make_emails(args.emails, args.duplicates)
+    report = [
+        run("serial", lambda texts: [llama_utils.classify_email_tone(t) for t in texts], emails, fake),
+        run("batch", lambda texts: llama_utils.classify_email_tone_batch(texts, concurrency=args.concurrency), emails, fake),
+    ]
+    print(json.dumps({"results": report, "rate_limiter": llama_utils.rate_limiter.stats()}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
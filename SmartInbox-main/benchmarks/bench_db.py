@@ -0,0 +1,142 @@
+"""
+SQLite layer benchmark: per-request connections, rollback journal and no
+indexes (the original setup) versus pooled connections, WAL and the list
+indexes from backend/db.py.
+
+Seeds a throwaway database, then times the inbox, sent-mail and admin list
+queries plus single-row inserts under both setups.
+
+    python benchmarks/bench_db.py --emails 1000000 --users 2000
+"""
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.db import Database, _keyset_indexes
+
+INBOX_SQL = """
+    SELECT e.id, e.subject, e.body, e.summary, strftime('%Y-%m-%d %H:%M', e.sent_at) AS sent_at,
+           e.opened_at, e.tone, e.is_spam, u.email AS sender_email
+    FROM emails e JOIN users u ON e.sender_id = u.id
+    WHERE e.recipient_email = ? ORDER BY e.sent_at DESC
+"""
+SENT_INTERNAL_SQL = "SELECT id, recipient_email, subject, sent_at, is_spam, tone FROM emails WHERE sender_id = ? ORDER BY sent_at DESC"
+SENT_EXTERNAL_SQL = "SELECT id, recipient_email, subject, sent_at, is_spam, tone FROM external_emails WHERE sender_id = ? ORDER BY sent_at DESC"
+ADMIN_LATEST_SQL = "SELECT e.*, u.email AS sender_email FROM emails e JOIN users u ON e.sender_id = u.id ORDER BY e.sent_at DESC LIMIT 50"
+INSERT_SQL = "INSERT INTO emails (sender_id, recipient_email, subject, body, sent_at) VALUES (?, ?, ?, ?, ?)"
+
+
+def seed(db, users, emails, chunk=50000):
+    db.migrate()
+    conn = db.connect()
+    conn.executemany("INSERT INTO users (email, password_hash) VALUES (?, 'x')", [(f"user{i}@sbox.com",) for i in range(users)])
+    start = datetime(2025, 1, 1)
+    rng = random.Random(42)
+    for offset in range(0, emails, chunk):
+        internal, external = [], []
+        for i in range(offset, min(offset + chunk, emails)):
+            sender = rng.randrange(1, users + 1)
+            sent_at = start + timedelta(seconds=rng.randrange(365 * 86400))
+            body = f"Message {i} body text with a few words to make rows realistic. " * 3
+            if rng.random() < 0.8:
+                internal.append((sender, f"user{rng.randrange(users)}@sbox.com", f"Subject {i}", body, sent_at, "neutral"))
+            else:
+                external.append((sender, f"user{sender}", f"someone{i}@example.com", f"Subject {i}", body, sent_at, "neutral"))
+        conn.executemany("INSERT INTO emails (sender_id, recipient_email, subject, body, sent_at, tone) VALUES (?, ?, ?, ?, ?, ?)", internal)
+        conn.executemany("INSERT INTO external_emails (sender_id, sender_name, recipient_email, subject, body, sent_at, tone) VALUES (?, ?, ?, ?, ?, ?, ?)", external)
+        conn.commit()
+        print(f"seeded {min(offset + chunk, emails)} / {emails}", file=sys.stderr)
+    conn.close()
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda p: round(samples[min(len(samples) - 1, int(p / 100 * len(samples)))] * 1000, 3)
+    return {"p50_ms": pick(50), "p95_ms": pick(95), "p99_ms": pick(99)}
+
+
+def run_workload(get_conn, users, queries, inserts):
+    rng = random.Random(7)
+    timings = {"inbox": [], "sent": [], "admin_latest": [], "insert": []}
+    for _ in range(queries):
+        uid = rng.randrange(1, users + 1)
+        started = time.perf_counter()
+        conn = get_conn()
+        conn.execute(INBOX_SQL, (f"user{uid - 1}@sbox.com",)).fetchall()
+        conn.close()
+        timings["inbox"].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        conn = get_conn()
+        conn.execute(SENT_INTERNAL_SQL, (uid,)).fetchall()
+        conn.execute(SENT_EXTERNAL_SQL, (uid,)).fetchall()
+        conn.close()
+        timings["sent"].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        conn = get_conn()
+        conn.execute(ADMIN_LATEST_SQL).fetchall()
+        conn.close()
+        timings["admin_latest"].append(time.perf_counter() - started)
+
+    for i in range(inserts):
+        started = time.perf_counter()
+        conn = get_conn()
+        conn.execute(INSERT_SQL, (1, "user1@sbox.com", "bench", "insert body", datetime.now()))
+        conn.commit()
+        conn.close()
+        timings["insert"].append(time.perf_counter() - started)
+    return {name: percentiles(samples) for name, samples in timings.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--emails", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--inserts", type=int, default=500)
+    parser.add_argument("--db", default=None, help="database file to reuse (default: a new temp file)")
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(prefix="sbox-bench-"), "bench.db")
+    db = Database(path)
+    if not os.path.exists(path) or args.db is None:
+        seed(db, args.users, args.emails)
+
+    # Before: original setup
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode = DELETE")
+    for name in ("idx_emails_recipient_sent", "idx_emails_sender_sent", "idx_emails_sent",
+                 "idx_external_sender_sent", "idx_external_sent"):
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+    conn.close()
+
+    def per_request():
+        c = sqlite3.connect(path)
+        c.row_factory = sqlite3.Row
+        return c
+
+    before = run_workload(per_request, args.users, args.queries, args.inserts)
+
+    # After: indexes, WAL and pooled connections
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode = WAL")
+    _keyset_indexes(conn)
+    conn.execute("ANALYZE")
+    conn.close()
+    after = run_workload(db.connection, args.users, args.queries, args.inserts)
+
+    print(json.dumps({"emails": args.emails, "users": args.users, "before": before, "after": after,
+                      "pool": db.stats()}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Import/export throughput of mail_transfer.py, in messages/sec.
+
+Writes --messages synthetic emails to a JSONL and an mbox file, then runs
+`mail_transfer.py import` as a separate process into a copy of a freshly
+migrated database once per configuration:
+
+    chunk=1        one transaction per message (the row-at-a-time baseline)
+    chunk=N        one executemany and commit per N messages
+    +defer         ...with indexes, stats and search triggers rebuilt once at the end
+
+--existing seeds that many messages into the database first, since the
+deferred rebuild re-reads everything already stored. Peak RSS of each
+import process shows that memory stays flat as --messages grows. Export is
+timed on the result of the last run.
+
+    python benchmarks/bench_import.py --messages 100000 --existing 0
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from backend.db import Database
+from mail_transfer import connect, export, import_stream, write_jsonl, write_mbox
+
+WORDS = ("meeting invoice project deadline thanks please review attached update schedule budget "
+         "offer free prize account verify urgent report team friday call").split()
+TONES = ("neutral", "polite", "formal", "friendly", "urgent")
+
+
+def synthetic_records(count, seed=7):
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1)
+    for i in range(count):
+        external = rng.random() < 0.2
+        yield {
+            "source": "external" if external else "internal",
+            "sender": f"user{rng.randrange(500)}@sbox.com",
+            "recipient": f"someone{i}@example.com" if external else f"user{rng.randrange(500)}@sbox.com",
+            "subject": f"Subject {i} " + " ".join(rng.choices(WORDS, k=4)),
+            "body": "\n\n".join(" ".join(rng.choices(WORDS, k=rng.randrange(20, 120))) for _ in range(rng.randrange(1, 5))),
+            "sent_at": str(start + timedelta(seconds=rng.randrange(365 * 86400))),
+            "opened_at": None,
+            "tone": rng.choice(TONES),
+            "is_spam": rng.random() < 0.1,
+            "summary": None,
+        }
+
+
+def write_file(path, writer, count):
+    with open(path, "wb") as out:
+        for record in synthetic_records(count):
+            writer(out, record)
+    return os.path.getsize(path)
+
+
+def run_import(db_path, data_path, chunk_size, defer):
+    """Runs the CLI in a child process; returns its JSON report plus peak RSS from wait4()."""
+    command = [sys.executable, os.path.join(ROOT, "mail_transfer.py"), "--db", db_path, "--chunk-size", str(chunk_size),
+               "import", data_path, "--json"] + (["--offline", "--defer-indexes"] if defer else [])
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    output = proc.stdout.read()
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode:
+        raise SystemExit(f"import failed: {' '.join(command)}")
+    report = json.loads(output.decode().strip().splitlines()[-1])
+    report["peak_rss_mb"] = round(usage.ru_maxrss / 1024, 1)  # KiB on Linux
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--existing", type=int, default=0, help="messages already in the database before each import")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--baseline-messages", type=int, default=5000,
+                        help="messages for the chunk=1 run, which is slow (0 skips it)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="sbox-import-")
+    jsonl_path = os.path.join(workdir, "mail.jsonl")
+    mbox_path = os.path.join(workdir, "mail.mbox")
+    baseline_path = os.path.join(workdir, "baseline.jsonl")
+    files = {"jsonl_mb": write_file(jsonl_path, write_jsonl, args.messages),
+             "mbox_mb": write_file(mbox_path, write_mbox, args.messages)}
+    if args.baseline_messages:
+        write_file(baseline_path, write_jsonl, args.baseline_messages)
+
+    template = os.path.join(workdir, "template.db")
+    Database(template).migrate()
+    if args.existing:
+        existing_path = os.path.join(workdir, "existing.jsonl")
+        write_file(existing_path, write_jsonl, args.existing)
+        conn = connect(template, offline=True)
+        with open(existing_path, "rb") as stream:
+            import_stream(conn, stream, "jsonl", 5000, defer_indexes=True)
+        conn.close()
+
+    runs = [("jsonl chunk=1", baseline_path, 1, False)] if args.baseline_messages else []
+    runs += [
+        (f"jsonl chunk={args.chunk_size}", jsonl_path, args.chunk_size, False),
+        (f"jsonl chunk={args.chunk_size} +defer", jsonl_path, args.chunk_size, True),
+        (f"mbox chunk={args.chunk_size}", mbox_path, args.chunk_size, False),
+        (f"mbox chunk={args.chunk_size} +defer", mbox_path, args.chunk_size, True),
+    ]
+    report = {"messages": args.messages, "existing": args.existing,
+              **{k: round(v / 1e6, 1) for k, v in files.items()}, "imports": {}}
+    db_path = os.path.join(workdir, "Sbox.db")
+    for name, data_path, chunk_size, defer in runs:
+        shutil.copyfile(template, db_path)
+        result = run_import(db_path, data_path, chunk_size, defer)
+        report["imports"][name] = {key: result[key] for key in
+                                   ("imported", "messages_per_sec", "insert_seconds", "reindex_seconds", "peak_rss_mb")}
+        print(f"{name}: {result['messages_per_sec']} messages/sec", file=sys.stderr)
+
+    conn = connect(db_path)
+    for fmt in ("jsonl", "mbox"):
+        with open(os.devnull, "wb") as out:
+            started = time.perf_counter()
+            exported = export(conn, out, fmt, ("emails", "external_emails"), args.chunk_size)["messages"]
+            report[f"export_{fmt}_messages_per_sec"] = round(exported / (time.perf_counter() - started), 1)
+    conn.close()
+    shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
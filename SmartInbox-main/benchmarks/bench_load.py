@@ -0,0 +1,349 @@
+"""
+End-to-end load test: seeds a database with synthetic users and mail, swaps
+backend/fake_llm.py's FakeGroqClient in for the Groq client and points
+delivery at a local SMTP sink (backend/fake_smtp.py), then drives the Flask
+routes from --concurrency virtual users, each with its own logged-in session.
+
+Every scenario runs for --duration seconds on its own; "mixed" runs a
+weighted mix of all of them. Background jobs queued by a scenario are drained
+before the next one starts. The JSON report has throughput and p50/p95/p99
+per scenario; --out saves it and --compare diffs it against an earlier
+report, e.g. one taken on the previous commit.
+
+    python benchmarks/bench_load.py --emails 2000000 --workdir /tmp/sbox-load --out after.json --compare before.json
+
+A --workdir that already holds a seeded Sbox.db is reused as is, so the
+same dataset can be measured across commits without seeding again.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+from datetime import datetime, timedelta
+
+import bcrypt
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from backend.auth import BCRYPT_ROUNDS
+from backend.db import Database
+from backend.fake_llm import FakeGroqClient
+from backend.fake_smtp import FakeSMTPServer
+
+PASSWORD = "loadtest"
+ADMIN = ("admin@sbox.com", "admin@123")  # created by app.init_db()
+TONES = ("polite", "formal", "urgent", "friendly", "neutral", "appreciative")
+WORDS = ("meeting", "report", "invoice", "deadline", "project", "review", "budget", "schedule",
+         "client", "update", "proposal", "contract", "launch", "team", "feedback", "agenda")
+SCENARIOS = ("login", "send", "inbox", "sender_dashboard", "admin_dashboard", "summarize", "mark_read")
+MIX = {"inbox": 30, "mark_read": 20, "sender_dashboard": 15, "send": 15, "summarize": 10, "admin_dashboard": 5, "login": 5}
+
+
+# ------------------------- #
+# Dataset
+# ------------------------- #
+
+def sentence(rng, n):
+    return " ".join(rng.choice(WORDS) for _ in range(n))
+
+
+def seed(path, users, emails, chunk=50000):
+    db = Database(path)
+    db.migrate()
+    conn = db.connect()
+    password_hash = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(BCRYPT_ROUNDS)).decode()
+    conn.executemany("INSERT INTO users (email, password_hash) VALUES (?, ?)",
+                     [(f"user{i}@sbox.com", password_hash) for i in range(users)])
+    start = datetime(2025, 1, 1)
+    rng = random.Random(42)
+    for offset in range(0, emails, chunk):
+        internal, external = [], []
+        for i in range(offset, min(offset + chunk, emails)):
+            sender = rng.randrange(1, users + 1)
+            sent_at = start + timedelta(seconds=rng.randrange(365 * 86400))
+            subject, body = f"{sentence(rng, 4)} {i}", f"{sentence(rng, 60)} {i}"
+            tone, is_spam = rng.choice(TONES), rng.random() < 0.1
+            if rng.random() < 0.9:
+                # Half already summarized and half already opened, so summarize and mark_read hit both paths
+                internal.append((sender, f"user{rng.randrange(users)}@sbox.com", subject, body, sent_at, tone, is_spam,
+                                 sentence(rng, 12) if rng.random() < 0.5 else None,
+                                 sent_at + timedelta(hours=1) if rng.random() < 0.5 else None))
+            else:
+                external.append((sender, f"user{sender - 1}", f"contact{i}@example.com", subject, body, sent_at, tone, is_spam))
+        conn.executemany("INSERT INTO emails (sender_id, recipient_email, subject, body, sent_at, tone, is_spam, summary, opened_at) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", internal)
+        conn.executemany("INSERT INTO external_emails (sender_id, sender_name, recipient_email, subject, body, sent_at, tone, is_spam, delivery_status) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'sent')", external)
+        conn.commit()
+        print(f"seeded {min(offset + chunk, emails)} / {emails}", file=sys.stderr)
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+def drop_pending_jobs(path):
+    """Jobs left queued by an earlier run on the same workdir would compete with this one."""
+    db = Database(path)
+    conn = db.connect()
+    try:
+        dropped = conn.execute("DELETE FROM jobs WHERE status IN ('queued', 'running')").rowcount
+        conn.commit()
+        return dropped
+    finally:
+        conn.close()
+
+
+def dataset_counts(path):
+    db = Database(path)
+    conn = db.connect()
+    try:
+        counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in ("emails", "external_emails")}
+        counts["users"] = conn.execute("SELECT COUNT(*) FROM users WHERE is_admin = 0").fetchone()[0]
+        return counts
+    finally:
+        conn.close()
+
+
+# ------------------------- #
+# Virtual Users
+# ------------------------- #
+
+class VirtualUser:
+    """One logged-in user (plus an admin session) with the ids of mail in their inbox."""
+
+    def __init__(self, app_module, index, users, rng):
+        self.app = app_module.app
+        self.index = index
+        self.users = users
+        self.email = f"user{index}@sbox.com"
+        self.rng = rng
+        self.client = self.app.test_client()
+        self.admin = self.app.test_client()
+        self.user_id = self._login(self.client, self.email, PASSWORD)
+        self._login(self.admin, *ADMIN)
+        conn = app_module.get_db()
+        try:
+            self.inbox_ids = [row[0] for row in conn.execute(
+                "SELECT id FROM emails WHERE recipient_email = ? ORDER BY sent_at DESC LIMIT 500", (self.email,))]
+        finally:
+            conn.close()
+        self.sent = 0
+
+    def _login(self, client, email, password):
+        response = client.post('/login', json={'email': email, 'password': password})
+        if response.status_code != 200:
+            raise RuntimeError(f"Login failed for {email}: {response.status_code}")
+        with client.session_transaction() as session:
+            return session['user_id']
+
+    def _inbox_id(self):
+        return self.rng.choice(self.inbox_ids) if self.inbox_ids else 0
+
+    # Each scenario returns the response; status >= 400 counts as an error
+    def login(self):
+        return self.client.post('/login', json={'email': self.email, 'password': PASSWORD})
+
+    def send(self):
+        self.sent += 1
+        recipient = (f"contact{self.index}-{self.sent}@example.com" if self.rng.random() < 0.1
+                     else f"user{self.rng.randrange(self.users)}@sbox.com")
+        return self.client.post('/send', json={
+            'sender_id': self.user_id, 'recipient': recipient,
+            'subject': f"{sentence(self.rng, 4)} {self.sent}",
+            'body': f"{sentence(self.rng, 40)} (load test {self.index}-{self.sent})",
+        })
+
+    def inbox(self):
+        return self.client.get('/received_emails')
+
+    def sender_dashboard(self):
+        return self.client.get('/sender_dashboard')
+
+    def admin_dashboard(self):
+        return self.admin.get('/admin_dashboard')
+
+    def summarize(self):
+        return self.client.post('/summarize_email', json={'email_id': self._inbox_id()})
+
+    def mark_read(self):
+        return self.client.post(f'/mark_email_read/{self._inbox_id()}')
+
+
+# ------------------------- #
+# Runner
+# ------------------------- #
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+def run_scenario(vusers, names, weights, duration):
+    """Closed loop: every virtual user issues its next request as soon as the last one returns."""
+    latencies, errors = [], 0
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(vu):
+        nonlocal errors
+        local, failed = [], 0
+        while time.perf_counter() < deadline:
+            name = vu.rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            response = getattr(vu, name)()
+            response.get_data()
+            local.append(time.perf_counter() - started)
+            failed += response.status_code >= 400
+            response.close()
+        with lock:
+            latencies.extend(local)
+            errors += failed
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(vu,), name=f"load-{vu.index}") for vu in vusers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    ms = lambda value: round(value * 1000, 2) if value is not None else None
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "max_ms": ms(latencies[-1] if latencies else None),
+    }
+
+
+def drain(app_module, timeout):
+    """
+    Waits for enrichment and delivery jobs queued by the last scenario;
+    returns (seconds waited, jobs still pending when the timeout hit).
+    """
+    started = time.perf_counter()
+    while True:
+        pending = sum(queue.status()['depth'][state] for queue in (app_module.job_queue, app_module.delivery_queue)
+                      for state in ('queued', 'running'))
+        if not pending or time.perf_counter() - started >= timeout:
+            return round(time.perf_counter() - started, 2), pending
+        time.sleep(0.1)
+
+
+def compare(report, baseline):
+    """Percent change of throughput and p95/p99 per scenario against an earlier report."""
+    change = lambda new, old: round((new - old) / old * 100, 1) if new is not None and old else None
+    result = {"baseline_commit": baseline.get("config", {}).get("commit")}
+    for name, current in report["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(name)
+        if old:
+            result[name] = {f"{key}_change_pct": change(current[key], old[key])
+                            for key in ("throughput_rps", "p95_ms", "p99_ms")}
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--emails", type=int, default=200000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--workdir", help="directory holding Sbox.db; seeded if missing (default: a new temp dir)")
+    parser.add_argument("--concurrency", type=int, default=8, help="virtual users issuing requests at once")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per scenario")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS + ("mixed",)))
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds per fake LLM call")
+    parser.add_argument("--llm-jitter", type=float, default=0.1)
+    parser.add_argument("--smtp-latency", type=float, default=0.05, help="seconds per new SMTP connection")
+    parser.add_argument("--prefilter", action="store_true", help="train and use the naive Bayes pre-filter (off by default)")
+    parser.add_argument("--drain-timeout", type=float, default=120.0)
+    parser.add_argument("--out", help="write the JSON report here as well")
+    parser.add_argument("--compare", help="earlier report to compare against")
+    args = parser.parse_args()
+    if args.concurrency > args.users:
+        parser.error("--concurrency cannot exceed --users")
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="sbox-load-")
+    os.makedirs(workdir, exist_ok=True)
+    path = os.path.join(workdir, "Sbox.db")
+    if not os.path.exists(path):
+        seed(path, args.users, args.emails)
+    elif drop_pending_jobs(path):
+        print("dropped jobs left queued by an earlier run", file=sys.stderr)
+    counts = dataset_counts(path)
+
+    sink = FakeSMTPServer(connect_latency=args.smtp_latency).start()
+    # Read by the app modules at import time
+    os.environ.update({
+        "SBOX_LLM_BACKEND": "stub", "SBOX_GROQ_RPM": "0", "SBOX_GROQ_TPM": "0", "SBOX_LLM_CACHE_DB": "",
+        "SBOX_SMTP_HOST": sink.host, "SBOX_SMTP_PORT": str(sink.port), "SBOX_SMTP_SSL": "0",
+        "SBOX_SMTP_STARTTLS": "0", "SBOX_SMTP_RATE": "0", "SBOX_SUMMARY_PREFETCH": "0",
+        "SBOX_PREFILTER": "1" if args.prefilter else "0", "SBOX_LOG_LEVEL": os.getenv("SBOX_LOG_LEVEL", "WARNING"),
+        "SBOX_LOGIN_IP_LIMIT": "0", "SBOX_LOGIN_ACCOUNT_LIMIT": "0",  # every virtual user logs in from 127.0.0.1
+    })
+    os.chdir(workdir)  # app.py opens Sbox.db relative to the working directory
+    import app as app_module
+    app_module.create_app(migrate=True)  # also creates the admin account the admin_dashboard scenario uses
+    from backend import llama_utils
+    fake_llm = FakeGroqClient(latency=args.llm_latency, jitter=args.llm_jitter)
+    llama_utils.set_client(fake_llm)
+
+    rng = random.Random(7)
+    vusers = [VirtualUser(app_module, index, counts["users"], random.Random(rng.random()))
+              for index in rng.sample(range(counts["users"]), args.concurrency)]
+
+    report = {
+        "config": {"commit": git_commit(), "concurrency": args.concurrency, "duration_s": args.duration,
+                   "llm_latency_s": args.llm_latency, "llm_jitter_s": args.llm_jitter,
+                   "smtp_connect_latency_s": args.smtp_latency, "prefilter": args.prefilter},
+        "dataset": counts,
+        "scenarios": {},
+    }
+    for name in args.scenarios.split(","):
+        if name == "mixed":
+            names, weights = list(MIX), list(MIX.values())
+        elif name in SCENARIOS:
+            names, weights = [name], [1]
+        else:
+            parser.error(f"unknown scenario: {name}")
+        print(f"running {name} for {args.duration}s", file=sys.stderr)
+        result = run_scenario(vusers, names, weights, args.duration)
+        result["drain_s"], pending = drain(app_module, args.drain_timeout)
+        if pending:
+            result["undrained_jobs"] = pending  # later scenarios ran with these still being processed
+        report["scenarios"][name] = result
+
+    report["fake_llm_calls"] = fake_llm.calls
+    report["smtp"] = sink.stats()
+    app_module.job_queue.stop()
+    app_module.delivery_queue.stop()
+    sink.stop()
+
+    if args.compare:
+        with open(args.compare) as f:
+            report["comparison"] = compare(report, json.load(f))
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
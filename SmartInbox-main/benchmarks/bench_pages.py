@@ -0,0 +1,123 @@
+"""
+List view benchmark: loading a whole mailbox (the original inbox and
+sent-mail queries, bodies included) versus walking it in keyset pages with
+backend/mailbox.py.
+
+Seeds a throwaway database with most mail going to, and coming from, one
+heavy user, then reports latency and peak Python memory for the first page,
+a deep page and the full-list load.
+
+    python benchmarks/bench_pages.py --emails 200000 --heavy-share 0.2
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.db import Database
+from backend.mailbox import inbox_page, sent_page
+
+HEAVY = "user0@sbox.com"
+FULL_INBOX_SQL = """
+    SELECT e.id, e.subject, e.body, e.summary, strftime('%Y-%m-%d %H:%M', e.sent_at) AS sent_at,
+           e.opened_at, e.tone, e.is_spam, u.email AS sender_email
+    FROM emails e JOIN users u ON e.sender_id = u.id
+    WHERE e.recipient_email = ? ORDER BY e.sent_at DESC
+"""
+FULL_SENT_SQL = (
+    "SELECT id, recipient_email, subject, body, sent_at FROM emails WHERE sender_id = ? ORDER BY sent_at DESC",
+    "SELECT id, recipient_email, subject, body, sent_at FROM external_emails WHERE sender_id = ? ORDER BY sent_at DESC",
+)
+
+
+def seed(db, users, emails, heavy_share, chunk=50000):
+    db.migrate()
+    conn = db.connect()
+    conn.executemany("INSERT INTO users (email, password_hash) VALUES (?, 'x')", [(f"user{i}@sbox.com",) for i in range(users)])
+    start = datetime(2025, 1, 1)
+    rng = random.Random(42)
+    for offset in range(0, emails, chunk):
+        internal, external = [], []
+        for i in range(offset, min(offset + chunk, emails)):
+            heavy = rng.random() < heavy_share
+            sender = 1 if heavy and rng.random() < 0.5 else rng.randrange(2, users + 1)
+            recipient = HEAVY if heavy and sender != 1 else f"user{rng.randrange(1, users)}@sbox.com"
+            sent_at = start + timedelta(seconds=rng.randrange(365 * 86400))
+            body = f"Message {i} body text with a few words to make rows realistic. " * 20
+            if rng.random() < 0.8:
+                internal.append((sender, recipient, f"Subject {i}", body, sent_at))
+            else:
+                external.append((sender, f"user{sender}", f"someone{i}@example.com", f"Subject {i}", body, sent_at))
+        conn.executemany("INSERT INTO emails (sender_id, recipient_email, subject, body, sent_at) VALUES (?, ?, ?, ?, ?)", internal)
+        conn.executemany("INSERT INTO external_emails (sender_id, sender_name, recipient_email, subject, body, sent_at) VALUES (?, ?, ?, ?, ?, ?)", external)
+        conn.commit()
+        print(f"seeded {min(offset + chunk, emails)} / {emails}", file=sys.stderr)
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+def measure(fn, repeat):
+    """(p50 ms, peak KiB) of fn() over `repeat` runs."""
+    samples, peak = [], 0
+    for _ in range(repeat):
+        tracemalloc.start()
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    samples.sort()
+    return {"p50_ms": round(samples[len(samples) // 2] * 1000, 3), "peak_kib": round(peak / 1024, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--emails", type=int, default=200000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--heavy-share", type=float, default=0.2, help="fraction of mail to or from the heavy user")
+    parser.add_argument("--deep-page", type=int, default=50, help="page number used for the deep-page timing")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix="sbox-bench-"), "bench.db")
+    db = Database(path)
+    seed(db, args.users, args.emails, args.heavy_share)
+    conn = db.connect()
+
+    # Cursors for the deep page, collected once up front
+    inbox_cursor = sent_cursor = None
+    for _ in range(args.deep_page - 1):
+        _, inbox_cursor = inbox_page(conn, HEAVY, inbox_cursor)
+        _, sent_cursor = sent_page(conn, 1, sent_cursor)
+
+    def full_sent():
+        rows = [dict(r) for sql in FULL_SENT_SQL for r in conn.execute(sql, (1,)).fetchall()]
+        rows.sort(key=lambda e: e["sent_at"], reverse=True)
+
+    report = {
+        "emails": args.emails,
+        "heavy_inbox_rows": conn.execute("SELECT COUNT(*) FROM emails WHERE recipient_email = ?", (HEAVY,)).fetchone()[0],
+        "inbox": {
+            "full_list": measure(lambda: [dict(r) for r in conn.execute(FULL_INBOX_SQL, (HEAVY,)).fetchall()], args.repeat),
+            "first_page": measure(lambda: inbox_page(conn, HEAVY), args.repeat),
+            f"page_{args.deep_page}": measure(lambda: inbox_page(conn, HEAVY, inbox_cursor), args.repeat),
+        },
+        "sent": {
+            "full_list": measure(full_sent, args.repeat),
+            "first_page": measure(lambda: sent_page(conn, 1), args.repeat),
+            f"page_{args.deep_page}": measure(lambda: sent_page(conn, 1, sent_cursor), args.repeat),
+        },
+    }
+    conn.close()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Full-text search benchmark: seeds a throwaway database (the FTS index is
+filled by the insert triggers), then times ranked searches for rare, medium
+and common words, a prefix and a phrase query, admin-wide and scoped to
+one user's inbox.
+
+    python benchmarks/bench_search.py --emails 1000000
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.db import Database
+from backend.search import search
+
+VOCABULARY = [f"word{i}" for i in range(20000)]
+
+
+def seed(db, users, emails, chunk=50000):
+    db.migrate()
+    conn = db.connect()
+    conn.executemany("INSERT INTO users (email, password_hash) VALUES (?, 'x')", [(f"user{i}@sbox.com",) for i in range(users)])
+    start = datetime(2025, 1, 1)
+    rng = random.Random(42)
+    # Zipf-like: low-numbered words are common, high-numbered ones rare
+    weights = [1 / (rank + 1) for rank in range(len(VOCABULARY))]
+    for offset in range(0, emails, chunk):
+        rows = []
+        for i in range(offset, min(offset + chunk, emails)):
+            words = rng.choices(VOCABULARY, weights, k=60)
+            rows.append((rng.randrange(1, users + 1), f"user{rng.randrange(users)}@sbox.com",
+                         " ".join(words[:5]), " ".join(words[5:]), start + timedelta(seconds=rng.randrange(365 * 86400)),
+                         rng.choice(("polite", "formal", "urgent", "friendly")), rng.random() < 0.1))
+        conn.executemany("INSERT INTO emails (sender_id, recipient_email, subject, body, sent_at, tone, is_spam) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.commit()
+        print(f"seeded {min(offset + chunk, emails)} / {emails}", file=sys.stderr)
+    conn.execute("INSERT INTO emails_fts (emails_fts) VALUES ('optimize')")
+    conn.commit()
+    conn.close()
+
+
+def timed(fn, repeat):
+    samples, rows = [], 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = len(fn()[0])
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return {"p50_ms": round(samples[len(samples) // 2] * 1000, 3), "max_ms": round(samples[-1] * 1000, 3), "rows": rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--emails", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix="sbox-bench-"), "bench.db")
+    db = Database(path)
+    seed(db, args.users, args.emails)
+    conn = db.connect()
+    queries = {"rare": "word15000", "medium": "word500", "common": "word20",
+               "prefix": "word150*", "phrase": '"word3 word4"', "two_words": "word700 word900"}
+    report = {"emails": args.emails}
+    for name, query in queries.items():
+        report[name] = {
+            "admin_all": timed(lambda: search(conn, query, box='all'), args.repeat),
+            "admin_filtered": timed(lambda: search(conn, query, box='all', filters={'tone': 'urgent', 'spam': False}), args.repeat),
+            "user_inbox": timed(lambda: search(conn, query, box='inbox', user_email="user7@sbox.com"), args.repeat),
+        }
+    conn.close()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Outbound delivery benchmark against a local SMTP sink (backend/fake_smtp.py):
+one new connection per message, the original send_external_email pattern,
+versus sessions reused through backend/outbox.py's SMTPPool.
+
+--connect-latency stands in for the TCP + TLS handshake and login that a
+real relay costs per connection.
+
+    python benchmarks/bench_smtp.py --messages 500 --connect-latency 0.05
+"""
+import os
+import sys
+import json
+import time
+import smtplib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.fake_smtp import FakeSMTPServer
+from backend.outbox import SMTPPool, build_message
+
+FROM = "sbox@localhost"
+
+
+def connection_per_message(sink, messages, workers):
+    def send(i):
+        with smtplib.SMTP(sink.host, sink.port) as server:
+            server.sendmail(FROM, [f"user{i}@example.com"], messages[i])
+    with ThreadPoolExecutor(workers) as executor:
+        list(executor.map(send, range(len(messages))))
+
+
+def pooled(sink, messages, workers):
+    pool = SMTPPool(sink.host, sink.port, use_ssl=False, size=workers, max_per_connection=1000)
+    with ThreadPoolExecutor(workers) as executor:
+        list(executor.map(lambda i: pool.send(FROM, [f"user{i}@example.com"], messages[i]), range(len(messages))))
+    pool.close_all()
+    return pool.stats()
+
+
+def run(name, fn, args, messages):
+    sink = FakeSMTPServer(connect_latency=args.connect_latency).start()
+    started = time.perf_counter()
+    extra = fn(sink, messages, args.workers)
+    elapsed = time.perf_counter() - started
+    sink.stop()
+    counts = sink.stats()
+    result = {"seconds": round(elapsed, 3), "messages_per_s": round(counts["messages"] / elapsed, 1),
+              "connections": counts["connections"], "delivered": counts["messages"]}
+    if extra:
+        result["pool"] = extra
+    return name, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=2, help="concurrent senders (SBOX_SMTP_POOL)")
+    parser.add_argument("--connect-latency", type=float, default=0.05, help="seconds per new connection")
+    args = parser.parse_args()
+
+    messages = [build_message(FROM, "bench", f"user{i}@example.com", f"Subject {i}", "Body text. " * 50)
+                for i in range(args.messages)]
+    report = dict([run("connection_per_message", connection_per_message, args, messages),
+                   run("pooled_sessions", pooled, args, messages)])
+    report["speedup"] = round(report["pooled_sessions"]["messages_per_s"] / report["connection_per_message"]["messages_per_s"], 1)
+    print(json.dumps({"messages": args.messages, "workers": args.workers, **report}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Cold-start benchmark: what a fresh worker process pays before it can serve.
+Each run is a new interpreter against an already-migrated database and
+reports (median over --runs):
+
+    import_ms          import app (no side effects since the app factory)
+    create_app_ms      schema check + starting the background workers
+    first_request_ms   first GET / (template compiled, first pooled connection)
+    second_request_ms  the same request warm
+    llm_client_ms      building the Groq client, now deferred to the first LLM call
+    migrate_ms         one-time `flask --app app migrate` on an empty database (whole process)
+
+plus the slowest imports on the way to serving, from python -X importtime.
+
+    python benchmarks/bench_startup.py --runs 5
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def child(workdir, llm_client=True):
+    """Runs inside the measured process; prints one JSON line of timings."""
+    os.chdir(workdir)  # app.py opens Sbox.db relative to the working directory
+    sys.path.insert(0, ROOT)
+    timings = {}
+
+    started = time.perf_counter()
+    import app as app_module
+    timings["import_ms"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    app = app_module.create_app()
+    timings["create_app_ms"] = time.perf_counter() - started
+
+    client = app.test_client()
+    for name in ("first_request_ms", "second_request_ms"):
+        started = time.perf_counter()
+        response = client.get('/')
+        response.get_data()
+        timings[name] = time.perf_counter() - started
+        assert response.status_code == 200, response.status_code
+
+    if llm_client:
+        from backend.llm_backends import GroqBackend
+        from backend.llama_utils import MODEL_NAME
+        started = time.perf_counter()
+        GroqBackend(MODEL_NAME).client
+        timings["llm_client_ms"] = time.perf_counter() - started
+
+    print(json.dumps({k: round(v * 1000, 2) for k, v in timings.items()}))
+    os._exit(0)  # skip joining the daemon worker threads
+
+
+def run_child(workdir, env, importtime=False):
+    # The -X importtime run leaves out the Groq client so the list shows what startup itself imports
+    command = ([sys.executable, "-X", "importtime", os.path.abspath(__file__), "--child-imports", workdir] if importtime
+               else [sys.executable, os.path.abspath(__file__), "--child", workdir])
+    result = subprocess.run(command, env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def slowest_imports(stderr, top):
+    """Top-level-ish modules by cumulative import time (ms) from -X importtime output."""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = [part.strip() for part in line[len("import time:"):].split("|")]
+        if name.count(" ") <= 4:  # at most two levels of nesting
+            entries.append((int(cumulative) / 1000, name.strip()))
+    entries.sort(reverse=True)
+    return {name: round(ms, 1) for ms, name in entries[:top]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=8, help="slowest imports to list")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--child-imports", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child or args.child_imports:
+        child(args.child or args.child_imports, llm_client=bool(args.child))
+        return
+
+    workdir = tempfile.mkdtemp(prefix="sbox-startup-")
+    env = dict(os.environ, GROQ_API=os.getenv("GROQ_API", "bench"), SBOX_LLM_CACHE_DB="", SBOX_LOG_LEVEL="WARNING")
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-m", "flask", "--app", os.path.join(ROOT, "app.py"), "migrate"],
+                   cwd=workdir, env=env, capture_output=True, check=True)
+    migrate_ms = round((time.perf_counter() - started) * 1000, 1)
+
+    runs = [run_child(workdir, env)[0] for _ in range(args.runs)]
+    _, importtime = run_child(workdir, env, importtime=True)
+    report = {key: round(statistics.median(run[key] for run in runs), 2) for key in runs[0]}
+    report["migrate_ms"] = migrate_ms
+    report["runs"] = args.runs
+    report["slowest_imports_ms"] = slowest_imports(importtime, args.top)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
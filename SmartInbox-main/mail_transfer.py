@@ -0,0 +1,571 @@
+"""
+Stream mail into or out of Sbox.db as mbox or JSON Lines.
+
+Both directions hold one chunk of messages in memory at a time, so file
+size does not matter. Rows are read with keyset pagination on the primary
+key, and imports are inserted with one executemany per table per chunk,
+each chunk in its own transaction. Progress and the final rate are printed
+in messages/sec.
+
+    python mail_transfer.py export -o mail.jsonl              # both tables
+    python mail_transfer.py export --tables emails -o inbox.mbox
+    python mail_transfer.py import mail.mbox.gz --chunk-size 2000 --defer-indexes
+    python mail_transfer.py reindex                           # finish an interrupted --defer-indexes import
+
+The format follows the extension (.mbox, .jsonl, optionally .gz) unless
+--format is given; "-" reads stdin or writes stdout. Imported mail goes to
+the inbox table when the recipient has an account and to external_emails
+otherwise, unless a JSONL record (or an X-Sbox-Source header) says which.
+Unknown senders get a disabled placeholder account that cannot log in;
+registering an @sbox.com address claims its placeholder.
+"""
+import os
+import re
+import sys
+import gzip
+import json
+import time
+import sqlite3
+import argparse
+from datetime import datetime
+from email.header import Header, decode_header, make_header
+from email.parser import BytesParser
+from email.utils import format_datetime, getaddresses, parseaddr, parsedate_to_datetime
+
+from backend import mail_stats, search
+from backend.auth import PLACEHOLDER_HASH
+from backend.db import Database
+from backend.jobs import QUEUED
+
+DATABASE = 'Sbox.db'
+TABLES = ('emails', 'external_emails')
+SOURCES = {'emails': 'internal', 'external_emails': 'external'}
+FORMATS = ('jsonl', 'mbox')
+
+
+# ------------------------- #
+# File Helpers
+# ------------------------- #
+
+def detect_format(path, fmt):
+    if fmt:
+        return fmt
+    name = path[:-3] if path.endswith('.gz') else path
+    if name.endswith('.mbox') or name.endswith('.mbx'):
+        return 'mbox'
+    if name.endswith('.jsonl') or name.endswith('.ndjson'):
+        return 'jsonl'
+    raise SystemExit(f"Cannot tell the format of {path}: pass --format jsonl or mbox")
+
+
+def open_binary(path, mode):
+    """A binary stream for `path`: stdin/stdout for "-", transparently gzipped for .gz."""
+    if path == '-':
+        return sys.stdin.buffer if mode == 'rb' else sys.stdout.buffer
+    if path.endswith('.gz'):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+def parse_timestamp(value):
+    """A stored sent_at/opened_at string (or ISO 8601 from a JSONL file) as a naive local datetime, or None."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    return parsed.astimezone().replace(tzinfo=None) if parsed.tzinfo else parsed
+
+
+# ------------------------- #
+# Export
+# ------------------------- #
+
+def export_columns(table):
+    extra = "e.opened_at" if table == 'emails' else "e.sender_name, NULL AS opened_at"
+    return (f"e.id, u.email AS sender, e.recipient_email AS recipient, e.subject, e.body, e.sent_at, "
+            f"e.tone, e.is_spam, e.summary, {extra}")
+
+
+def iter_rows(conn, table, chunk_size):
+    """Keyset pagination on the primary key; memory use is one chunk regardless of table size."""
+    sql = (f"SELECT {export_columns(table)} FROM {table} e LEFT JOIN users u ON u.id = e.sender_id "
+           f"WHERE e.id > ? ORDER BY e.id LIMIT ?")
+    after_id = 0
+    while True:
+        rows = conn.execute(sql, (after_id, chunk_size)).fetchall()
+        if not rows:
+            return
+        yield from rows
+        after_id = rows[-1]['id']
+
+
+def to_record(table, row) -> dict:
+    record = {
+        'source': SOURCES[table], 'sender': row['sender'], 'recipient': row['recipient'],
+        'subject': row['subject'], 'body': row['body'], 'sent_at': row['sent_at'], 'opened_at': row['opened_at'],
+        'tone': row['tone'], 'is_spam': bool(row['is_spam']), 'summary': row['summary'],
+    }
+    if table == 'external_emails':
+        record['sender_name'] = row['sender_name']
+    return record
+
+
+def write_jsonl(out, record):
+    out.write(json.dumps(record, ensure_ascii=False, default=str).encode('utf-8') + b'\n')
+
+
+def _header(value):
+    """One line of header text; non-ASCII becomes an RFC 2047 encoded word."""
+    value = ' '.join(str(value).split())
+    return value if value.isascii() else Header(value, 'utf-8').encode()
+
+
+FROM_LINE_RE = re.compile(r'^(>*From )', re.MULTILINE)
+
+
+def write_mbox(out, record):
+    """
+    mboxrd: body lines starting with (>*)From  get one more ">". Headers are
+    written directly; the email package's generator is ~10x slower per message.
+    """
+    sender = record['sender'] or 'unknown@sbox.com'
+    sent_at = parse_timestamp(record['sent_at']) or datetime.now()
+    headers = [
+        f"From {sender} {sent_at.strftime('%a %b %d %H:%M:%S %Y')}",
+        f"From: {sender}",
+        f"To: {record['recipient'] or ''}",
+        f"Subject: {_header(record['subject'] or '')}",
+        f"Date: {format_datetime(sent_at.astimezone())}",
+        # Sbox's own fields ride along as headers so an export imports back unchanged
+        f"X-Sbox-Source: {record['source']}",
+        f"X-Sbox-Sent-At: {record['sent_at']}",
+        f"X-Sbox-Spam: {'yes' if record['is_spam'] else 'no'}",
+    ]
+    for name, key in (('X-Sbox-Opened-At', 'opened_at'), ('X-Sbox-Tone', 'tone'), ('X-Sbox-Summary', 'summary'),
+                      ('X-Sbox-Sender-Name', 'sender_name')):
+        if record.get(key):
+            headers.append(f"{name}: {_header(record[key])}")
+    headers += ["MIME-Version: 1.0", 'Content-Type: text/plain; charset="utf-8"', "Content-Transfer-Encoding: 8bit"]
+    body = FROM_LINE_RE.sub(r'>\1', (record['body'] or '').replace('\r\n', '\n'))
+    out.write(('\n'.join(headers) + '\n\n' + body + '\n\n').encode('utf-8', 'surrogateescape'))
+
+
+def export(conn, out, fmt, tables, chunk_size):
+    writer = write_mbox if fmt == 'mbox' else write_jsonl
+    started = time.perf_counter()
+    count = 0
+    for table in tables:
+        for row in iter_rows(conn, table, chunk_size):
+            writer(out, to_record(table, row))
+            count += 1
+            if count % (chunk_size * 10) == 0:
+                print(f"[export] {count} messages, {count / (time.perf_counter() - started):.1f} messages/sec",
+                      file=sys.stderr)
+    out.flush()
+    return {'messages': count, 'seconds': round(time.perf_counter() - started, 2)}
+
+
+# ------------------------- #
+# Import: Readers
+# ------------------------- #
+
+def read_jsonl(stream):
+    """Yields one dict per line; a line that is not a JSON object yields None (counted as invalid)."""
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield record if isinstance(record, dict) else None
+
+
+FROM_QUOTE_RE = re.compile(rb'^>(>*From )')
+
+
+def read_mbox(stream):
+    """
+    Splits an mbox on "From " lines without loading it (the stdlib mailbox
+    module indexes the whole file first) and yields one record per message.
+    """
+    parser = BytesParser()  # compat32: plain string headers, much cheaper than policy.default's header objects
+    lines = []
+    for line in stream:
+        if line.startswith(b'From '):
+            if lines:
+                yield _mbox_record(parser, lines)
+            lines = []
+            continue
+        lines.append(FROM_QUOTE_RE.sub(rb'\1', line))
+    if lines:
+        yield _mbox_record(parser, lines)
+
+
+TAG_RE = re.compile(r'<[^>]+>')
+
+
+def _decoded(value):
+    """Unfolded header text with RFC 2047 encoded words decoded, or None."""
+    if value is None:
+        return None
+    value = str(value)
+    if '=?' in value:
+        try:
+            value = str(make_header(decode_header(value)))
+        except (LookupError, ValueError, UnicodeError):
+            pass
+    return ' '.join(value.split())
+
+
+def _text_body(message):
+    """The first text/plain part, else the first text/html part with tags stripped."""
+    html = None
+    for part in message.walk():
+        content_type = part.get_content_type()
+        if content_type not in ('text/plain', 'text/html') or part.get_filename():
+            continue
+        payload = part.get_payload(decode=True) or b''
+        try:
+            text = payload.decode(part.get_content_charset() or 'utf-8', 'replace')
+        except LookupError:  # unknown charset
+            text = payload.decode('utf-8', 'replace')
+        if content_type == 'text/plain':
+            return text
+        html = html if html is not None else TAG_RE.sub('', text)
+    return html or ''
+
+
+def _mbox_record(parser, lines):
+    if len(lines) > 1 and lines[-1].strip() == b'':
+        lines.pop()  # the blank line that separates messages
+    try:
+        message = parser.parsebytes(b''.join(lines))
+        sent_at = message['X-Sbox-Sent-At']
+        if not sent_at and message['Date']:
+            try:
+                date = parsedate_to_datetime(str(message['Date']))
+                sent_at = str(date.astimezone().replace(tzinfo=None) if date.tzinfo else date)
+            except (TypeError, ValueError):
+                sent_at = None
+        sender_name, sender = parseaddr(_decoded(message['From']) or '')
+        recipients = getaddresses([_decoded(message['To']) or ''])
+        spam = message['X-Sbox-Spam']
+        body = _text_body(message)
+        return {
+            'source': message['X-Sbox-Source'], 'sender': sender,
+            'sender_name': _decoded(message['X-Sbox-Sender-Name']) or sender_name,
+            'recipient': recipients[0][1] if recipients else '', 'subject': _decoded(message['Subject']) or '',
+            'body': body[:-1] if body.endswith('\n') else body, 'sent_at': sent_at,
+            'opened_at': message['X-Sbox-Opened-At'], 'tone': _decoded(message['X-Sbox-Tone']),
+            'is_spam': None if spam is None else str(spam).strip().lower() == 'yes',
+            'summary': _decoded(message['X-Sbox-Summary']),
+        }
+    except Exception:
+        return None
+
+
+# ------------------------- #
+# Import: Chunked Writer
+# ------------------------- #
+
+INSERT_SQL = {
+    'emails': '''INSERT INTO emails (sender_id, recipient_email, subject, body, sent_at, opened_at,
+                 tone, is_spam, summary, enrichment_status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+    'external_emails': '''INSERT INTO external_emails (sender_id, sender_name, recipient_email, subject, body, sent_at,
+                          tone, is_spam, summary, enrichment_status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+}
+
+
+class Importer:
+    """
+    Buffers up to chunk_size rows, then writes them with one executemany per
+    table inside a single transaction. With enrich=True, rows that arrive
+    without a tone are marked pending and get an enrich_email job, queued in
+    the same transaction by one INSERT ... SELECT. Placeholder accounts for
+    unknown senders are created in that transaction too, so a chunk that
+    rolls back leaves none behind.
+    """
+    NEW_USER = -1  # a placeholder account the next flush() creates
+
+    def __init__(self, conn, chunk_size=1000, create_users=True, enrich=False):
+        self.conn = conn
+        self.chunk_size = chunk_size
+        self.create_users = create_users
+        self.enrich = enrich
+        self._user_ids = {}  # email -> id, NEW_USER or None; one entry per distinct address
+        self._new_users = []
+        self._pending = {table: [] for table in TABLES}  # rows start with the sender's email, not id
+        self.counters = {'imported': 0, 'internal': 0, 'external': 0, 'invalid': 0, 'skipped': 0,
+                         'users_created': 0, 'queued': 0}
+
+    def _user_id(self, email, create):
+        if email not in self._user_ids:
+            row = self.conn.execute('SELECT id FROM users WHERE email = ?', (email,)).fetchone()
+            self._user_ids[email] = row[0] if row else None
+        if self._user_ids[email] is None and create:
+            self._user_ids[email] = self.NEW_USER
+            self._new_users.append(email)
+        return self._user_ids[email]
+
+    def add(self, record):
+        if record is None:
+            self.counters['invalid'] += 1
+            return
+        sender = (record.get('sender') or '').strip().lower()
+        recipient = (record.get('recipient') or '').strip().lower()
+        if not sender or not recipient:
+            self.counters['invalid'] += 1
+            return
+        if self._user_id(sender, self.create_users) is None:
+            self.counters['skipped'] += 1
+            return
+        source = record.get('source')
+        if source not in ('internal', 'external'):
+            source = 'internal' if self._user_id(recipient, False) is not None else 'external'
+        tone = record.get('tone') or None
+        status = 'pending' if self.enrich and tone is None else 'done'
+        sent_at = parse_timestamp(record.get('sent_at')) or datetime.now()
+        values = (recipient, record.get('subject') or '', record.get('body') or '', sent_at)
+        labels = (tone, 1 if record.get('is_spam') else 0, record.get('summary') or None, status)
+        if source == 'internal':
+            self._pending['emails'].append((sender, *values, parse_timestamp(record.get('opened_at')), *labels))
+        else:
+            name = record.get('sender_name') or sender.split('@')[0]
+            self._pending['external_emails'].append((sender, name, *values, *labels))
+        self.counters[source] += 1
+        if sum(len(rows) for rows in self._pending.values()) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not any(self._pending.values()):
+            return
+        created, imported, queued = [], 0, 0
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            for email in self._new_users:
+                cur = self.conn.execute('INSERT INTO users (email, password_hash, is_active) VALUES (?, ?, 0)',
+                                        (email, PLACEHOLDER_HASH))
+                self._user_ids[email] = cur.lastrowid
+                created.append(email)
+            for table, rows in self._pending.items():
+                if not rows:
+                    continue
+                # Nothing else can insert while this transaction holds the write lock
+                last_id = self.conn.execute(f'SELECT COALESCE(MAX(id), 0) FROM {table}').fetchone()[0]
+                self.conn.executemany(INSERT_SQL[table], [(self._user_ids[row[0]], *row[1:]) for row in rows])
+                if self.enrich:
+                    now = time.time()
+                    queued += self.conn.execute(f'''
+                        INSERT INTO jobs (kind, payload, status, run_after, created_at, updated_at)
+                        SELECT 'enrich_email', json_object('table', ?, 'id', id), ?, ?, ?, ?
+                        FROM {table} WHERE id > ? AND enrichment_status = 'pending'
+                    ''', (table, QUEUED, now, now, now, last_id)).rowcount
+                imported += len(rows)
+            self.conn.execute('COMMIT')
+        except BaseException:  # including Ctrl-C, so the next transaction can start
+            self.conn.execute('ROLLBACK')
+            for email in created:
+                self._user_ids[email] = self.NEW_USER
+            raise
+        self.counters['users_created'] += len(created)
+        self.counters['imported'] += imported
+        self.counters['queued'] += queued
+        self._new_users.clear()
+        for rows in self._pending.values():
+            rows.clear()
+
+
+# ------------------------- #
+# Deferred Index Maintenance
+# ------------------------- #
+# --defer-indexes drops the secondary indexes and the stats/search triggers
+# of both email tables for the duration of the import, then recreates them
+# and rebuilds the counters and the FTS index in one pass. That is faster
+# when the import is large next to the mail already stored. The definitions
+# are saved in the database first, so `reindex` can finish the job if the
+# import is interrupted.
+
+def suspend_maintenance(conn):
+    conn.execute('BEGIN IMMEDIATE')
+    conn.execute('CREATE TABLE IF NOT EXISTS deferred_schema (name TEXT PRIMARY KEY, type TEXT NOT NULL, sql TEXT NOT NULL)')
+    rows = conn.execute(f'''
+        SELECT name, type, sql FROM sqlite_master
+        WHERE type IN ('index', 'trigger') AND sql IS NOT NULL AND tbl_name IN ({', '.join('?' * len(TABLES))})
+    ''', TABLES).fetchall()
+    conn.executemany('INSERT OR IGNORE INTO deferred_schema (name, type, sql) VALUES (?, ?, ?)', rows)
+    for name, kind, _ in rows:
+        conn.execute(f'DROP {kind.upper()} IF EXISTS "{name}"')
+    conn.execute('COMMIT')
+    return len(rows)
+
+
+def restore_maintenance(conn):
+    """Recreates what suspend_maintenance() dropped and rebuilds counters and search; None if nothing was deferred."""
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'deferred_schema'").fetchone():
+        return None
+    started = time.perf_counter()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        existing = {row[0] for row in conn.execute('SELECT name FROM sqlite_master')}
+        # Indexes first: bulk-building one from sorted keys is cheaper than row-by-row maintenance
+        restored = conn.execute("SELECT name, sql FROM deferred_schema ORDER BY type = 'trigger', name").fetchall()
+        for name, sql in restored:
+            if name not in existing:
+                conn.execute(sql)
+        mail_stats.rebuild(conn)
+        if search.available(conn):
+            search.rebuild(conn)
+        conn.execute('DROP TABLE deferred_schema')
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return {'restored': len(restored), 'seconds': round(time.perf_counter() - started, 2)}
+
+
+def import_stream(conn, stream, fmt, chunk_size=1000, create_users=True, enrich=False, defer_indexes=False):
+    importer = Importer(conn, chunk_size, create_users, enrich)
+    reader = read_mbox if fmt == 'mbox' else read_jsonl
+    if defer_indexes:
+        suspend_maintenance(conn)
+    started = time.perf_counter()
+    report_every = chunk_size * 10
+    try:
+        for seen, record in enumerate(reader(stream), 1):
+            importer.add(record)
+            if seen % report_every == 0:
+                print(f"[import] {seen} messages, {seen / (time.perf_counter() - started):.1f} messages/sec",
+                      file=sys.stderr)
+        importer.flush()
+    finally:
+        insert_seconds = time.perf_counter() - started
+        reindex = restore_maintenance(conn) if defer_indexes else None
+    total = time.perf_counter() - started
+    counters = importer.counters
+    return {
+        **counters,
+        'insert_seconds': round(insert_seconds, 2),
+        'reindex_seconds': reindex['seconds'] if reindex else 0.0,
+        'seconds': round(total, 2),
+        'messages_per_sec': round(counters['imported'] / total, 1) if total else None,
+    }
+
+
+# ------------------------- #
+# CLI
+# ------------------------- #
+
+def connect(path, offline=False):
+    """
+    A connection for one transfer. offline=True also locks everyone else out
+    until it closes (see take_offline), as DDL needs the app to be stopped.
+    """
+    database = Database(path)
+    current = database.schema_version()
+    if current < database.latest_version:
+        raise SystemExit(f"{path} is at schema v{current}, expected v{database.latest_version}: "
+                         f"run `flask --app app migrate` first")
+    conn = database.connect()
+    conn.isolation_level = None  # transactions are managed explicitly, one per chunk
+    # Pages of a memory-mapped, growing file count towards RSS; a one-pass transfer gains nothing from them
+    conn.execute('PRAGMA mmap_size = 0')
+    if offline:
+        take_offline(conn, path)
+    return conn
+
+
+def take_offline(conn, path):
+    """
+    Takes an exclusive lock that is held until the connection closes. In WAL
+    mode that only succeeds while no other connection has the database open,
+    so it refuses to run next to the app, and keeps the app out meanwhile.
+    """
+    conn.execute('PRAGMA locking_mode = EXCLUSIVE')
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute('COMMIT')
+    except sqlite3.OperationalError as e:
+        conn.close()
+        raise SystemExit(f"{path} is open in another process ({e}): stop the app first")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=DATABASE, help='SQLite database path (default: %(default)s)')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='messages per read/insert batch')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export_cmd = commands.add_parser('export', help='write mail to a file')
+    export_cmd.add_argument('-o', '--output', default='-', help='file to write, "-" for stdout (default)')
+    export_cmd.add_argument('--format', choices=FORMATS, default=None, help='default: from the extension, else jsonl')
+    export_cmd.add_argument('--tables', nargs='+', choices=TABLES, default=list(TABLES))
+
+    import_cmd = commands.add_parser('import', help='load mail from a file')
+    import_cmd.add_argument('input', help='file to read, "-" for stdin')
+    import_cmd.add_argument('--format', choices=FORMATS, default=None)
+    import_cmd.add_argument('--offline', action='store_true',
+                            help='the app is stopped: lock the database for the whole run (refused while anything '
+                                 'else has it open)')
+    import_cmd.add_argument('--defer-indexes', action='store_true',
+                            help='drop indexes and stats/search triggers during the import, rebuild them after; '
+                                 'schema changes, so it requires --offline')
+    import_cmd.add_argument('--skip-unknown-senders', action='store_true',
+                            help='skip mail from addresses without an account instead of creating one')
+    import_cmd.add_argument('--enrich', action='store_true',
+                            help='queue tone/spam/summary classification for mail imported without a tone')
+    import_cmd.add_argument('--json', action='store_true', help='print the final report as JSON on stdout')
+
+    commands.add_parser('reindex', help='restore indexes and triggers left dropped by an interrupted --defer-indexes '
+                                        'import (runs offline, like --defer-indexes)')
+    args = parser.parse_args(argv)
+    if args.command == 'import' and args.defer_indexes and not args.offline:
+        # Mail the app wrote meanwhile would miss the stats and search index, and the
+        # DDL would leave the app's connections with a stale schema
+        parser.error("--defer-indexes changes the schema: stop the app and add --offline")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not os.path.exists(args.db):
+        print(f"Database not found: {args.db}", file=sys.stderr)
+        return 1
+    conn = connect(args.db, offline=args.command == 'reindex' or getattr(args, 'offline', False))
+    try:
+        if args.command == 'export':
+            fmt = args.format or (detect_format(args.output, None) if args.output != '-' else 'jsonl')
+            out = open_binary(args.output, 'wb')
+            try:
+                summary = export(conn, out, fmt, args.tables, args.chunk_size)
+            finally:
+                if out is not sys.stdout.buffer:
+                    out.close()
+            print(f"[export] done: {summary}", file=sys.stderr)
+        elif args.command == 'import':
+            fmt = detect_format(args.input, args.format) if args.input != '-' or args.format else 'jsonl'
+            stream = open_binary(args.input, 'rb')
+            try:
+                summary = import_stream(conn, stream, fmt, args.chunk_size, create_users=not args.skip_unknown_senders,
+                                        enrich=args.enrich, defer_indexes=args.defer_indexes)
+            finally:
+                if stream is not sys.stdin.buffer:
+                    stream.close()
+            print(f"[import] done: {summary}", file=sys.stderr)
+            if args.json:
+                print(json.dumps(summary))
+            if summary['queued']:
+                print(f"[import] {summary['queued']} messages queued for classification; "
+                      f"the app's enrichment workers will pick them up", file=sys.stderr)
+        else:
+            result = restore_maintenance(conn)
+            print(f"[reindex] {result or 'nothing was deferred'}", file=sys.stderr)
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
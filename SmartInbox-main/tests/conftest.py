@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+# Lets `pytest` run from any directory, like the benchmarks do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.db import Database
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = Database(str(tmp_path / "Sbox.db"))
+    database.migrate()
+    conn = database.connection()
+    conn.execute("INSERT INTO users (email, password_hash) VALUES ('alice@sbox.com', 'x')")
+    conn.commit()
+    conn.close()
+    yield database
+    database.close_all()
@@ -0,0 +1,85 @@
+import sqlite3
+
+import pytest
+
+from backend import bulk
+
+
+@pytest.fixture
+def conn(db):
+    conn = db.connection()
+    conn.execute("INSERT INTO users (email, password_hash) VALUES ('bob@sbox.com', 'x')")
+    rows = [
+        ("polite, formal", 0, "2026-01-05 09:00:00"),
+        ("urgent", 1, "2026-01-05 23:59:00"),
+        ("Polite", 0, "2026-01-06 00:00:00"),
+        (None, 0, "2026-01-07 12:00:00"),
+    ]
+    for tone, is_spam, sent_at in rows:
+        conn.execute("INSERT INTO emails (sender_id, recipient_email, subject, body, tone, is_spam, sent_at) "
+                     "VALUES (1, 'bob@sbox.com', 'Hi', 'hello', ?, ?, ?)", (tone, is_spam, sent_at))
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def matching(conn, source="internal", ids=None, filters=None):
+    table, where, params = bulk.selection(source, ids, filters)
+    return [row[0] for row in conn.execute(f"SELECT id FROM {table} WHERE {where} ORDER BY id", params)]
+
+
+@pytest.mark.parametrize("source, ids, filters, message", [
+    ("drafts", [1], None, "source"),
+    ("internal", None, None, "at least one filter"),
+    ("internal", None, {}, "at least one filter"),
+    ("internal", None, {"tone": ""}, "at least one filter"),
+    ("internal", "1,2", None, "list"),
+    ("internal", ["1", "two"], None, "integers"),
+    ("internal", list(range(bulk.MAX_IDS + 1)), None, "at most"),
+    ("internal", None, ["tone"], "object"),
+    ("internal", None, {"subject": "Hi"}, "Unknown filter"),
+    ("internal", None, {"after": "05/01/2026"}, "YYYY-MM-DD"),
+    ("internal", None, {"sender_id": "alice"}, "sender_id"),
+    ("external", None, {"unread": True}, "read state"),
+])
+def test_selection_rejects_bad_input(source, ids, filters, message):
+    with pytest.raises(ValueError, match=message):
+        bulk.selection(source, ids, filters)
+
+
+def test_selection_filters(conn):
+    assert matching(conn, ids=[2, "4", 99]) == [2, 4]
+    assert matching(conn, filters={"tone": "polite"}) == [1, 3]  # either label of a multi-tone row
+    assert matching(conn, filters={"spam": "yes"}) == [2]
+    assert matching(conn, filters={"after": "2026-01-06"}) == [3, 4]
+    assert matching(conn, filters={"before": "2026-01-05"}) == [1, 2]  # the whole named day
+    assert matching(conn, ids=[1, 2, 3], filters={"tone": "polite", "before": "2026-01-05"}) == [1]
+
+
+def test_apply_actions(conn):
+    assert bulk.apply(conn, "reclassify", "internal", filters={"tone": "urgent"}) == 1
+    assert bulk.apply(conn, "reclassify", "internal", ids=[2]) == 0  # already pending
+    assert conn.execute("SELECT COUNT(*) FROM jobs WHERE kind = 'enrich_email'").fetchone()[0] == 1
+
+    read = bulk.apply(conn, "mark_read", "internal", ids=[1, 3])
+    assert sorted(tuple(row) for row in read) == [(1, 1), (3, 1)]
+    assert len(bulk.apply(conn, "mark_read", "internal", filters={"unread": True})) == 2
+    assert matching(conn, filters={"unread": True}) == []
+
+    assert bulk.apply(conn, "delete", "internal", filters={"spam": True}) == 1
+    assert conn.execute("SELECT COUNT(*) FROM emails").fetchone()[0] == 3
+    with pytest.raises(ValueError, match="Unknown action"):
+        bulk.apply(conn, "archive", "internal", ids=[1])
+
+
+def test_apply_rolls_back_the_whole_action(conn):
+    # The job rows are inserted first; failing the status update must take them back out
+    conn.execute("CREATE TEMP TRIGGER refuse_pending BEFORE UPDATE OF enrichment_status ON emails "
+                 "WHEN NEW.id = 3 BEGIN SELECT RAISE(ABORT, 'refused'); END")
+
+    with pytest.raises(sqlite3.IntegrityError):
+        bulk.apply(conn, "reclassify", "internal", filters={"after": "2026-01-01"})
+
+    assert not conn.in_transaction
+    assert conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0] == 0
+    assert conn.execute("SELECT COUNT(*) FROM emails WHERE enrichment_status = 'pending'").fetchone()[0] == 0
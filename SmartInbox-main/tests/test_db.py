@@ -0,0 +1,40 @@
+import sqlite3
+
+
+def change_schema(path):
+    """DDL from a second connection, as a CLI or another process would run it."""
+    other = sqlite3.connect(path)
+    other.execute("CREATE TABLE IF NOT EXISTS unrelated (value TEXT)")
+    other.commit()
+    other.close()
+
+
+def test_insert_after_schema_change_on_another_connection(db):
+    conn = db.connection()
+    conn.execute("SELECT COUNT(*) FROM emails").fetchone()  # schema loaded before the change
+    change_schema(db.path)
+
+    conn.execute("INSERT INTO emails (sender_id, recipient_email, subject, body) VALUES (1, 'bob@sbox.com', 'Budget', 'quarterly numbers')")
+    conn.commit()
+
+    assert conn.execute("SELECT COUNT(*) FROM emails").fetchone()[0] == 1
+    assert conn.execute("SELECT rowid FROM emails_fts WHERE emails_fts MATCH 'quarterly'").fetchone()[0] == 1
+    conn.execute("INSERT INTO emails_fts (emails_fts) VALUES ('integrity-check')")
+    conn.close()
+
+
+def test_update_after_schema_change_on_another_connection(db):
+    setup = sqlite3.connect(db.path)
+    setup.execute("INSERT INTO emails (sender_id, recipient_email, subject, body) VALUES (1, 'bob@sbox.com', 'Hi', 'hello')")
+    setup.commit()
+    setup.close()
+    conn = db.connection()
+    conn.execute("SELECT body FROM emails WHERE id = 1").fetchone()
+    change_schema(db.path)
+
+    conn.execute("UPDATE emails SET tone = 'polite', summary = 'greeting' WHERE id = 1")
+    conn.commit()
+
+    assert conn.execute("SELECT rowid FROM emails_fts WHERE emails_fts MATCH 'greeting'").fetchone()[0] == 1
+    conn.execute("INSERT INTO emails_fts (emails_fts) VALUES ('integrity-check')")
+    conn.close()
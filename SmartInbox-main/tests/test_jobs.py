@@ -0,0 +1,151 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from backend.jobs import DEAD, DONE, QUEUED, JobQueue, PermanentJobError, enqueue, init_jobs_table
+
+
+@pytest.fixture
+def queue(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    conn = sqlite3.connect(path)
+    init_jobs_table(conn)
+    conn.commit()
+    conn.close()
+    queue = JobQueue(path, workers=1, max_attempts=3, base_delay=2.0, max_delay=5.0)
+    yield queue
+    queue.stop()
+
+
+def add_job(queue, kind="work", payload=None):
+    conn = queue._connect()
+    job_id = enqueue(conn, kind, payload or {})
+    conn.close()
+    return job_id
+
+
+def run_due(queue):
+    """Claims and runs one due job on this thread, as a worker would; returns False if none was due."""
+    conn = queue._connect()
+    try:
+        job = queue._claim(conn)
+        if job is None:
+            return False
+        queue._execute(conn, job)
+        return True
+    finally:
+        conn.close()
+
+
+def make_due(queue, job_id):
+    conn = queue._connect()
+    conn.execute("UPDATE jobs SET run_after = 0 WHERE id = ?", (job_id,))
+    conn.close()
+
+
+def job_row(queue, job_id):
+    conn = queue._connect()
+    row = conn.execute("SELECT status, attempts, run_after, last_error FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    conn.close()
+    return row
+
+
+def test_success_marks_job_done(queue):
+    seen = []
+    queue.register("work", seen.append)
+    job_id = add_job(queue, payload={"email_id": 7})
+
+    assert run_due(queue)
+
+    assert seen == [{"email_id": 7}]
+    assert job_row(queue, job_id)["status"] == DONE
+    assert queue.counters["succeeded"] == 1
+
+
+def test_failures_retry_with_exponential_backoff(queue):
+    def flaky(payload):
+        raise RuntimeError("backend down")
+    queue.register("work", flaky)
+    job_id = add_job(queue)
+
+    delays = []
+    for _ in range(2):
+        before = time.time()
+        assert run_due(queue)
+        row = job_row(queue, job_id)
+        assert row["status"] == QUEUED
+        assert row["last_error"] == "RuntimeError: backend down"
+        delays.append(row["run_after"] - before)
+        assert not run_due(queue)  # not due until the backoff passes
+        make_due(queue, job_id)
+
+    assert delays[0] == pytest.approx(2.0, abs=0.5)
+    assert delays[1] == pytest.approx(4.0, abs=0.5)
+    assert queue.counters["retried"] == 2
+
+
+def test_backoff_is_capped(queue):
+    queue.base_delay = 10.0
+    queue.register("work", lambda payload: 1 / 0)
+    job_id = add_job(queue)
+
+    before = time.time()
+    run_due(queue)
+
+    assert job_row(queue, job_id)["run_after"] - before == pytest.approx(5.0, abs=0.5)
+
+
+def test_dead_letter_after_max_attempts(queue):
+    dead = []
+    queue.register("work", lambda payload: 1 / 0, on_dead=lambda payload, error: dead.append((payload, error)))
+    job_id = add_job(queue, payload={"email_id": 3})
+
+    for _ in range(3):
+        make_due(queue, job_id)
+        assert run_due(queue)
+
+    row = job_row(queue, job_id)
+    assert (row["status"], row["attempts"]) == (DEAD, 3)
+    assert dead == [({"email_id": 3}, "ZeroDivisionError: division by zero")]
+    assert not run_due(queue)
+
+
+def test_permanent_error_skips_retries(queue):
+    def reject(payload):
+        raise PermanentJobError("email was deleted")
+    queue.register("work", reject)
+    job_id = add_job(queue)
+
+    run_due(queue)
+
+    assert job_row(queue, job_id)["status"] == DEAD
+    assert queue.counters == {"succeeded": 0, "retried": 0, "dead": 1}
+
+
+def test_queue_only_claims_its_kinds(queue):
+    queue.kinds = ("deliver",)
+    queue.register("work", lambda payload: None)
+    add_job(queue, kind="work")
+
+    assert not run_due(queue)
+
+
+def test_worker_survives_database_errors(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    queue = JobQueue(path, workers=1, poll_interval=0.05)
+    done = threading.Event()
+    queue.register("work", lambda payload: done.set())
+    queue.start()
+    try:
+        time.sleep(0.2)  # every claim fails: the jobs table does not exist yet
+        conn = sqlite3.connect(path)
+        init_jobs_table(conn)
+        enqueue(conn, "work", {})
+        conn.commit()
+        conn.close()
+
+        assert done.wait(5)
+    finally:
+        queue.stop()
@@ -0,0 +1,136 @@
+import json
+import threading
+
+import pytest
+
+from backend import llama_utils
+from backend.llm_cache import LLMCache
+
+
+class ScriptedBackend:
+    """Answers each prompt kind with a canned reply and records which kinds were asked."""
+    name = "scripted"
+    uses_rate_limits = False
+    model_name = "scripted"
+
+    def __init__(self, replies):
+        self.replies = replies
+        self.asked = []
+
+    def complete(self, prompt: str, max_tokens=64, json_mode=False) -> str:
+        kind = ("analysis" if "email analyzer" in prompt else "tone" if "tone classifier" in prompt
+                else "spam" if "spam, phishing, and scam detector" in prompt else "summary")
+        self.asked.append(kind)
+        reply = self.replies.get(kind, "")
+        return reply(prompt) if callable(reply) else reply
+
+    def last_usage(self):
+        return None
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "calls": len(self.asked)}
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    """Installs a ScriptedBackend with an empty in-memory cache and the pre-filter off."""
+    monkeypatch.setattr(llama_utils, "cache", LLMCache(db_path=None))
+    monkeypatch.setattr(llama_utils, "PREFILTER_ENABLED", False)
+
+    def install(**replies):
+        backend = ScriptedBackend(replies)
+        monkeypatch.setattr(llama_utils, "llm_backend", backend)
+        return backend
+    return install
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ('{"tone": "polite", "spam": "no", "summary": "Hi"}', {"tone": "polite", "spam": "no", "summary": "Hi"}),
+    ('Sure! ```json\n{"tone": "urgent", "spam": true}\n```', {"tone": "urgent", "spam": True}),
+    ('["polite"]', None),
+    ("no json here", None),
+    ('{"tone": "polite"', None),
+    ("", None),
+    (None, None),
+])
+def test_parse_analysis(raw, expected):
+    assert llama_utils._parse_analysis(raw) == expected
+
+
+def test_parse_fields():
+    assert llama_utils._parse_tone("Polite and FORMAL") == "polite, formal"
+    assert llama_utils._parse_tone("cheerful") is None
+    assert llama_utils._parse_tone(3) is None
+    assert llama_utils._parse_spam(" Yes ") is True
+    assert llama_utils._parse_spam(False) is False
+    assert llama_utils._parse_spam("maybe") is None
+
+
+def test_analyze_email_uses_one_call_when_valid(llm):
+    backend = llm(analysis=json.dumps({"tone": "friendly", "spam": "no", "summary": "Lunch on Friday."}))
+
+    result = llama_utils.analyze_email("Want to grab lunch on Friday?")
+
+    assert result == {"tone": "friendly", "is_spam": False, "summary": "Lunch on Friday.", "label_source": "llm"}
+    assert backend.asked == ["analysis"]
+
+
+def test_analyze_email_falls_back_per_invalid_field(llm):
+    backend = llm(analysis=json.dumps({"tone": "cheerful", "spam": "yes", "summary": "Invoice attached."}),
+                  tone="formal")
+
+    result = llama_utils.analyze_email("Please find the invoice attached.")
+
+    assert result["tone"] == "formal"
+    assert result["is_spam"] is True
+    assert result["summary"] == "Invoice attached."
+    assert backend.asked == ["analysis", "tone"]
+
+
+def test_analyze_email_falls_back_for_every_field_on_garbage(llm):
+    backend = llm(analysis="I cannot help with that.", tone="urgent", spam="no", summary="Server is down.")
+
+    result = llama_utils.analyze_email("The server is down, please call me.")
+
+    assert result == {"tone": "urgent", "is_spam": False, "summary": "Server is down.", "label_source": "llm"}
+    assert backend.asked == ["analysis", "tone", "spam", "summary"]
+
+
+def test_batch_keeps_input_order_and_dedupes():
+    calls = []
+    lock = threading.Lock()
+
+    def shout(text):
+        with lock:
+            calls.append(text)
+        return text.strip().upper()
+
+    texts = ["b", "a", "  b ", "c", "a"]
+    assert llama_utils._run_batch(shout, texts, concurrency=4) == ["B", "A", "B", "C", "A"]
+    assert sorted(calls) == ["a", "b", "c"]  # whitespace variants share one call
+    assert llama_utils._run_batch(shout, []) == []
+
+
+def test_tone_batch_matches_single_calls(llm):
+    tones = {"Thanks a lot!": "appreciative", "Do it now.": "demanding", "See attached.": "neutral"}
+    backend = llm(tone=lambda prompt: next(tone for text, tone in tones.items() if text in prompt))
+
+    texts = ["Do it now.", "Thanks a lot!", "Do it now.", "See attached."]
+    result = llama_utils.classify_email_tone_batch(texts, concurrency=3)
+
+    assert result == ["demanding", "appreciative", "demanding", "neutral"]
+    assert backend.asked.count("tone") == 3
+
+
+def test_batch_checked_flags_failed_texts(llm, monkeypatch):
+    class Failing(ScriptedBackend):
+        def complete(self, prompt, max_tokens=64, json_mode=False):
+            if "broken" in prompt:
+                raise RuntimeError("upstream error")
+            return super().complete(prompt, max_tokens, json_mode)
+
+    monkeypatch.setattr(llama_utils, "llm_backend", Failing({"spam": "no"}))
+
+    result = llama_utils.run_batch_checked(llama_utils.detect_spam, ["hello there", "broken message"], concurrency=2)
+
+    assert result == [(False, False), (False, True)]
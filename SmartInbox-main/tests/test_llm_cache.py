@@ -0,0 +1,111 @@
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+
+from backend import llm_cache
+from backend.llm_cache import LLMCache, make_key
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A settable llm_cache.time.time()."""
+    now = SimpleNamespace(value=1_000_000.0)
+    monkeypatch.setattr(llm_cache, "time", SimpleNamespace(time=lambda: now.value))
+    return now
+
+
+def disk_keys(path):
+    conn = sqlite3.connect(path)
+    keys = {row[0] for row in conn.execute("SELECT key FROM llm_cache")}
+    conn.close()
+    return keys
+
+
+def test_key_ignores_whitespace_and_normalization():
+    assert make_key("m", "tone", "Hello   there\n", 16) == make_key("m", "tone", " Hello there", 16)
+    assert make_key("m", "tone", "caf\u00e9", 16) == make_key("m", "tone", "cafe\u0301", 16)
+
+
+def test_key_separates_model_task_and_budget():
+    keys = {
+        make_key("m", "tone", "hi", 16),
+        make_key("other", "tone", "hi", 16),
+        make_key("m", "spam", "hi", 16),
+        make_key("m", "tone", "hi", 32),
+        make_key("m", "tone", "Hi", 16),
+    }
+    assert len(keys) == 5
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LLMCache(max_entries=2, db_path=None)
+    cache.set("a", "m", "tone", "polite")
+    cache.set("b", "m", "tone", "urgent")
+    assert cache.get("a") == "polite"  # b is now the oldest
+
+    cache.set("c", "m", "tone", "formal")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "polite"
+    assert cache.get("c") == "formal"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = LLMCache(ttl=60, db_path=None)
+    cache.set("a", "m", "tone", "polite")
+
+    clock.value += 59
+    assert cache.get("a") == "polite"
+    clock.value += 2
+    assert cache.get("a") is None
+    assert cache.stats()["expired"] == 1
+
+
+def test_disk_tier_survives_restart_until_ttl(tmp_path, clock):
+    path = str(tmp_path / "cache.db")
+    LLMCache(ttl=60, db_path=path).set("a", "m", "summary", {"text": "hi"})
+
+    restarted = LLMCache(ttl=60, db_path=path)
+    assert restarted.get("a") == {"text": "hi"}
+    assert restarted.stats()["disk_hits"] == 1
+
+    clock.value += 61
+    assert LLMCache(ttl=60, db_path=path).get("a") is None
+
+
+def test_invalidate_by_model(tmp_path):
+    cache = LLMCache(db_path=str(tmp_path / "cache.db"))
+    cache.set("a", "old", "tone", "polite")
+    cache.set("b", "new", "tone", "urgent")
+
+    assert cache.invalidate("old") == 1
+    assert cache.get("a") is None
+    assert cache.get("b") == "urgent"
+
+
+def test_purge_drops_expired_then_oldest_rows(tmp_path, clock):
+    path = str(tmp_path / "cache.db")
+    cache = LLMCache(ttl=60, db_path=path, disk_max_rows=2, purge_interval=3600)
+    cache.set("expired", "m", "tone", "polite")
+    clock.value += 61
+    for key in ("old", "mid", "new"):
+        clock.value += 1
+        cache.set(key, "m", "tone", "urgent")
+    assert len(disk_keys(path)) == 4  # not yet due
+
+    assert cache.purge() == 2
+    assert disk_keys(path) == {"mid", "new"}
+    assert cache.stats()["purged"] == 2
+
+
+def test_store_purges_once_interval_passes(tmp_path, clock):
+    path = str(tmp_path / "cache.db")
+    cache = LLMCache(ttl=60, db_path=path, purge_interval=300)
+    cache.set("a", "m", "tone", "polite")
+
+    clock.value += 301
+    cache.set("b", "m", "tone", "urgent")
+
+    assert disk_keys(path) == {"b"}
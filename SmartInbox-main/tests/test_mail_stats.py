@@ -0,0 +1,76 @@
+from backend import mail_stats
+from backend.llama_utils import TONES
+
+
+def add_mail(conn, tone=None, is_spam=0, sent_at="2026-01-05 09:00:00"):
+    return conn.execute("INSERT INTO emails (sender_id, recipient_email, subject, body, sent_at, tone, is_spam) "
+                        "VALUES (1, 'bob@sbox.com', 'Hi', 'hello', ?, ?, ?)", (sent_at, tone, is_spam)).lastrowid
+
+
+def counters(conn):
+    days = {row[0]: tuple(row[1:]) for row in conn.execute(
+        "SELECT day, total, spam, opened FROM mail_daily WHERE source = 'internal' AND total != 0")}
+    return mail_stats.totals(conn)["internal"], days, mail_stats.tone_tally(conn, TONES)
+
+
+def test_counters_follow_insert_update_and_delete(db):
+    conn = db.connection()
+    first = add_mail(conn, tone="polite, formal")
+    second = add_mail(conn, tone="Urgent", is_spam=1, sent_at="2026-01-06 10:00:00")
+    conn.commit()
+
+    total, days, tones = counters(conn)
+    assert total == {"total": 2, "spam": 1, "opened": 0}
+    assert days == {"2026-01-05": (1, 0, 0), "2026-01-06": (1, 1, 0)}
+    assert tones == {"polite": 1, "formal": 1, "urgent": 1}
+
+    conn.execute("UPDATE emails SET opened_at = CURRENT_TIMESTAMP, tone = 'polite', is_spam = 1, "
+                 "sent_at = '2026-01-06 08:00:00' WHERE id = ?", (first,))
+    conn.commit()
+
+    total, days, tones = counters(conn)
+    assert total == {"total": 2, "spam": 2, "opened": 1}
+    assert days == {"2026-01-06": (2, 2, 1)}
+    assert tones == {"polite": 1, "urgent": 1}
+
+    conn.execute("DELETE FROM emails WHERE id = ?", (second,))
+    conn.commit()
+
+    total, days, tones = counters(conn)
+    assert total == {"total": 1, "spam": 1, "opened": 1}
+    assert days == {"2026-01-06": (1, 1, 1)}
+    assert tones == {"polite": 1}
+    conn.close()
+
+
+def test_tally_splits_multi_tone_labels_and_drops_unknown():
+    assert mail_stats.split_tones("Polite,  FORMAL, cheerful", TONES) == ["polite", "formal"]
+    assert mail_stats.split_tones(None, TONES) == []
+
+
+def test_unrelated_updates_leave_counters_alone(db):
+    conn = db.connection()
+    email_id = add_mail(conn, tone="angry, demanding")
+    conn.execute("UPDATE emails SET summary = 'complaint', subject = 'Re: Hi' WHERE id = ?", (email_id,))
+    conn.commit()
+
+    assert mail_stats.tone_tally(conn, TONES) == {"angry": 1, "demanding": 1}
+    assert mail_stats.totals(conn)["internal"]["total"] == 1
+    conn.close()
+
+
+def test_rebuild_matches_triggers(db):
+    conn = db.connection()
+    for tone, is_spam in (("polite", 0), ("polite, urgent", 1), (None, 0)):
+        add_mail(conn, tone=tone, is_spam=is_spam)
+    conn.execute("INSERT INTO external_emails (sender_id, sender_name, recipient_email, subject, body, tone, is_spam) "
+                 "VALUES (1, 'Alice', 'carol@example.com', 'Hi', 'hello', 'friendly', 0)")
+    conn.commit()
+    before = mail_stats.totals(conn), mail_stats.tone_tally(conn, TONES)
+
+    mail_stats.rebuild(conn)
+    conn.commit()
+
+    assert (mail_stats.totals(conn), mail_stats.tone_tally(conn, TONES)) == before
+    assert before[1] == {"polite": 2, "urgent": 1, "friendly": 1}
+    conn.close()
@@ -0,0 +1,82 @@
+import pytest
+
+from backend import mailbox
+
+TIES = "2026-01-05 09:00:00"
+
+
+def add_mail(conn, table, sent_at, subject):
+    if table == "emails":
+        conn.execute("INSERT INTO emails (sender_id, recipient_email, subject, body, sent_at) VALUES (1, 'bob@sbox.com', ?, 'hi', ?)",
+                     (subject, sent_at))
+    else:
+        conn.execute("INSERT INTO external_emails (sender_id, sender_name, recipient_email, subject, body, sent_at) "
+                     "VALUES (1, 'Alice', 'carol@example.com', ?, 'hi', ?)", (subject, sent_at))
+
+
+def all_pages(fetch, limit):
+    rows, cursor = [], None
+    while True:
+        page, cursor = fetch(cursor, limit)
+        rows.extend(page)
+        if cursor is None:
+            return rows
+
+
+@pytest.fixture
+def conn(db):
+    conn = db.connection()
+    add_mail(conn, "emails", "2026-01-06 10:00:00", "newest")
+    for n in range(5):
+        add_mail(conn, "emails", TIES, f"tie {n}")
+        add_mail(conn, "external_emails", TIES, f"external tie {n}")
+    add_mail(conn, "emails", "2026-01-04 08:00:00", "oldest")
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 50])
+def test_inbox_pages_cover_ties_once_in_order(conn, limit):
+    rows = all_pages(lambda cursor, n: mailbox.inbox_page(conn, "bob@sbox.com", cursor, n), limit)
+
+    subjects = [row["subject"] for row in rows]
+    assert subjects == ["newest"] + [f"tie {n}" for n in reversed(range(5))] + ["oldest"]
+
+
+@pytest.mark.parametrize("limit", [1, 2, 4])
+def test_sent_pages_merge_sources_across_ties(conn, limit):
+    rows = all_pages(lambda cursor, n: mailbox.sent_page(conn, 1, cursor, n), limit)
+
+    keys = [(row["sort_sent_at"], row["source"], row["id"]) for row in rows]
+    assert keys == sorted(keys, reverse=True)
+    assert len(set(keys)) == len(keys) == 12
+    # At one timestamp internal mail sorts before external
+    assert [row["source"] for row in rows[1:11]] == [mailbox.INTERNAL] * 5 + [mailbox.EXTERNAL] * 5
+
+
+def test_cursor_is_stable_when_mail_arrives(conn):
+    first, cursor = mailbox.inbox_page(conn, "bob@sbox.com", limit=3)
+    add_mail(conn, "emails", TIES, "late tie")
+    add_mail(conn, "emails", "2026-01-07 00:00:00", "brand new")
+    conn.commit()
+
+    rest = all_pages(lambda c, n: mailbox.inbox_page(conn, "bob@sbox.com", c or cursor, n), 3)
+
+    # Newer mail sorts before the cursor, so the next pages neither repeat nor skip rows
+    assert [row["subject"] for row in first + rest] == ["newest", "tie 4", "tie 3", "tie 2", "tie 1", "tie 0", "oldest"]
+
+
+def test_admin_page_pages_one_source(conn):
+    rows = all_pages(lambda cursor, n: mailbox.admin_page(conn, "external", cursor, n), 2)
+
+    assert [row["subject"] for row in rows] == [f"external tie {n}" for n in reversed(range(5))]
+
+
+def test_cursor_round_trip_and_rejects_garbage():
+    row = {"sort_sent_at": TIES, "source": mailbox.INTERNAL, "id": 42}
+    assert mailbox.decode_cursor(mailbox.encode_cursor(row)) == (TIES, mailbox.INTERNAL, 42)
+    assert mailbox.decode_cursor("") is None
+    for cursor in ("not-a-cursor", "WzEsMl0"):  # the second is valid base64 of [1,2]
+        with pytest.raises(ValueError):
+            mailbox.decode_cursor(cursor)
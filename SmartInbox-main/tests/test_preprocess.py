@@ -0,0 +1,80 @@
+import pytest
+
+from backend import preprocess
+from backend.metrics import estimate_tokens
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Sounds good.\n\nOn Mon, Jan 5, 2026 at 9:00 AM Bob <bob@sbox.com> wrote:\n> Lunch?\n> Bob", "Sounds good."),
+    ("Approved.\n\n-----Original Message-----\nFrom: Bob\nSubject: PO", "Approved."),
+    ("Yes, see below\n> quoted line\nThanks", "Yes, see below\nThanks"),
+    ("Call me.\n-- \nAlice Smith\nHead of Sales", "Call me."),
+    ("On my way\n\nSent from my iPhone", "On my way"),
+    ("Numbers attached.\n\nCONFIDENTIALITY NOTICE: this message is private\nand for the addressee only.",
+     "Numbers attached."),
+    ("Lots   of\t\tspace\r\n\r\n\r\n\r\nand lines  ", "Lots of space\n\nand lines"),
+    ("Click here to unsubscribe", "Click here to unsubscribe"),
+    ("", ""),
+    (None, ""),
+])
+def test_clean_email_keeps_only_the_new_text(text, expected):
+    assert preprocess.clean_email(text) == expected
+
+
+def test_clean_email_keeps_a_bare_forward():
+    # Nothing above the quote: the quote is the message
+    assert preprocess.clean_email("> forwarded text\n> second line") == "> forwarded text\n> second line"
+
+
+def test_head_tail_leaves_short_text_alone():
+    text = "short message"
+    assert preprocess.head_tail(text, 100) is text
+
+
+def test_head_tail_keeps_both_ends_within_budget():
+    words = [f"word{n}" for n in range(2000)]
+    text = " ".join(words)
+
+    fitted = preprocess.head_tail(text, 100)
+
+    assert len(fitted) <= 100 * preprocess.CHARS_PER_TOKEN
+    head, tail = fitted.split(preprocess.ELLIPSIS)
+    assert text.startswith(head) and text.endswith(tail)
+    assert len(head) > len(tail)  # two thirds from the start
+    # Cut on word boundaries
+    assert set(head.split()) <= set(words) and set(tail.split()) <= set(words)
+
+
+def test_fit_respects_each_task_budget():
+    text = "Please review the attached budget. " * 2000
+    for task, budget in preprocess.BUDGETS.items():
+        fitted = preprocess.fit(task, text)
+        assert estimate_tokens(fitted) <= budget + 1
+        assert not preprocess.over_budget(task, fitted)
+    assert preprocess.over_budget("tone", text)
+
+
+def test_needs_chunking_uses_the_cleaned_text():
+    budget = preprocess.BUDGETS["summary"] * preprocess.CHARS_PER_TOKEN
+    quoted = "Thanks!\n" + "> old thread line\n" * (budget // 10)
+
+    assert not preprocess.needs_chunking("Thanks!")
+    assert not preprocess.needs_chunking(quoted)  # long only because of the quoted thread
+    assert preprocess.needs_chunking("word " * budget)
+
+
+def test_summary_chunks_stay_under_budget_and_count():
+    text = "\n\n".join(f"Paragraph {n}: " + "details " * 150 for n in range(200))
+
+    pieces = preprocess.summary_chunks(text)
+
+    assert 1 < len(pieces) <= preprocess.MAX_SUMMARY_CHUNKS
+    assert all(not preprocess.over_budget("summary", piece) for piece in pieces)
+    # Head and tail sampled: the opening and the last paragraph both reach the summarizer
+    assert pieces[0].startswith("Paragraph 0:")
+    assert "Paragraph 199:" in pieces[-1]
+
+
+def test_compact_rewrite_refuses_over_budget_drafts():
+    assert preprocess.compact_rewrite("Hi  Bob,\n\n\n> your note\n-- \nAlice") == "Hi Bob,\n\n> your note\n--\nAlice"
+    assert preprocess.compact_rewrite("word " * (preprocess.BUDGETS["rewrite"] * 4)) is None
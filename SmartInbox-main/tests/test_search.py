@@ -0,0 +1,81 @@
+import pytest
+
+from backend import search
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("budget report", '"budget" "report"'),
+    ('"quarterly budget" review', '"quarterly budget" "review"'),
+    ("budg*", '"budg"*'),
+    ('NEAR(a b) OR subject:x "unclosed', '"NEAR a" "b" "OR" "subject x" "unclosed"'),
+    ("don't", '"don t"'),
+    ("*** -- ()", None),
+    ("", None),
+    (None, None),
+])
+def test_to_match_quotes_every_term(query, expected):
+    assert search.to_match(query) == expected
+
+
+@pytest.fixture
+def conn(db):
+    conn = db.connection()
+    if not search.available(conn):
+        pytest.skip("SQLite built without FTS5")
+    conn.execute("INSERT INTO users (email, password_hash) VALUES ('bob@sbox.com', 'x')")
+    yield conn
+    conn.close()
+
+
+def add_mail(conn, subject, body, recipient="bob@sbox.com", sent_at="2026-01-05 09:00:00", sender_id=1):
+    return conn.execute("INSERT INTO emails (sender_id, recipient_email, subject, body, sent_at) VALUES (?, ?, ?, ?, ?)",
+                        (sender_id, recipient, subject, body, sent_at)).lastrowid
+
+
+def test_subject_matches_rank_above_body_matches(conn):
+    in_body = add_mail(conn, "Hello", "the invoice is attached, along with other paperwork")
+    in_subject = add_mail(conn, "Invoice", "see attached")
+    conn.commit()
+
+    rows, cursor = search.search(conn, "invoice", box="all")
+
+    assert [row["id"] for row in rows] == [in_subject, in_body]
+    assert cursor is None
+    assert "<mark>" in rows[0]["snippet_html"]
+
+
+def test_cursor_pages_through_tied_scores(conn):
+    ids = [add_mail(conn, "Standup", "daily standup notes") for _ in range(5)]
+    conn.execute("INSERT INTO external_emails (sender_id, sender_name, recipient_email, subject, body) "
+                 "VALUES (1, 'Alice', 'carol@example.com', 'Standup', 'daily standup notes')")
+    conn.commit()
+
+    seen, cursor = [], None
+    while True:
+        rows, cursor = search.search(conn, "standup", box="all", cursor=cursor, limit=2)
+        seen += [(row["source"], row["id"]) for row in rows]
+        if cursor is None:
+            break
+
+    assert len(seen) == len(set(seen)) == 6
+    assert sorted(email_id for source, email_id in seen if source == "Internal") == ids
+
+
+def test_boxes_and_inclusive_date_filter(conn):
+    to_bob = add_mail(conn, "Offsite", "plan", sent_at="2026-01-05 23:30:00")
+    add_mail(conn, "Offsite", "plan", recipient="carol@sbox.com", sent_at="2026-01-06 08:00:00")
+    conn.commit()
+
+    inbox, _ = search.search(conn, "offsite", box="inbox", user_id=2, user_email="bob@sbox.com")
+    assert [row["id"] for row in inbox] == [to_bob]
+    sent, _ = search.search(conn, "offsite", box="sent", user_id=1)
+    assert len(sent) == 2
+    dated, _ = search.search(conn, "offsite", box="all", filters={"date_from": "2026-01-05", "date_to": "2026-01-05"})
+    assert [row["id"] for row in dated] == [to_bob]
+
+
+def test_bad_queries_and_cursors_raise(conn):
+    with pytest.raises(ValueError):
+        search.search(conn, "   ", box="all")
+    with pytest.raises(ValueError):
+        search.search(conn, "plan", box="all", cursor="garbage")
@@ -0,0 +1,17 @@
+"""
+WSGI entry point for production servers. Apply migrations once per deploy,
+then start the workers:
+
+    flask --app app migrate
+    gunicorn -k gthread -w 1 --threads 64 wsgi:app
+
+One process, because the event hub and job workers live in it. Use threads,
+not gevent: its monkey-patching turns the bcrypt executor, the job workers
+and the local LLM thread into greenlets, and their CPU-bound calls would
+then stall every request. Each open /events stream holds one of the
+--threads; set SBOX_EVENT_PORT to serve it from the asyncio event server
+instead (see backend/event_server.py).
+"""
+from app import create_app
+
+app = create_app()